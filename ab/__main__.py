@@ -5,13 +5,61 @@ Gitee: https://gitee.com/walkline/a-batch-tool
 """
 from optparse import OptionParser
 from serial.tools.list_ports import comports
+import serial
 import os
 import shutil, tempfile
+import base64
+import hashlib
+import json
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 try:
-	from pyboard import Pyboard, stdout_write_bytes
+	from pyboard import Pyboard, PyboardError
 except ModuleNotFoundError:
-	from .pyboard import Pyboard, stdout_write_bytes
+	from .pyboard import Pyboard, PyboardError
+
+try:
+	from mpy import MpyCompiler, MpyCrossError
+except ModuleNotFoundError:
+	from .mpy import MpyCompiler, MpyCrossError
+
+try:
+	from minify import Minifier
+except ModuleNotFoundError:
+	from .minify import Minifier
+
+try:
+	import port_daemon
+except ModuleNotFoundError:
+	from . import port_daemon
+
+try:
+	from watch import create_watcher
+except ModuleNotFoundError:
+	from .watch import create_watcher
+
+try:
+	import trace_events
+except ModuleNotFoundError:
+	from . import trace_events
+
+try:
+	import board_fs
+except ModuleNotFoundError:
+	from . import board_fs
+
+try:
+	from capture import SessionCapture
+except ModuleNotFoundError:
+	from .capture import SessionCapture
+
+try:
+	from protocol_webrepl import PASSWORD_ENV
+except ModuleNotFoundError:
+	from .protocol_webrepl import PASSWORD_ENV
 
 try:
 	from __init__ import __version__
@@ -20,8 +68,16 @@ except ModuleNotFoundError:
 
 
 DEFAULT_CONFIG_FILE = 'abconfig'
+DEFAULT_BAUDRATE = 115200
+MANIFEST_FILE = '.ab_manifest'
+MANIFEST_VERSION = 1
 EXCLUDE_PREFIX = '#'
 RUN_AFTER_UPLOAD_PREFIX = '!'
+TRANSFER_MODES = ['base64', 'repr', 'stream', 'bundle']
+TRANSFER_CHUNK_SIZES = {
+	'repr': 256,
+	'base64': 1536
+}
 
 CMD_MKDIRS = \
 '''
@@ -37,55 +93,330 @@ for dir in {}:
       print(ose)
 '''
 
+CMD_HASH_FILES = \
+'''
+import binascii, hashlib, os
+buf = bytearray(512)
+for path, size in {}:
+  try:
+    if os.stat(path)[6] != size:
+      raise OSError
+    f = open(path, 'rb')
+  except OSError:
+    print('-')
+    continue
+  sha256 = hashlib.sha256()
+  while True:
+    n = f.readinto(buf)
+    if not n:
+      break
+    sha256.update(memoryview(buf)[:n])
+  f.close()
+  print(binascii.hexlify(sha256.digest()).decode())
+'''
+
+CMD_STAT_FILES = \
+'''
+import os
+for path, size in {}:
+  try:
+    print(int(os.stat(path)[6] == size))
+  except OSError:
+    print(0)
+'''
+
+CMD_REMOVE_FILES = \
+'''
+import os
+for file in {}:
+  try:
+    os.remove(file)
+    if not {}:
+      print('- removed {{}}'.format(file))
+  except OSError:
+    pass
+'''
+
+CMD_REMOVE_DIRS = \
+'''
+import os
+for dir in {}:
+  try:
+    os.rmdir(dir)
+    if not {}:
+      print('- removed {{}}/'.format(dir))
+  except OSError:
+    pass
+'''
+
+CMD_READ_MANIFEST = \
+'''
+try:
+  f = open({!r})
+  while True:
+    d = f.read(256)
+    if not d:
+      break
+    print(d, end='')
+  f.close()
+except OSError:
+  pass
+'''
+
+CMD_RENAME_MANIFEST = \
+'''
+import os
+os.rename({0!r} + '.tmp', {0!r})
+'''
+
 parser = None
 
-def list_all_files_and_dirs(includes, excludes):
-	dir_list = []
-	file_list = []
-	bad_list = []
+GLOB_CHARS = re.compile(r'[*?[]')
 
-	for include in includes:
-		if not os.path.exists(include):
-			bad_list.append(include)
+def is_pattern(path):
+	return GLOB_CHARS.search(path) is not None
+
+def compile_pattern(pattern, match_contents=True):
+	'''
+	把 gitignore 风格的匹配规则编译为正则表达式，match_contents 为 True 时同时匹配文件夹下的所有内容：
+	不含通配符的规则是相对于项目根目录的路径；不含 / 的通配符规则匹配任意层级的文件或文件夹名；
+	** 匹配任意层级的文件夹，* 和 ? 不匹配 /
+	'''
+	pattern = pattern.replace('\\', '/').strip('/')
+	regex = ''
+	index = 0
+
+	while index < len(pattern):
+		if pattern.startswith('**/', index):
+			regex += '(?:.*/)?'
+			index += 3
+		elif pattern.startswith('**', index):
+			regex += '.*'
+			index += 2
+		elif pattern[index] == '*':
+			regex += '[^/]*'
+			index += 1
+		elif pattern[index] == '?':
+			regex += '[^/]'
+			index += 1
+		elif pattern[index] == '[' and ']' in pattern[index + 2:]:
+			end = pattern.index(']', index + 2)
+			chars = pattern[index + 1:end]
+			regex += '[' + ('^' + chars[1:] if chars.startswith('!') else chars) + ']'
+			index = end + 1
+		else:
+			regex += re.escape(pattern[index])
+			index += 1
+
+	if is_pattern(pattern) and '/' not in pattern:
+		regex = '(?:.*/)?' + regex
+
+	return re.compile(regex + '(?:/.*)?' if match_contents else regex)
+
+def compile_excludes(excludes):
+	'''
+	把所有排除规则合并为一个正则表达式，返回判断路径是否被排除的函数
+	'''
+	if not excludes:
+		return lambda path: False
+
+	regex = re.compile('|'.join([f'(?:{compile_pattern(exclude).pattern})' for exclude in excludes]))
+
+	return lambda path: regex.fullmatch(path) is not None
+
+def walk_files(root, is_excluded, pattern=None):
+	'''
+	使用 os.scandir 遍历文件夹，跳过被排除的文件夹，逐个返回文件路径
+	'''
+	stack = [root]
+
+	while stack:
+		dir = stack.pop()
+
+		try:
+			entries = sorted(os.scandir(dir or '.'), key=lambda entry: entry.name, reverse=True)
+		except OSError:
 			continue
 
-		if os.path.isdir(include):
-			for root, _, files in os.walk(include):
-				if root in excludes:
-					continue
+		subdirs = []
+
+		for entry in entries:
+			path = f'{dir}/{entry.name}' if dir else entry.name
+
+			if is_excluded(path):
+				continue
+
+			if entry.is_dir():
+				if not entry.is_symlink():
+					subdirs.append(path)
+			elif pattern is None or pattern.fullmatch(path):
+				yield path
+
+		stack.extend(subdirs)
+
+def iter_all_files(includes, excludes, bad_list=None):
+	'''
+	逐个返回 includes 中包含且没有被 excludes 排除的文件，不存在的项目添加到 bad_list 中，
+	include 可以是文件、文件夹或者通配符规则
+	'''
+	is_excluded = compile_excludes(excludes)
+
+	for include in includes:
+		include = include.replace('\\', '/')
+
+		if is_pattern(include):
+			parts = include.split('/')
+			prefix = []
+
+			while not is_pattern(parts[len(prefix)]):
+				prefix.append(parts[len(prefix)])
 
-				for file in files:
-					full_path = os.path.join(root, file)
+			root = '/'.join(prefix)
+			pattern = compile_pattern(include, match_contents=False)
+			found = False
 
-					if full_path not in excludes:
-						file_list.append(full_path)
+			if not root or os.path.isdir(root):
+				for path in walk_files(root, is_excluded, pattern):
+					found = True
+					yield path
+
+			if not found and bad_list is not None:
+				bad_list.append(include)
+		elif not os.path.exists(include):
+			if bad_list is not None:
+				bad_list.append(include)
+		elif is_excluded(include):
+			continue
+		elif os.path.isdir(include):
+			yield from walk_files(include if include != '.' else '', is_excluded)
 		else:
-			if include not in excludes:
-				file_list.append(include)
+			yield include
 
-	for file in file_list:
-		splited_path = os.path.split(file)[0].split(os.path.sep)
+def list_all_files_and_dirs(includes, excludes):
+	file_set = set()
+	dir_set = set()
+	bad_list = []
 
-		for index in range(len(splited_path) + 1):
-			full_path = os.path.sep.join(splited_path[:index])
+	for file in iter_all_files(includes, excludes, bad_list):
+		if file in file_set:
+			continue
 
-			if full_path not in dir_list and full_path:
-				dir_list.append(full_path)
+		file_set.add(file)
+		dir = file.rpartition('/')[0]
 
-	for items in [file_list, dir_list, bad_list]:
-		for index, item in enumerate(items):
-			items[index] = item.replace('\\', '/')
+		while dir and dir not in dir_set:
+			dir_set.add(dir)
+			dir = dir.rpartition('/')[0]
 
-	file_list.sort()
-	dir_list.sort()
+	file_list = sorted(file_set)
+	dir_list = sorted(dir_set)
 	bad_list.sort()
 
-	if 'main.py' in file_list:
+	if 'main.py' in file_set:
 		file_list.remove('main.py')
 		file_list.append('main.py')
 
 	return file_list, dir_list, bad_list
 
+def hash_file(filename):
+	sha256 = hashlib.sha256()
+
+	with open(filename, 'rb') as file:
+		for chunk in iter(lambda: file.read(4096), b''):
+			sha256.update(chunk)
+
+	return sha256.hexdigest()
+
+def read_manifest(pyboard):
+	'''
+	读取开发板上的清单文件，返回 {路径: [大小, sha256]}，清单文件不存在或无法解析时返回 None
+	'''
+	try:
+		manifest = json.loads(pyboard.exec(CMD_READ_MANIFEST.format(MANIFEST_FILE)).decode() or 'null')
+	except ValueError:
+		return None
+
+	if not isinstance(manifest, dict) or manifest.get('version') != MANIFEST_VERSION:
+		return None
+
+	files = manifest.get('files')
+
+	return files if isinstance(files, dict) else None
+
+def write_manifest(pyboard, files, transfer):
+	'''
+	先写入临时文件再重命名，保证开发板上的清单文件始终完整，
+	清单文件使用与其它文件相同的 transfer 方式上传，不会在开发板上编译一个很长的字符串
+	'''
+	content = json.dumps({'version': MANIFEST_VERSION, 'files': files}, separators=(',', ':'), sort_keys=True)
+
+	with tempfile.TemporaryDirectory(prefix='ab_') as temp_dir:
+		temp_file = os.path.join(temp_dir, MANIFEST_FILE)
+
+		with open(temp_file, 'w') as file:
+			file.write(content)
+
+		transfer_files(pyboard, [(temp_file, MANIFEST_FILE + '.tmp')], [], transfer)
+
+	pyboard.exec(CMD_RENAME_MANIFEST.format(MANIFEST_FILE))
+
+def get_changed_files(pyboard, uploads, manifest=None):
+	'''
+	对比本地文件与开发板上同路径文件的 sha256，返回需要上传的文件列表和跳过的字节数，
+	提供清单时与清单中记录的大小和 sha256 对比，不再读取开发板上的文件，
+	但文件可能在 ab 之外被删除或修改，所以仍在一次 exec 中检查每个文件在开发板上存在并且大小相同
+	'''
+	sizes = [os.path.getsize(src) for src, _ in uploads]
+	files = [(dest, size) for (_, dest), size in zip(uploads, sizes)]
+
+	if manifest is None:
+		board_hashes = pyboard.exec(CMD_HASH_FILES.format(files)).decode().split()
+	else:
+		stats = pyboard.exec(CMD_STAT_FILES.format(files)).decode().split()
+		entries = [manifest.get(dest) for _, dest in uploads]
+		board_hashes = [entry[1] if stat == '1' and entry and entry[0] == size else '-' for entry, size, stat in zip(entries, sizes, stats)]
+
+	if len(board_hashes) != len(uploads):
+		raise PyboardError('unexpected hash list from board')
+
+	changed = []
+	skipped_bytes = 0
+
+	for (src, dest), size, board_hash in zip(uploads, sizes, board_hashes):
+		if board_hash != '-' and board_hash == hash_file(src):
+			skipped_bytes += size
+		else:
+			changed.append((src, dest))
+
+	return changed, skipped_bytes
+
+def mirror_board(pyboard, manifest, uploads, include_dirs, options, log=print):
+	'''
+	删除清单中记录但不再需要上传的文件，以及因此变空的文件夹，只删除 ab 上传过的文件
+	'''
+	dests = set([dest for _, dest in uploads])
+	include_dirs = set(include_dirs)
+	stale_files = sorted([file for file in manifest if file not in dests])
+	stale_dirs = set()
+
+	for file in stale_files:
+		dir = file.rpartition('/')[0]
+
+		while dir and dir not in include_dirs:
+			stale_dirs.add(dir)
+			dir = dir.rpartition('/')[0]
+
+	if not options.quiet:
+		log(f'\nMirroring, {len(stale_files)} stale files on board')
+
+	if stale_files:
+		cmd = CMD_REMOVE_FILES.format(stale_files, options.quiet) + CMD_REMOVE_DIRS.format(sorted(stale_dirs, reverse=True), options.quiet)
+		for line in pyboard.exec(cmd).decode().splitlines():
+			log(line)
+
+	for file in stale_files:
+		del manifest[file]
+
 def choose_a_port():
 	port_list = []
 
@@ -134,7 +465,7 @@ def parse_config_file(config_file):
 	for line in lines:
 		if line:
 			if line.startswith(EXCLUDE_PREFIX):
-				excludes.append(os.path.normpath(line.strip(EXCLUDE_PREFIX + '/\\').strip()))
+				excludes.append(os.path.normpath(line.strip(EXCLUDE_PREFIX + '/\\').strip()).replace('\\', '/'))
 			elif line.startswith(RUN_AFTER_UPLOAD_PREFIX):
 				run_file_temp = os.path.normpath(line.strip(RUN_AFTER_UPLOAD_PREFIX + '/\\').strip())
 				includes.append(run_file_temp)
@@ -145,6 +476,542 @@ def parse_config_file(config_file):
 
 	return includes, excludes, run_file
 
+def minify_uploads(uploads, temp_dir, options):
+	minifier = Minifier()
+	minified_uploads = []
+
+	for src, dest in uploads:
+		if minifier.should_minify(dest):
+			staged_file = os.path.join(temp_dir, dest)
+
+			if not minifier.minify(src, staged_file) and not options.quiet:
+				print(f'\nMinify {dest} failed, upload it as is')
+
+			src = staged_file
+
+		minified_uploads.append((src, dest))
+
+	if not options.quiet and minifier.source_bytes:
+		print(f'\nMinified {minifier.hits + minifier.misses} files, {minifier.source_bytes} -> {minifier.minified_bytes} bytes ({minifier.minified_bytes / minifier.source_bytes:.0%})')
+		print(f'- {minifier.misses} minified, {minifier.hits} from cache')
+
+	return minified_uploads, minifier
+
+def compile_uploads(uploads, temp_dir, options):
+	compiler = MpyCompiler(options.mpy_args.split() if options.mpy_args else None)
+	compiled_uploads = []
+
+	for src, dest in uploads:
+		if compiler.should_compile(dest):
+			mpy_file = dest[:-3] + '.mpy'
+			staged_file = os.path.join(temp_dir, mpy_file)
+			os.makedirs(os.path.dirname(staged_file), exist_ok=True)
+
+			try:
+				src = compiler.compile(src, staged_file, dest)
+			except MpyCrossError as mce:
+				raise MpyCrossError(f'Compile {dest} failed\n{mce}')
+
+			dest = mpy_file
+
+		compiled_uploads.append((src, dest))
+
+	if not options.quiet:
+		print(f'\nCompiled with {compiler.version}')
+		print(f'- {compiler.misses} compiled, {compiler.hits} from cache')
+
+	return compiled_uploads, compiler
+
+def stage_uploads(files, temp_dir, options):
+	'''
+	按选项压缩、编译需要上传的文件，返回 (本地文件, 开发板路径) 列表和用到的缓存，编译失败时抛出 MpyCrossError
+	'''
+	uploads = [(file, file) for file in files]
+	caches = []
+
+	if options.minify:
+		uploads, minifier = minify_uploads(uploads, temp_dir, options)
+		caches.append(minifier.cache)
+
+	if options.mpy:
+		uploads, compiler = compile_uploads(uploads, temp_dir, options)
+		caches.append(compiler.cache)
+
+	return uploads, caches
+
+def upload_dest(file, options):
+	return file[:-3] + '.mpy' if options.mpy and MpyCompiler.should_compile(file) else file
+
+def get_ports(options):
+	if options.port:
+		return [port.strip() for port in options.port.split(',') if port.strip()]
+
+	if options.vid_pid:
+		vid, pid = [int(id, 16) for id in options.vid_pid.split(':')]
+		return sorted([port.device for port in comports() if port.vid == vid and port.pid == pid])
+
+	return [choose_a_port()]
+
+def open_board(port):
+	'''
+	串口有后台服务时通过服务使用已经打开的串口，否则直接打开串口
+	'''
+	if port_daemon.is_running(port):
+		return port_daemon.RemotePyboard(port)
+
+	return Pyboard(port)
+
+def daemon_command(options):
+	if options.daemon == 'run':
+		port_daemon.BoardDaemon(get_ports(options)[0]).serve_forever()
+	elif options.daemon == 'start':
+		for port in get_ports(options):
+			print(f'- {port}: {"started" if port_daemon.start(port) else "start failed"}')
+	else:
+		ports = get_ports(options) if options.port or options.vid_pid else port_daemon.list_running()
+
+		if not ports:
+			print('No daemon running')
+
+		for port in ports:
+			if options.daemon == 'stop':
+				print(f'- {port}: {"stopped" if port_daemon.stop(port) else "not running"}')
+			else:
+				print(f'- {port}: {"running" if port_daemon.is_running(port) else "not running"}')
+
+def fs_command(options, args):
+	'''
+	使用开发板文件系统索引显示 ls、tree 或 du 的结果，有缓存时不需要连接开发板
+	'''
+	port = get_ports(options)[0]
+	index = None if options.refresh else board_fs.load_index(port)
+	cached = index is not None
+
+	if index is None:
+		pyboard = open_board(port)
+
+		try:
+			pyboard.enter_raw_repl(soft_reset=False)
+
+			index = board_fs.BoardIndex.build(pyboard)
+			pyboard.exit_raw_repl()
+		finally:
+			pyboard.close()
+
+		board_fs.save_index(port, index)
+
+	try:
+		lines = board_fs.FORMATTERS[options.fs](index, args[0] if args else '/')
+	except ValueError as ve:
+		print(ve)
+		exit(1)
+
+	print('\n'.join(lines))
+
+	if cached and not options.quiet:
+		print(f'\n(index of {len(index.files)} files cached at {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(index.created))}, use --refresh to rebuild)')
+
+def transfer_files(pyboard, uploads, include_dirs, transfer, progress_callback=None, compress=False):
+	'''
+	按 transfer 指定的方式上传文件，返回实际发送的文件内容字节数
+	'''
+	if transfer == 'stream':
+		return pyboard.fs_put_files(uploads, progress_callback=progress_callback, compress=compress)
+
+	if transfer == 'bundle':
+		return pyboard.fs_put_bundle(include_dirs, uploads, progress_callback=progress_callback, compress=compress)
+
+	for index, (src, dest) in enumerate(uploads, start=1):
+		if progress_callback:
+			progress_callback(index, dest)
+
+		pyboard.fs_put(src, dest, chunk_size=TRANSFER_CHUNK_SIZES[transfer], encoding=transfer)
+
+	return sum([os.path.getsize(src) for src, _ in uploads])
+
+def put_files(pyboard, uploads, include_dirs, options, progress_callback=None, compress=None):
+	'''
+	按 options.transfer 指定的方式上传文件，compress 为 None 时使用 options.compress
+	'''
+	compress = options.compress if compress is None else compress
+
+	return transfer_files(pyboard, uploads, include_dirs, options.transfer, progress_callback, compress)
+
+def estimate_exec_path(pyboard, uploads):
+	'''
+	在开发板上测量一次空 exec 和一次完整 base64 数据块的 exec 的耗时，按原来逐个文件 exec 的方式
+	（新建文件夹，每个文件打开、逐块写入、关闭）估算上传同样的文件需要的时间，返回 (秒数, exec 次数)
+	'''
+	chunk_size = TRANSFER_CHUNK_SIZES['base64']
+
+	start_time = time.time()
+	pyboard.exec('pass')
+	empty_time = time.time() - start_time
+
+	start_time = time.time()
+	pyboard.exec('_=' + repr(base64.b64encode(bytes(chunk_size))))
+	chunk_time = time.time() - start_time
+
+	# one exec for the dirs, then open and close per file, the last chunk costs by its size
+	execs = 1
+	total_time = empty_time
+
+	for src, _ in uploads:
+		chunks, rest = divmod(os.path.getsize(src), chunk_size)
+		execs += 2 + chunks + (rest > 0)
+		total_time += 2 * empty_time + chunks * chunk_time
+
+		if rest:
+			total_time += empty_time + (chunk_time - empty_time) * rest / chunk_size
+
+	return total_time, execs
+
+def upload_to_board(port, uploads, include_dirs, options, log=print):
+	start_time = time.time()
+	trace_events.name_thread(port)
+	pyboard = open_board(port)
+	board_fs.invalidate(port)
+	finished = False
+
+	try:
+		# a soft reset closes the WebREPL connection
+		soft_reset = not options.no_reset and not port.startswith('webrepl://')
+		pyboard.enter_raw_repl(soft_reset=soft_reset)
+
+		if not options.quiet:
+			log(f'\nBoard ready in {time.time() - start_time:.2f}s ({"soft reset" if soft_reset else "no reset"})')
+
+		if options.baudrate:
+			if pyboard.set_baudrate(options.baudrate):
+				log(f'\nSwitched baudrate to {options.baudrate}')
+			else:
+				log(f'\nSwitch baudrate to {options.baudrate} failed, fall back to {DEFAULT_BAUDRATE}')
+
+		# the unpacker creates dirs itself in bundle mode
+		if options.transfer != 'bundle':
+			if not options.quiet:
+				log('\nMaking dirs on board...')
+
+			with trace_events.span('mkdirs', dirs=len(include_dirs)):
+				cmd = CMD_MKDIRS.format(include_dirs, options.quiet)
+				for line in pyboard.exec(cmd).decode().splitlines():
+					log(line)
+
+		# .py files shadow .mpy files of the same name on import, remove them
+		dests = [dest for _, dest in uploads]
+		stale_files = [dest[:-4] + '.py' for dest in dests if dest.endswith('.mpy') and dest[:-4] + '.py' not in dests]
+
+		if stale_files:
+			cmd = CMD_REMOVE_FILES.format(stale_files, options.quiet)
+			for line in pyboard.exec(cmd).decode().splitlines():
+				log(line)
+
+		with trace_events.span('read_manifest'):
+			manifest = read_manifest(pyboard)
+
+		if manifest:
+			for file in stale_files:
+				manifest.pop(file, None)
+
+		if options.mirror:
+			if manifest is None:
+				log(f'\nNo {MANIFEST_FILE} on board, nothing to mirror until the next upload')
+			else:
+				with trace_events.span('mirror'):
+					mirror_board(pyboard, manifest, uploads, include_dirs, options, log)
+
+		all_uploads = uploads
+
+		if options.sync:
+			try:
+				with trace_events.span('sync', files=len(uploads)):
+					changed_uploads, skipped_bytes = get_changed_files(pyboard, uploads, manifest)
+			except PyboardError as pe:
+				log(f'\nCompare files failed, upload all files\n{pe}')
+			else:
+				log(f'\nSkipped {len(uploads) - len(changed_uploads)} unchanged files ({skipped_bytes} bytes)')
+				uploads = changed_uploads
+
+		log('{}'.format('\nUpload files to board...' if not options.quiet else ''))
+
+		def show_progress(index, dest):
+			if not options.quiet:
+				log(f'- uploading {dest} ({index}/{len(uploads)})')
+
+		upload_bytes = sum([os.path.getsize(src) for src, _ in uploads])
+		start_time = time.time()
+
+		# options are shared by all boards, decide for this board only
+		compress = options.compress
+
+		if compress and not pyboard.fs_decompress_supported():
+			log('\nNo deflate or zlib module on board, upload without compression')
+			compress = False
+
+		with trace_events.span('put_files', bytes=upload_bytes, files=len(uploads), transfer=options.transfer) as span:
+			sent_bytes = put_files(pyboard, uploads, include_dirs, options, show_progress, compress)
+			span.set(sent=sent_bytes)
+
+		# writing the manifest may stream one more file
+		upload_acks = pyboard.stream_acks
+
+		upload_time = time.time() - start_time
+		upload_baudrate = pyboard.serial.baudrate
+
+		manifest = manifest or {}
+		manifest.update({dest: [os.path.getsize(src), hash_file(src)] for src, dest in all_uploads})
+
+		with trace_events.span('write_manifest'):
+			write_manifest(pyboard, manifest, options.transfer)
+
+		finished = True
+		log('\nUpload Finished')
+
+		if uploads:
+			rate = f'{upload_bytes / upload_time:.0f}' if upload_time else '-'
+			log(f'- {upload_bytes} bytes in {upload_time:.2f}s, {rate} bytes/s ({options.transfer})')
+
+			if compress and sent_bytes:
+				saved_time = (upload_bytes - sent_bytes) * upload_time / sent_bytes
+				log(f'- compressed to {sent_bytes} bytes ({upload_bytes / sent_bytes:.2f}x), saved about {saved_time:.2f}s')
+
+			if options.transfer in ('stream', 'bundle'):
+				if '://' in port or isinstance(pyboard, port_daemon.RemotePyboard):
+					# the baudrate says nothing about the time on a network or through the daemon
+					log(f'- {upload_time / len(uploads) * 1000:.1f}ms per file (no wire time estimate through {port.partition("://")[0] if "://" in port else "the daemon"}), {upload_acks / len(uploads):.2f} acks per file')
+				else:
+					# time spent beyond pushing the payload through the wire (10 bits per byte)
+					overhead = max(upload_time - sent_bytes * 10 / upload_baudrate, 0) / len(uploads)
+					log(f'- per-file overhead {overhead * 1000:.1f}ms, {upload_acks / len(uploads):.2f} acks per file')
+
+				# costs two more execs on the board, only when asked for
+				if options.stats:
+					try:
+						exec_time, execs = estimate_exec_path(pyboard, uploads)
+					except PyboardError:
+						pass
+					else:
+						log(f'- per-file exec path (base64) would take about {exec_time:.2f}s, {exec_time / len(uploads) * 1000:.1f}ms per file in {execs} execs (measured on this board)')
+
+				if options.transfer == 'bundle' and not compress:
+					block_size = pyboard.raw_paste_window or 256
+					stream_acks = sum([1 + -(-os.path.getsize(src) // block_size) for src, _ in uploads])
+					log(f'- stream mode would need {stream_acks / len(uploads):.2f} acks per file and one more exec to make dirs')
+	finally:
+		# a board left at the high rate can't be reached at 115200 until a hard reset
+		if pyboard.serial.baudrate != DEFAULT_BAUDRATE:
+			try:
+				if not finished:
+					# interrupt whatever the error left running on the board
+					pyboard.enter_raw_repl(soft_reset=False)
+
+				pyboard.set_baudrate(DEFAULT_BAUDRATE)
+			except (PyboardError, OSError) as e:
+				log(f'\nRestore baudrate to {DEFAULT_BAUDRATE} failed: {e}')
+
+		if finished:
+			pyboard.exit_raw_repl()
+
+		pyboard.close()
+
+	return {'files': len(uploads), 'bytes': upload_bytes}
+
+def upload_to_boards(ports, uploads, include_dirs, options):
+	print_lock = threading.Lock()
+	width = max([len(port) for port in ports])
+	results = {}
+
+	def upload(port):
+		def log(message):
+			with print_lock:
+				for line in message.strip('\n').splitlines():
+					print(f'[{port:<{width}}] {line}')
+
+		start_time = time.time()
+
+		try:
+			with trace_events.span('upload', port=port):
+				result = upload_to_board(port, uploads, include_dirs, options, log)
+			result['error'] = None
+		except Exception as e:
+			log(f'failed: {e}')
+			result = {'files': None, 'bytes': None, 'error': str(e).splitlines()[0] if str(e) else type(e).__name__}
+
+		result['time'] = time.time() - start_time
+		results[port] = result
+
+	with ThreadPoolExecutor(max_workers=options.jobs or len(ports)) as executor:
+		list(executor.map(upload, ports))
+
+	print(f'\nSummary ({len(ports)} boards):')
+	print(f'    {"PORT":<{width}}  RESULT  {"FILES":>5}  {"BYTES":>9}  {"TIME":>7}')
+
+	for port in ports:
+		result = results[port]
+		files = '-' if result['files'] is None else result['files']
+		upload_bytes = '-' if result['bytes'] is None else result['bytes']
+		line = f'    {port:<{width}}  {"fail" if result["error"] else "pass":<6}  {files:>5}  {upload_bytes:>9}  {result["time"]:>6.2f}s'
+
+		if result['error']:
+			print(f'\x1b[31m{line}  {result["error"]}\033[0m')
+		else:
+			print(f'\x1b[32m{line}\033[0m')
+
+	return all([result['error'] is None for result in results.values()])
+
+def watch_board(port, config_file, options):
+	'''
+	保持一个 Pyboard 连接，文件保存后只上传有变化的文件，然后按 --on-change 软重启或运行 ! 文件，
+	并显示从保存文件到开始运行的耗时
+	'''
+	def scan():
+		includes, excludes, run_file = parse_config_file(config_file)
+		include_files, include_dirs, _ = list_all_files_and_dirs(includes, excludes)
+		return include_files, include_dirs, run_file
+
+	def snapshot(files):
+		result = {}
+
+		for file in files + [config_file]:
+			try:
+				stat = os.stat(file)
+			except OSError:
+				continue
+
+			result[file] = (stat.st_size, stat.st_mtime_ns)
+
+		return result
+
+	def show_output(data):
+		# drop the end markers of raw REPL output
+		print(data.replace(b'\x04>', b'').replace(b'\x04', b'').decode('utf-8', 'replace'), end='', flush=True)
+
+	include_files, include_dirs, run_file = scan()
+	last_snapshot = snapshot(include_files)
+	watcher = create_watcher(lambda: snapshot(scan()[0]))
+
+	for dir in ['.', os.path.dirname(config_file) or '.'] + include_dirs:
+		watcher.add(dir)
+
+	if options.on_change == 'reset' and port.startswith('webrepl://'):
+		print('\nSoft reset closes the WebREPL connection, nothing to do on change')
+		options.on_change = 'none'
+
+	if options.on_change == 'run' and not run_file:
+		print(f'\nNo run file (line starts with {RUN_AFTER_UPLOAD_PREFIX}) in {config_file}, nothing to run on change')
+
+	temp_dir = tempfile.TemporaryDirectory(prefix='ab_')
+	pyboard = open_board(port)
+	running = False
+
+	try:
+		pyboard.enter_raw_repl(soft_reset=False)
+		manifest = read_manifest(pyboard) or {}
+
+		print(f'\nWatching {len(include_files)} files ({type(watcher).__name__}), press Ctrl-C to stop')
+
+		while True:
+			changed = watcher.wait(0.05)
+
+			# the raw REPL prompt must stay in the buffer while nothing is running
+			if running:
+				output = pyboard.read_available()
+
+				if output:
+					show_output(output)
+
+			if not changed:
+				continue
+
+			include_files, include_dirs, run_file = scan()
+			current_snapshot = snapshot(include_files)
+			changed_files = [file for file in include_files if current_snapshot.get(file) != last_snapshot.get(file)]
+			deleted_files = [file for file in last_snapshot if file not in current_snapshot and file != config_file]
+			last_snapshot = current_snapshot
+
+			for dir in include_dirs:
+				watcher.add(dir)
+
+			if not changed_files and not (options.mirror and deleted_files):
+				continue
+
+			saved_time = min([current_snapshot[file][1] / 1e9 for file in changed_files] + [time.time()])
+
+			if running:
+				pyboard.enter_raw_repl(soft_reset=False)
+				running = False
+
+			try:
+				uploads, _ = stage_uploads(changed_files, temp_dir.name, options)
+			except MpyCrossError as mce:
+				print(f'\n{mce}')
+				continue
+
+			start_time = time.time()
+			changed_dirs = sorted(set([dir for dir in include_dirs if any([file.startswith(dir + '/') for file in changed_files])]))
+
+			if changed_dirs and options.transfer != 'bundle':
+				pyboard.exec(CMD_MKDIRS.format(changed_dirs, True))
+
+			print(f'\nUploading {len(uploads)} changed files...')
+			board_fs.invalidate(port)
+
+			try:
+				put_files(pyboard, uploads, changed_dirs, options)
+			except PyboardError as pe:
+				print(f'Upload failed\n{pe}')
+				pyboard.enter_raw_repl(soft_reset=False)
+				continue
+
+			manifest.update({dest: [os.path.getsize(src), hash_file(src)] for src, dest in uploads})
+
+			if options.mirror and deleted_files:
+				deleted_dests = [upload_dest(file, options) for file in deleted_files]
+
+				for line in pyboard.exec(CMD_REMOVE_FILES.format(deleted_dests, options.quiet)).decode().splitlines():
+					print(line)
+
+				for dest in deleted_dests:
+					manifest.pop(dest, None)
+
+			write_manifest(pyboard, manifest, options.transfer)
+			upload_time = time.time() - start_time
+
+			if options.on_change == 'reset':
+				pyboard.exit_raw_repl()
+				pyboard.serial.write(b'\x04')
+				pyboard.read_until(1, b'soft reboot\r\n', timeout=2)
+				running = True
+			elif options.on_change == 'run' and run_file:
+				pyboard.exec_raw_no_follow(f'exec(open({upload_dest(run_file, options)!r}).read(), {{"__name__": "__main__"}})')
+				running = True
+
+			upload_bytes = sum([os.path.getsize(src) for src, _ in uploads])
+			print(f'- {upload_bytes} bytes in {upload_time:.2f}s, save-to-{"running" if running else "uploaded"} {time.time() - saved_time:.2f}s')
+	except KeyboardInterrupt:
+		print('\nWatch stopped')
+	finally:
+		# interrupt the run file, but keep main.py running after a soft reset
+		if pyboard.in_raw_repl:
+			pyboard.serial.write(b'\r\x03\x03')
+			pyboard.exit_raw_repl()
+
+		pyboard.close()
+		watcher.close()
+		temp_dir.cleanup()
+
+def report_trace(options):
+	'''
+	保存 --trace 指定的文件，--stats 时按阶段显示次数、耗时和传输速率（阶段之间有嵌套，耗时不能相加）
+	'''
+	if options.trace:
+		trace_events.save(options.trace)
+		print(f'\nTrace saved to {options.trace}, open it in chrome://tracing or https://ui.perfetto.dev')
+
+	if options.stats:
+		print('\nStats:')
+		print(trace_events.format_stats())
+
 def ab(options, files):
 	global parser
 
@@ -157,14 +1024,29 @@ def ab(options, files):
 	if options.simulate:
 		options.quiet = False
 
-	includes, excludes, _ = parse_config_file(config_file)
-	include_files, include_dirs, bad_list = list_all_files_and_dirs(includes, excludes)
+	if options.compress and options.transfer not in ('stream', 'bundle'):
+		options.transfer = 'stream'
+
+	if options.trace or options.stats:
+		trace_events.enable()
+
+	with trace_events.span('list_files'):
+		includes, excludes, _ = parse_config_file(config_file)
+		include_files, include_dirs, bad_list = list_all_files_and_dirs(includes, excludes)
 
 	if not include_files:
 		print('Nothing to do!')
 		exit(0)
 
-	port = '' if options.simulate else choose_a_port()
+	ports = [''] if options.simulate else get_ports(options)
+
+	if not ports:
+		print('No serial port found')
+		exit()
+
+	# before anything is uploaded
+	if options.watch and len(ports) > 1:
+		parser.error('--watch works with one board only')
 
 	if not options.quiet:
 		print(f'\nFile List ({len(include_files)}):')
@@ -178,47 +1060,44 @@ def ab(options, files):
 			print(f'\nNot Found List ({len(bad_list)})')
 			print('{}'.format('\n'.join([f'- {dir_or_file}' for dir_or_file in bad_list])))
 
-		print('\nMaking dirs on board...')
-
 	if options.simulate:
+		print('\nMaking dirs on board...')
 		print('Upload files to board...')
 		print('Simulate finished')
 		exit(0)
 
-	pyboard = Pyboard(port)
-	pyboard.enter_raw_repl()
+	temp_dir = tempfile.TemporaryDirectory(prefix='ab_') if options.minify or options.mpy else None
 
-	cmd = CMD_MKDIRS.format(include_dirs, options.quiet)
-	pyboard.exec(cmd, data_consumer=stdout_write_bytes)
+	try:
+		with trace_events.span('stage', files=len(include_files)):
+			uploads, caches = stage_uploads(include_files, temp_dir.name if temp_dir else None, options)
+	except MpyCrossError as mce:
+		print(f'\n{mce}')
+		exit(1)
 
-	temp_dir = None
+	if len(ports) == 1:
+		with trace_events.span('upload', port=ports[0]):
+			upload_to_board(ports[0], uploads, include_dirs, options)
 
-	# if options.minify:
-	# 	temp_dir = tempfile.TemporaryDirectory(prefix='ab_')
+		succeeded = True
+	else:
+		succeeded = upload_to_boards(ports, uploads, include_dirs, options)
 
-	# 	for dir in include_dirs:
-	# 		dest_dir = os.path.join(temp_dir.name, dir)
-	# 		if not os.path.exists(dest_dir):
-	# 			os.mkdir(dest_dir)
-	
-	# 	for file in include_files:
-	# 		dest_file = os.path.join(temp_dir.name, file)
-	# 		shutil.copyfile(file, dest_file)
+	if temp_dir:
+		temp_dir.cleanup()
 
-	print('{}'.format('\nUpload files to board...' if not options.quiet else ''))
+	for cache in caches:
+		cache.evict()
 
-	for index, file in enumerate(include_files, start=1):
-		if not options.quiet:
-			print(f'- uploading {file} ({index}/{len(include_files)})')
+	if not options.watch:
+		report_trace(options)
 
-		pyboard.fs_put(os.path.join(temp_dir.name if temp_dir else '', file), file)
+	if not succeeded:
+		exit(1)
 
-	pyboard.exit_raw_repl()
-
-	if temp_dir:
-		temp_dir.cleanup()
-
-	print('\nUpload Finished')
+	if options.watch:
+		watch_board(ports[0], config_file, options)
+		report_trace(options)
 
 def main():
 	global parser
@@ -231,13 +1110,35 @@ def main():
 	parser = OptionParser(usage, version=f'ampy batch tool ({__version__})')
 	parser.disable_interspersed_args()
 
-	# parser.add_option(
-	# 	'-m', '--minify',
-	# 	action = 'store_true',
-	# 	dest = 'minify',
-	# 	default = False,
-	# 	help = 'minify .py files which put to board'
-	# )
+	parser.add_option(
+		'-m', '--minify',
+		action = 'store_true',
+		dest = 'minify',
+		default = False,
+		help = 'strip docstrings, comments, blank lines and shorten indentation of .py files which put to board'
+	)
+	parser.add_option(
+		'-p', '--port',
+		dest = 'port',
+		help = 'upload to these ports instead of choosing one, separated by commas, e.g. COM3,COM4, network boards can be given as socket://HOST:PORT, rfc2217://HOST:PORT or webrepl://HOST[:8266]'
+	)
+	parser.add_option(
+		'--password',
+		dest = 'password',
+		help = f'password of webrepl:// ports, or set it in the {PASSWORD_ENV} environment variable'
+	)
+	parser.add_option(
+		'--vid-pid',
+		dest = 'vid_pid',
+		help = 'upload to all ports matching the usb VID:PID in hex, e.g. 10c4:ea60'
+	)
+	parser.add_option(
+		'-j', '--jobs',
+		type = 'int',
+		dest = 'jobs',
+		default = 0,
+		help = 'number of boards uploaded or flashed at the same time, default all of them'
+	)
 	parser.add_option(
 		'-q', '--quiet',
 		action = 'store_true',
@@ -252,6 +1153,89 @@ def main():
 		default = False,
 		help = 'just print command lines for review'
 	)
+	parser.add_option(
+		'-t', '--transfer',
+		type = 'choice',
+		choices = TRANSFER_MODES,
+		dest = 'transfer',
+		default = 'base64',
+		help = 'transfer mode of file content: base64 (default), repr, stream or bundle'
+	)
+	parser.add_option(
+		'-z', '--compress',
+		action = 'store_true',
+		dest = 'compress',
+		default = False,
+		help = 'compress files on host and decompress them on board, implies --transfer stream'
+	)
+	parser.add_option(
+		'--mpy',
+		action = 'store_true',
+		dest = 'mpy',
+		default = False,
+		help = 'compile .py files (except main.py and boot.py) to .mpy with mpy-cross before upload'
+	)
+	parser.add_option(
+		'--mpy-args',
+		dest = 'mpy_args',
+		help = 'extra arguments for mpy-cross, e.g. "-march=xtensawin"'
+	)
+	parser.add_option(
+		'-b', '--baudrate',
+		type = 'int',
+		dest = 'baudrate',
+		default = 0,
+		help = 'switch board and port to a higher baudrate (e.g. 921600) after entering raw repl, fall back to 115200 if failed'
+	)
+	parser.add_option(
+		'--no-reset',
+		action = 'store_true',
+		dest = 'no_reset',
+		default = False,
+		help = 'attach to the running interpreter without soft reset'
+	)
+	parser.add_option(
+		'--sync',
+		action = 'store_true',
+		dest = 'sync',
+		default = False,
+		help = 'upload changed files only, compared by sha256'
+	)
+	parser.add_option(
+		'-w', '--watch',
+		action = 'store_true',
+		dest = 'watch',
+		default = False,
+		help = 'keep the board connected after upload, and upload changed files whenever they are saved'
+	)
+	parser.add_option(
+		'--on-change',
+		type = 'choice',
+		choices = ['none', 'reset', 'run'],
+		dest = 'on_change',
+		default = 'none',
+		help = 'what to do after changed files uploaded in watch mode: none (default), reset (soft reset and run main.py) or run (run the ! file in config file)'
+	)
+	parser.add_option(
+		'--mirror',
+		action = 'store_true',
+		dest = 'mirror',
+		default = False,
+		help = 'remove files uploaded before but no longer in config file, and the dirs emptied by it'
+	)
+	parser.add_option(
+		'--trace',
+		dest = 'trace',
+		metavar = 'FILE',
+		help = 'save the time spent in every phase of upload (open, handshake, exec, file, flow control waits) to FILE as trace event json for chrome://tracing or perfetto'
+	)
+	parser.add_option(
+		'--stats',
+		action = 'store_true',
+		dest = 'stats',
+		default = False,
+		help = 'show count, time and throughput of every phase after upload, and estimate the per-file exec path for stream and bundle'
+	)
 	parser.add_option(
 		'--repl',
 		action = 'store_true',
@@ -266,12 +1250,60 @@ def main():
 		default = False,
 		help = 'enter raw repl mode via usb cdc'
 	)
+	parser.add_option(
+		'--capture',
+		dest = 'capture',
+		metavar = 'FILE',
+		help = 'save everything the board prints in repl mode to FILE, with a timestamp per line'
+	)
+	parser.add_option(
+		'--capture-size',
+		type = 'int',
+		dest = 'capture_size',
+		default = 10,
+		help = 'start a new capture file after this many MB, the old one is renamed to FILE.1, FILE.2 and so on, default 10'
+	)
+	parser.add_option(
+		'--capture-gzip',
+		action = 'store_true',
+		dest = 'capture_gzip',
+		default = False,
+		help = 'compress the renamed capture files with gzip'
+	)
+	parser.add_option(
+		'--capture-raw',
+		action = 'store_true',
+		dest = 'capture_raw',
+		default = False,
+		help = 'save the received bytes as they are, without decoding and timestamps, for binary data'
+	)
 	parser.add_option(
 		'--flash',
 		action = 'store_true',
 		dest = 'flash',
 		help = 'an esptool shell'
 	)
+	parser.add_option(
+		'--daemon',
+		type = 'choice',
+		choices = ['start', 'stop', 'status', 'run'],
+		dest = 'daemon',
+		help = 'start, stop or show the background daemon which keeps the port open, ab and repl use it automatically when running'
+	)
+	parser.add_option(
+		'--fs',
+		type = 'choice',
+		choices = list(board_fs.FORMATTERS),
+		dest = 'fs',
+		help = 'show files on board with ls, tree or du, the path is given as argument (default /), uses the cached index of the board'
+	)
+	parser.add_option(
+		'--refresh',
+		action = 'store_true',
+		dest = 'refresh',
+		default = False,
+		help = 'rebuild the index of files on board for --fs'
+	)
 	parser.add_option(
 		'--readme',
 		action = 'store_true',
@@ -281,6 +1313,16 @@ def main():
 
 	options, files = parser.parse_args()
 
+	if options.vid_pid and not re.fullmatch(r'[0-9a-fA-F]{1,4}:[0-9a-fA-F]{1,4}', options.vid_pid):
+		parser.error(f'--vid-pid must be VID:PID in hex, e.g. 1a86:7523, not {options.vid_pid!r}')
+
+	# daemon:// and webrepl:// ports
+	serial.protocol_handler_packages.append('ab')
+
+	# spawned daemons read the password from the environment as well
+	if options.password is not None:
+		os.environ[PASSWORD_ENV] = options.password
+
 	if options.readme:
 		import webbrowser
 		webbrowser.open('https://gitee.com/walkline/a-batch-tool')
@@ -290,13 +1332,26 @@ def main():
 		except ImportError:
 			from miniterm import main
 		port = choose_a_port()
-		main(default_port=port, default_dtr=True if options.replcdc else False)
+
+		if port_daemon.is_running(port):
+			port = f'daemon://{port}'
+
+		capture = None
+
+		if options.capture:
+			capture = SessionCapture(options.capture, options.capture_size * 1024 * 1024, options.capture_gzip, options.capture_raw)
+
+		main(default_port=port, default_dtr=True if options.replcdc else False, capture=capture)
+	elif options.daemon:
+		daemon_command(options)
+	elif options.fs:
+		fs_command(options, files)
 	elif options.flash:
 		try:
 			from .flash import run_esptool_shell
 		except ImportError:
 			from flash import run_esptool_shell
-		run_esptool_shell()
+		run_esptool_shell(options.jobs)
 	else:
 		ab(options, files)
 
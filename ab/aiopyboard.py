@@ -0,0 +1,136 @@
+"""
+The MIT License (MIT)
+Copyright © 2021 Walkline Wang (https://walkline.wang)
+Gitee: https://gitee.com/walkline/a-batch-tool
+
+asyncio driver of the Pyboard protocol, driving the port through its
+non-blocking file descriptor from the event loop, so one thread can talk to
+many boards.  The protocol itself is PyboardProtocol in pyboard.py, shared
+with the blocking Pyboard.  Linux/macOS only.
+
+    async def main():
+        pyboard = AsyncPyboard("/dev/ttyUSB0")
+        await pyboard.enter_raw_repl()
+        print(await pyboard.exec_("print(1 + 1)"))
+        await pyboard.exit_raw_repl()
+        pyboard.close()
+"""
+import asyncio
+import os
+
+try:
+    from pyboard import PROTOCOL_METHODS, FILL, POLL, SLEEP, WRITE, PyboardError, PyboardProtocol
+except ModuleNotFoundError:
+    from .pyboard import PROTOCOL_METHODS, FILL, POLL, SLEEP, WRITE, PyboardError, PyboardProtocol
+
+
+def _coroutine_method(name):
+    generator = getattr(PyboardProtocol, "_g_" + name)
+
+    async def method(self, *args, **kwargs):
+        return await self._run(generator(self, *args, **kwargs))
+
+    method.__name__ = name
+    return method
+
+
+class AsyncPyboard(PyboardProtocol):
+    # Runs the PyboardProtocol generators from the event loop, so it speaks
+    # exactly the same protocol as Pyboard.  Must be created inside a running
+    # event loop.
+    def __init__(self, device, baudrate=115200, exclusive=True):
+        import serial
+
+        super().__init__()
+        self._rx_event = asyncio.Event()
+        self._closed = False
+
+        try:
+            self.serial = serial.Serial(None, baudrate=baudrate, timeout=0, exclusive=exclusive)
+            self.serial.port = device
+            self.serial.rts = False
+            self.serial.dtr = False
+            self.serial.open()
+        except (OSError, IOError):
+            raise PyboardError("failed to access " + device)
+
+        self._fd = self.serial.fileno()
+        os.set_blocking(self._fd, False)
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(self._fd, self._on_readable)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._loop.remove_reader(self._fd)
+            self.serial.close()
+
+    async def _run(self, generator):
+        # Same as Pyboard._run, awaiting the I/O requests instead.
+        result = error = None
+        while True:
+            try:
+                request = generator.throw(error) if error else generator.send(result)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                result, error = await self._io(*request), None
+            except Exception as e:
+                result, error = None, e
+
+    async def _io(self, op, arg=None):
+        if op == WRITE:
+            await self._write(arg)
+        elif op == FILL:
+            return await self._fill(arg)
+        elif op == SLEEP:
+            await asyncio.sleep(arg)
+        # POLL: the reader callback already moved everything into _rx_buffer
+
+    def _on_readable(self):
+        try:
+            data = os.read(self._fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if data:
+            self._rx_buffer += data
+        else:
+            # the port went away, stop watching it
+            self._loop.remove_reader(self._fd)
+        self._rx_event.set()
+
+    async def _fill(self, timeout):
+        # Wait up to timeout for more data, returns False if none arrived.
+        self._rx_event.clear()
+        try:
+            await asyncio.wait_for(self._rx_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def _write(self, data):
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[os.write(self._fd, view) :]
+            except BlockingIOError:
+                writable = self._loop.create_future()
+
+                def on_writable():
+                    # the loop may call it again before remove_writer runs
+                    if not writable.done():
+                        writable.set_result(None)
+
+                self._loop.add_writer(self._fd, on_writable)
+                try:
+                    await writable
+                finally:
+                    self._loop.remove_writer(self._fd)
+
+
+for _name in PROTOCOL_METHODS:
+    setattr(AsyncPyboard, _name, _coroutine_method(_name))
+
+AsyncPyboard.exec = AsyncPyboard.exec_
@@ -0,0 +1,211 @@
+"""
+The MIT License (MIT)
+Copyright © 2021 Walkline Wang (https://walkline.wang)
+Gitee: https://gitee.com/walkline/a-batch-tool
+
+开发板文件系统索引，使用 os.ilistdir 一次遍历整个文件系统，文件类型和大小都来自 ilistdir，
+不需要对每个文件调用 os.stat，索引按串口缓存在本地，通过 ab 上传文件或烧录固件后失效，
+开发板上运行的代码和其它工具也会修改文件，所以缓存超过 INDEX_MAX_AGE 秒后重新建立：
+
+	index = load_index(port)
+
+	if index is None:
+		index = BoardIndex.build(pyboard)
+		save_index(port, index)
+
+	print('\\n'.join(format_tree(index, '/lib')))
+"""
+import json
+import posixpath
+import time
+
+try:
+	from cache import ArtifactCache
+except ModuleNotFoundError:
+	from .cache import ArtifactCache
+
+INDEX_VERSION = 1
+INDEX_MAX_AGE = 5 * 60
+
+# one line per entry, "d PATH" for dirs and "SIZE PATH" for files,
+# old firmwares without the size in ilistdir fall back to os.stat
+CMD_INDEX_FS = \
+'''
+import os
+s = ['']
+while s:
+  d = s.pop()
+  for e in os.ilistdir(d or '/'):
+    p = d + '/' + e[0]
+    if e[1] & 0x4000:
+      s.append(p)
+      print('d', p)
+    else:
+      print(e[3] if len(e) > 3 and e[3] >= 0 else os.stat(p)[6], p)
+'''
+
+
+def normpath(path):
+	return posixpath.normpath('/' + path.strip()).replace('//', '/')
+
+
+class BoardIndex(object):
+	'''
+	files 为 {路径: 大小}，dirs 为所有文件夹，路径都以 / 开头
+	'''
+	def __init__(self, files=None, dirs=None, created=None):
+		self.files = files or {}
+		self.dirs = set(dirs or [])
+		self.dirs.add('/')
+		self.created = created or time.time()
+
+	@classmethod
+	def build(cls, pyboard):
+		'''
+		pyboard 需要处于 raw repl 模式
+		'''
+		files = {}
+		dirs = []
+
+		for line in pyboard.exec(CMD_INDEX_FS).decode().splitlines():
+			kind, _, path = line.partition(' ')
+
+			if not path:
+				continue
+
+			if kind == 'd':
+				dirs.append(path)
+			else:
+				files[path] = int(kind)
+
+		return cls(files, dirs)
+
+	@classmethod
+	def from_json(cls, content):
+		data = json.loads(content)
+
+		if data.get('version') != INDEX_VERSION:
+			raise ValueError('unknown index version')
+
+		return cls(data['files'], data['dirs'], data['created'])
+
+	def to_json(self):
+		return json.dumps({
+			'version': INDEX_VERSION,
+			'created': self.created,
+			'files': self.files,
+			'dirs': sorted(self.dirs)
+		}, separators=(',', ':'))
+
+	def children(self, path):
+		'''
+		返回文件夹下的 [(名称, 大小)]，文件夹的大小为 None，文件夹在前，各自按名称排序
+		'''
+		prefix = '' if path == '/' else path
+		dirs = [(dir[len(prefix) + 1:], None) for dir in self.dirs if posixpath.dirname(dir) == path and dir != '/']
+		files = [(file[len(prefix) + 1:], size) for file, size in self.files.items() if posixpath.dirname(file) == path]
+
+		return sorted(dirs) + sorted(files)
+
+	def du(self, path):
+		if path in self.files:
+			return self.files[path]
+
+		prefix = '' if path == '/' else path
+
+		return sum([size for file, size in self.files.items() if file.startswith(prefix + '/')])
+
+	def py_files(self):
+		return sorted([file for file in self.files if file.endswith('.py')])
+
+	def check(self, path):
+		path = normpath(path)
+
+		if path not in self.dirs and path not in self.files:
+			raise ValueError(f'{path} not found on board')
+
+		return path
+
+
+def format_ls(index, path='/'):
+	path = index.check(path)
+
+	if path in index.files:
+		return [f'    {index.files[path]:>9}  {path}']
+
+	return [f'    {"DIR" if size is None else size:>9}  {name}{"/" if size is None else ""}' for name, size in index.children(path)]
+
+def format_tree(index, path='/'):
+	path = index.check(path)
+	lines = [path]
+
+	def walk(dir, depth):
+		for name, size in index.children(dir):
+			if size is None:
+				lines.append(f'{"    " * depth}{name}/')
+				walk(posixpath.join(dir, name), depth + 1)
+			else:
+				lines.append(f'{"    " * depth}{name} ({size})')
+
+	if path in index.dirs:
+		walk(path, 1)
+
+	return lines
+
+def format_du(index, path='/'):
+	'''
+	显示文件夹下每一项的总大小（字节）
+	'''
+	path = index.check(path)
+	lines = []
+
+	if path in index.dirs:
+		for name, _ in index.children(path):
+			lines.append(f'    {index.du(posixpath.join(path, name)):>9}  {posixpath.join(path, name)}')
+
+	lines.append(f'    {index.du(path):>9}  {path} (total)')
+
+	return lines
+
+FORMATTERS = {
+	'ls': format_ls,
+	'tree': format_tree,
+	'du': format_du
+}
+
+
+def cache_key(port):
+	# the daemon and the port itself lead to the same board
+	if port.startswith('daemon://'):
+		port = port[len('daemon://'):]
+
+	return ArtifactCache.key('board_fs', port)
+
+def load_index(port, cache=None, max_age=INDEX_MAX_AGE):
+	'''
+	读取缓存的索引，没有缓存或缓存超过 max_age 秒时返回 None
+	'''
+	cached_file = (cache or ArtifactCache('fs')).get(cache_key(port))
+
+	if not cached_file:
+		return None
+
+	try:
+		with open(cached_file) as file:
+			index = BoardIndex.from_json(file.read())
+	except (OSError, ValueError, KeyError):
+		return None
+
+	if time.time() - index.created > max_age:
+		return None
+
+	return index
+
+def save_index(port, index, cache=None):
+	(cache or ArtifactCache('fs')).put(cache_key(port), index.to_json().encode())
+
+def invalidate(port, cache=None):
+	'''
+	开发板上的文件有变化时调用，下次使用时重新建立索引
+	'''
+	(cache or ArtifactCache('fs')).remove(cache_key(port))
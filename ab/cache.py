@@ -0,0 +1,95 @@
+"""
+The MIT License (MIT)
+Copyright © 2021 Walkline Wang (https://walkline.wang)
+Gitee: https://gitee.com/walkline/a-batch-tool
+"""
+import hashlib
+import os
+import tempfile
+
+CACHE_DIR_ENV = 'AB_CACHE_DIR'
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+
+def default_cache_dir():
+	return os.environ.get(CACHE_DIR_ENV) or os.path.join(os.path.expanduser('~'), '.cache', 'ab')
+
+
+class ArtifactCache(object):
+	'''
+	以内容哈希为键的本地文件缓存，每个 namespace 单独一个目录，默认保存在 ~/.cache/ab 下，
+	可以使用环境变量 AB_CACHE_DIR 指定其它目录。
+	命中的缓存会更新修改时间，evict() 按修改时间从旧到新删除缓存，直到总大小不超过 max_size
+	'''
+	def __init__(self, namespace, root=None, max_size=DEFAULT_MAX_SIZE):
+		self.path = os.path.join(root or default_cache_dir(), namespace)
+		self.max_size = max_size
+
+	@staticmethod
+	def key(*parts):
+		sha256 = hashlib.sha256()
+
+		for part in parts:
+			sha256.update(part if isinstance(part, bytes) else str(part).encode())
+			sha256.update(b'\0')
+
+		return sha256.hexdigest()
+
+	def _filename(self, key):
+		return os.path.join(self.path, key[:2], key)
+
+	def get(self, key):
+		filename = self._filename(key)
+
+		try:
+			os.utime(filename)
+		except OSError:
+			return None
+
+		return filename
+
+	def put(self, key, data):
+		filename = self._filename(key)
+		os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+		# write to a temp file and rename, so a cache entry is never seen half written
+		fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(filename))
+		with os.fdopen(fd, 'wb') as file:
+			file.write(data)
+		os.replace(temp_file, filename)
+
+		return filename
+
+	def remove(self, key):
+		try:
+			os.remove(self._filename(key))
+		except OSError:
+			pass
+
+	def evict(self):
+		entries = []
+		total_size = 0
+
+		for root, _, files in os.walk(self.path):
+			for file in files:
+				filename = os.path.join(root, file)
+
+				try:
+					stat = os.stat(filename)
+				except OSError:
+					continue
+
+				entries.append((stat.st_mtime, stat.st_size, filename))
+				total_size += stat.st_size
+
+		entries.sort()
+
+		for _, size, filename in entries:
+			if total_size <= self.max_size:
+				break
+
+			try:
+				os.remove(filename)
+				total_size -= size
+			except OSError:
+				pass
@@ -0,0 +1,153 @@
+"""
+The MIT License (MIT)
+Copyright © 2021 Walkline Wang (https://walkline.wang)
+Gitee: https://gitee.com/walkline/a-batch-tool
+"""
+import codecs
+import collections
+import gzip
+import os
+import shutil
+import threading
+import time
+
+DEFAULT_MAX_SIZE = 10 * 1024 * 1024
+# received bytes waiting for the writer, newer data is dropped beyond this
+MAX_PENDING = 16 * 1024 * 1024
+FLUSH_INTERVAL = 0.5
+FILE_BUFFER_SIZE = 256 * 1024
+
+
+def format_timestamp(timestamp):
+	return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp)) + f'.{int(timestamp * 1000) % 1000:03d}'
+
+
+class SessionCapture(object):
+	'''
+	把串口收到的数据写入文件，write() 只把数据放入队列，由后台线程写入文件，调用者永远不会等待磁盘
+
+	- 文本模式按 UTF-8 解码，每行开头加上收到数据时的本机时间，\\r\\n 转换为 \\n
+	- raw 模式按原样写入收到的字节，适合二进制数据
+	- 文件超过 max_size 字节后改名为 FILE.1、FILE.2……（compress 为 True 时压缩为 FILE.N.gz），再新建 FILE 继续写入
+	'''
+	def __init__(self, path, max_size=DEFAULT_MAX_SIZE, compress=False, raw=False):
+		self.path = path
+		self.max_size = max_size
+		self.compress = compress
+		self.raw = raw
+		self.received = 0
+		self.written = 0
+		self.dropped = 0
+		self.segments = 0
+
+		self._pending = collections.deque()
+		self._pending_size = 0
+		self._condition = threading.Condition()
+		self._alive = True
+		self._decoder = codecs.getincrementaldecoder('utf-8')('replace')
+		self._line_start = True
+		self._next_segment = self._find_next_segment()
+		self._file = open(path, 'ab', buffering=FILE_BUFFER_SIZE)
+		self._thread = threading.Thread(target=self._run, name='capture', daemon=True)
+		self._thread.start()
+
+	def _find_next_segment(self):
+		'''
+		接着已经存在的分段文件编号
+		'''
+		folder, name = os.path.split(os.path.abspath(self.path))
+		numbers = [0]
+
+		for entry in os.listdir(folder):
+			suffix = entry[len(name) + 1:].split('.')[0]
+
+			if entry.startswith(name + '.') and suffix.isdigit():
+				numbers.append(int(suffix))
+
+		return max(numbers) + 1
+
+	def write(self, data):
+		with self._condition:
+			self.received += len(data)
+
+			if self._pending_size + len(data) > MAX_PENDING:
+				self.dropped += len(data)
+				return
+
+			self._pending.append((time.time(), data))
+			self._pending_size += len(data)
+			self._condition.notify()
+
+	def close(self):
+		with self._condition:
+			self._alive = False
+			self._condition.notify()
+
+		self._thread.join()
+
+	def _format(self, timestamp, data):
+		if self.raw:
+			return data
+
+		text = self._decoder.decode(data).replace('\r\n', '\n').replace('\r', '')
+
+		if not text:
+			return b''
+
+		prefix = f'[{format_timestamp(timestamp)}] '
+		lines = text.split('\n')
+		result = []
+
+		for index, line in enumerate(lines):
+			# the last item is the part after the final \n, empty if the chunk ends a line
+			if index == len(lines) - 1 and not line:
+				break
+
+			result.append((prefix if self._line_start else '') + line)
+			self._line_start = index < len(lines) - 1
+
+		return ('\n'.join(result) + ('\n' if self._line_start else '')).encode('utf-8')
+
+	def _rotate(self):
+		self._file.close()
+		segment = f'{self.path}.{self._next_segment}'
+		self._next_segment += 1
+		os.replace(self.path, segment)
+
+		if self.compress:
+			with open(segment, 'rb') as source, gzip.open(segment + '.gz', 'wb') as target:
+				shutil.copyfileobj(source, target)
+
+			os.remove(segment)
+
+		self.segments += 1
+		self._file = open(self.path, 'ab', buffering=FILE_BUFFER_SIZE)
+
+	def _run(self):
+		last_flush = time.monotonic()
+
+		while True:
+			with self._condition:
+				if self._alive and not self._pending:
+					self._condition.wait(FLUSH_INTERVAL)
+
+				chunks = list(self._pending)
+				self._pending.clear()
+				self._pending_size = 0
+				alive = self._alive
+
+			for timestamp, data in chunks:
+				output = self._format(timestamp, data)
+				self._file.write(output)
+				self.written += len(data)
+
+				if self._file.tell() >= self.max_size:
+					self._rotate()
+
+			if not alive:
+				self._file.close()
+				return
+
+			if time.monotonic() - last_flush >= FLUSH_INTERVAL:
+				self._file.flush()
+				last_flush = time.monotonic()
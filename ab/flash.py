@@ -4,7 +4,16 @@ Copyright © 2021 Walkline Wang (https://walkline.wang)
 Gitee: https://gitee.com/walkline/a-batch-tool
 """
 from serial.tools.list_ports import comports
+from concurrent.futures import ThreadPoolExecutor
 import os
+import subprocess
+import threading
+import time
+
+try:
+	import board_fs
+except ModuleNotFoundError:
+	from . import board_fs
 
 EXCLUDE_DIRS = ['.git', '.vscode', '__pycache__', 'build', 'dist']
 
@@ -36,6 +45,87 @@ def choose_an_option(title, options):
 		except:
 			pass
 
+def choose_some_options(title, options):
+	'''
+	多选列表，可以输入多个序号（如 1,3 或 1-3），输入 a 选择全部，直接回车选择第一项
+	'''
+	print(f'\n{title} List:')
+	for index, option in enumerate(options, start=1):
+		if index == 1:
+			print(f'\x1b[32m  [{index}] {option}\033[0m')
+		else:
+			print(f'  [{index}] {option}')
+
+	while True:
+		try:
+			selected = input('Choose options (e.g. 1,3 or 1-3, a for all): ').strip()
+
+			if selected == '':
+				return options[:1]
+
+			if selected.lower() == 'a':
+				return options
+
+			indexes = []
+
+			for item in selected.split(','):
+				if '-' in item:
+					first, last = [int(number) for number in item.split('-')]
+					indexes.extend(range(first, last + 1))
+				else:
+					indexes.append(int(item))
+
+			assert indexes and all([0 < index <= len(options) for index in indexes])
+
+			return [options[index - 1] for index in sorted(set(indexes))]
+		except KeyboardInterrupt:
+			exit()
+		except:
+			pass
+
+def flash_ports(ports, earse_command, write_command, jobs=0):
+	'''
+	同时为多个串口烧录固件，每个串口依次执行擦除和写入，输出内容按串口分别收集，全部完成后显示汇总结果
+	'''
+	print_lock = threading.Lock()
+	results = {}
+
+	def flash(port):
+		start_time = time.time()
+		output = b''
+		succeeded = False
+
+		try:
+			for command in (earse_command, write_command):
+				process = subprocess.run(command(port), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+				output += process.stdout
+
+				if process.returncode != 0:
+					break
+			else:
+				succeeded = True
+		except OSError as ose:
+			output += str(ose).encode()
+
+		results[port] = (succeeded, time.time() - start_time)
+
+		with print_lock:
+			print(f'\n----- {port}: {"pass" if succeeded else "fail"} ({results[port][1]:.1f}s) -----')
+			print(output.decode(errors='replace').replace('\r\n', '\n').strip())
+
+	print(f'\nFlashing {len(ports)} ports, {jobs or len(ports)} at a time...')
+
+	with ThreadPoolExecutor(max_workers=jobs or len(ports)) as executor:
+		list(executor.map(flash, ports))
+
+	print(f'\nSummary ({len(ports)} ports):')
+	for port in ports:
+		succeeded, duration = results[port]
+		if succeeded:
+			print(f'\x1b[32m  {port:<16} pass  {duration:>6.1f}s\033[0m')
+		else:
+			print(f'\x1b[31m  {port:<16} fail  {duration:>6.1f}s\033[0m')
+
 def list_files(root='.', levels=2, extention='.bin'):
 	'''
 	递归获取指定目录及指定层数子目录下指定扩展名的文件
@@ -59,7 +149,7 @@ def list_files(root='.', levels=2, extention='.bin'):
 
 	return files
 
-def run_esptool_shell():
+def run_esptool_shell(jobs=0):
 	__CHIP_LIST = ['auto', 'esp8266', 'esp32', 'esp32c3', 'esp32s2', 'esp32s3', 'esp32c2', 'esp32c6', 'esp32s3beta2', 'esp32c6beta', 'esp32h2beta1', 'esp32h2beta2']
 	__CHIP = '--chip {}'
 	__PORT = '--port {}'
@@ -83,8 +173,7 @@ def run_esptool_shell():
 		print('No serial port found')
 		exit()
 
-	port = choose_an_option('Port', port_list)
-	__PORT = __PORT.format(port.split(' - ')[0])
+	ports = [port.split(' - ')[0] for port in choose_some_options('Port', port_list)]
 
 	chip = choose_an_option('Chip', __CHIP_LIST)
 	__CHIP = __CHIP.format(chip)
@@ -99,12 +188,23 @@ def run_esptool_shell():
 
 	firmware = choose_an_option('Firmware', firmware_list)
 
-	earse_command = f'esptool {__PORT} {__BAUD} {__CHIP} erase_flash'
-	write_command = f'esptool {__PORT} {__BAUD} {__CHIP} {__BEFORE} {__AFTER} write_flash {__MODE} {__SIZE} {__FREQ} {addr} {firmware}'
+	def earse_command(port):
+		return f'esptool {__PORT.format(port)} {__BAUD} {__CHIP} erase_flash'.split()
+
+	def write_command(port):
+		return f'esptool {__PORT.format(port)} {__BAUD} {__CHIP} {__BEFORE} {__AFTER} write_flash {__MODE} {__SIZE} {__FREQ} {addr}'.split() + [firmware]
+
+	# erasing the flash removes all files on board
+	for port in ports:
+		board_fs.invalidate(port)
+
+	if len(ports) > 1:
+		flash_ports(ports, earse_command, write_command, jobs)
+		return
 
 	try:
-		if os.system(earse_command) == 0:
-			os.system(write_command)
+		if subprocess.call(earse_command(ports[0])) == 0:
+			subprocess.call(write_command(ports[0]))
 	except OSError as ose:
 		print(ose)
 
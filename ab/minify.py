@@ -0,0 +1,121 @@
+"""
+The MIT License (MIT)
+Copyright © 2021 Walkline Wang (https://walkline.wang)
+Gitee: https://gitee.com/walkline/a-batch-tool
+"""
+import ast
+import os
+import sys
+
+try:
+	from cache import ArtifactCache
+except ModuleNotFoundError:
+	from .cache import ArtifactCache
+
+# change it when the output of minify_source() changes, to invalidate the cache
+MINIFIER_VERSION = 1
+
+
+def strip_docstrings(tree):
+	for node in ast.walk(tree):
+		if not isinstance(node, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+			continue
+
+		body = node.body
+
+		if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant) and isinstance(body[0].value.value, str):
+			body.pop(0)
+
+			if not body and not isinstance(node, ast.Module):
+				body.append(ast.Pass())
+
+	return tree
+
+def shorten_indentation(code):
+	'''
+	删除 ast.unparse() 输出中的空行，并把 4 空格缩进替换为 1 个空格
+	'''
+	lines = []
+
+	for line in code.splitlines():
+		stripped = line.lstrip(' ')
+
+		if not stripped:
+			continue
+
+		indent = len(line) - len(stripped)
+		lines.append(' ' * (indent // 4) + ' ' * (indent % 4) + stripped)
+
+	return '\n'.join(lines) + '\n'
+
+def minify_source(source):
+	'''
+	基于语法树的代码压缩：删除文档字符串和注释，再删除空行并缩短缩进，
+	处理后的代码如果与原代码的语法树不一致则使用 ast.unparse() 的原始输出，保证不会改变代码含义
+	'''
+	code = ast.unparse(strip_docstrings(ast.parse(source)))
+
+	if not code:
+		return ''
+
+	shortened = shorten_indentation(code)
+
+	try:
+		if ast.dump(ast.parse(shortened)) == ast.dump(ast.parse(code)):
+			return shortened
+	except SyntaxError:
+		pass
+
+	return code + '\n'
+
+
+class Minifier(object):
+	'''
+	压缩 py 文件，压缩结果以源文件内容为键缓存
+	'''
+	def __init__(self, cache=None):
+		self.cache = cache or ArtifactCache('minify')
+		self.hits = 0
+		self.misses = 0
+		self.source_bytes = 0
+		self.minified_bytes = 0
+
+	@staticmethod
+	def should_minify(file):
+		return file.endswith('.py')
+
+	def minify(self, src, dest):
+		'''
+		把 src 压缩后写入 dest，无法解析的文件原样写入，返回是否压缩成功
+		'''
+		with open(src, 'rb') as file:
+			source = file.read()
+
+		key = ArtifactCache.key(source, MINIFIER_VERSION, sys.version_info[:2])
+		cached_file = self.cache.get(key)
+
+		if cached_file:
+			self.hits += 1
+
+			with open(cached_file, 'rb') as file:
+				minified = file.read()
+		else:
+			self.misses += 1
+
+			try:
+				minified = minify_source(source.decode('utf-8')).encode('utf-8')
+			except (SyntaxError, ValueError, UnicodeDecodeError):
+				minified = None
+
+			if minified is not None:
+				self.cache.put(key, minified)
+
+		os.makedirs(os.path.dirname(dest) or '.', exist_ok=True)
+
+		with open(dest, 'wb') as file:
+			file.write(source if minified is None else minified)
+
+		self.source_bytes += len(source)
+		self.minified_bytes += len(source if minified is None else minified)
+
+		return minified is not None
@@ -13,6 +13,8 @@
 from __future__ import absolute_import
 
 import codecs
+import collections
+import contextlib
 import os
 import sys
 import threading
@@ -33,6 +35,8 @@ ANSI_COLOR_RESET = b'\x1b[0m'
 ANSI_UNDERLINE = b'\033[4m'
 ANSI_CLOSE = b'\033[0m'
 ABCONFIG_FILE_PREFIX = 'abc'
+RX_BUFFER_SIZE = 1024 * 1024    # received bytes waiting for the console, the oldest are dropped beyond this
+RENDER_INTERVAL = 1 / 30        # the console is written at most 30 times per second
 
 help = \
 b'''
@@ -44,48 +48,11 @@ b'''
     Ctrl-L - Run last file
     Ctrl-R - Run local file
     Ctrl-T - Run board file
+    Ctrl-W - Browse board files
     Ctrl-G - Run clipboard code
     Ctrl-U - Upload files to board\033[0m
 '''
 
-command_list_onboard_files = \
-b'''
-import os,sys
-file_list=[]
-def list_files(root='/'):
-  files=[]
-  for dir in os.listdir(root):
-    fullpath = ('' if root=='/' else root)+'/'+dir
-    if os.stat(fullpath)[0] & 0x4000 != 0:
-      files.extend(list_files(fullpath))
-    else:
-      if dir.endswith('.py'):
-        files.append(fullpath)
-  return files
-file_list = list_files()
-if len(file_list)>0:
-  print('\033[1;36mRun onboard file\033[0m')
-  for index,file in enumerate(file_list,start=1):
-    print('    [{}] {}'.format(index, file))
-  selected=None
-  while True:
-    try:
-      selected=int(input('Choose a file: '))
-      print('')
-      assert type(selected) is int and 0 < selected <= len(file_list)
-      break
-    except KeyboardInterrupt:
-      print('')
-      break
-    except:
-      pass
-  #print(file_list[selected-1])
-  if selected:
-    exec(open(file_list[selected-1]).read(), globals())
-else:
-  print('\033[1;33mNo py file on board\033[0m')
-'''
-
 try:
     raw_input
 except NameError:
@@ -277,6 +244,107 @@ TRANSFORMATIONS = {
 }
 
 
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+class RxBuffer(object):
+    '''(新增类)
+    串口读取线程和显示线程之间的有界缓冲区，按读取的数据块保存，
+    超过 size 时丢弃最旧的数据并计数，读取线程永远不会因为终端显示太慢而阻塞
+    '''
+
+    def __init__(self, size=RX_BUFFER_SIZE):
+        self.size = size
+        self._chunks = collections.deque()
+        self._length = 0
+        self._condition = threading.Condition()
+        self.received = 0
+        self.dropped = 0
+        self.drops = 0
+        self.peak = 0
+
+    def put(self, data):
+        with self._condition:
+            self._chunks.append(data)
+            self._length += len(data)
+            self.received += len(data)
+
+            if self._length > self.size:
+                self.drops += 1
+
+                while self._length > self.size:
+                    overflow = self._length - self.size
+                    chunk = self._chunks.popleft()
+
+                    if len(chunk) > overflow:
+                        self._chunks.appendleft(chunk[overflow:])
+                        chunk = chunk[:overflow]
+
+                    self._length -= len(chunk)
+                    self.dropped += len(chunk)
+
+            self.peak = max(self.peak, self._length)
+            self._condition.notify()
+
+    def take(self, timeout):
+        '''
+        最多等待 timeout 秒，取出缓冲区中的全部数据，同时返回到目前为止丢弃的总字节数
+        '''
+        with self._condition:
+            if not self._chunks:
+                self._condition.wait(timeout)
+
+            data = b''.join(self._chunks)
+            self._chunks.clear()
+            self._length = 0
+
+            return data, self.dropped
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+class RawReplFollower(object):
+    '''(新增类)
+    代码在 raw repl 中运行时过滤串口数据：去掉输出和错误信息后面的两个 \\x04，
+    代码运行结束后发送 ctrl-b 回到普通 repl，并隐藏回到普通 repl 时显示的版本信息，
+    超过 BANNER_LIMIT 字节还没有等到提示符时直接显示缓存的数据，不再过滤
+    '''
+    BANNER_LIMIT = 1024
+
+    def __init__(self, serial_instance):
+        self.serial = serial_instance
+        self.markers = 0
+        self.banner = bytearray()
+        self.done = False
+
+    def feed(self, data):
+        '''
+        返回需要显示的数据，done 为 True 后不再需要过滤
+        '''
+        shown = bytearray()
+
+        while data and self.markers < 2:
+            index = data.find(b'\x04')
+            if index < 0:
+                shown += data
+                data = b''
+            else:
+                shown += data[:index]
+                data = data[index + 1:]
+                self.markers += 1
+                if self.markers == 2:
+                    self.serial.write(b'\x02')   # ctrl-b: back to the friendly repl
+
+        if data:
+            self.banner += data
+            index = self.banner.find(b'\n>>> ')
+            if index >= 0:
+                shown += self.banner[index + 1:]
+                self.done = True
+            elif len(self.banner) > self.BANNER_LIMIT:
+                shown += self.banner
+                self.done = True
+
+        return bytes(shown)
+
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 class Miniterm(object):
     """\
@@ -298,8 +366,14 @@ class Miniterm(object):
         #self.menu_character = unichr(0x14)  # Menu: CTRL+T
         self.alive = None
         self._reader_alive = None
-        self._pause_reader = False
         self.receiver_thread = None
+        self.render_thread = None
+        self.rx_buffer = RxBuffer()
+        self.rendered = 0
+        self.frames = 0
+        self.capture = None
+        self.follower = None
+        self.raw_paste = True
         self.rx_decoder = None
         self.tx_decoder = None
         self.last_run = None
@@ -323,6 +397,10 @@ class Miniterm(object):
         """start worker threads"""
         self.alive = True
         self._start_reader()
+        # the console is written by its own thread, so the reader never waits for it
+        self.render_thread = threading.Thread(target=self.renderer, name='render')
+        self.render_thread.daemon = True
+        self.render_thread.start()
         # enter console->serial loop
         self.transmitter_thread = threading.Thread(target=self.writer, name='tx')
         self.transmitter_thread.daemon = True
@@ -340,6 +418,7 @@ class Miniterm(object):
             if hasattr(self.serial, 'cancel_read'):
                 self.serial.cancel_read()
             self.receiver_thread.join()
+            self.render_thread.join()
 
     def close(self):
         self.serial.close()
@@ -384,29 +463,78 @@ class Miniterm(object):
         sys.stderr.write('--- serial input encoding: {}\n'.format(self.input_encoding))
         sys.stderr.write('--- serial output encoding: {}\n'.format(self.output_encoding))
         sys.stderr.write('--- EOL: {}\n'.format(self.eol.upper()))
-        sys.stderr.write('--- filters: {}'.format(' '.join(self.filters)))
+        sys.stderr.write('--- filters: {}\n'.format(' '.join(self.filters)))
+        sys.stderr.write('--- rx: {} bytes received, {} bytes shown in {} frames\n'.format(
+            self.rx_buffer.received, self.rendered, self.frames))
+        sys.stderr.write('--- rx buffer: peak {} of {} bytes, {} bytes dropped in {} overruns'.format(
+            self.rx_buffer.peak, self.rx_buffer.size, self.rx_buffer.dropped, self.rx_buffer.drops))
+        if self.capture:
+            sys.stderr.write('\n--- capture: {} ({}), {} bytes written, {} bytes dropped, {} rotated segments'.format(
+                self.capture.path, 'raw' if self.capture.raw else 'text', self.capture.written,
+                self.capture.dropped, self.capture.segments))
+
+    def receive(self, data):
+        '''(新增函数)
+        处理从串口收到的数据：先交给 capture，再经过 follower 过滤后交给渲染线程显示，
+        读取线程和停止读取线程期间直接读取串口的代码都使用这个函数
+        '''
+        if self.capture:
+            # only queued here, written by the capture thread
+            self.capture.write(data)
+        if self.follower:
+            data = self.follower.feed(data)
+            if self.follower.done:
+                self.follower = None
+        if data:
+            self.rx_buffer.put(data)
 
     def reader(self):
-        """loop and copy serial->console"""
+        """loop and copy serial->rx buffer, the render thread shows it"""
         try:
             while self.alive and self._reader_alive:
                 # read all that is there or wait for one byte
                 data = self.serial.read(self.serial.in_waiting or 1)
                 if data:
-                    if self._pause_reader:
-                        continue
-                    if self.raw:
-                        self.console.write_bytes(data)
-                    else:
-                        text = self.rx_decoder.decode(data)
-                        for transformation in self.rx_transformations:
-                            text = transformation.rx(text)
-                        self.console.write(text)
+                    self.receive(data)
         except serial.SerialException:
             self.alive = False
             self.console.cancel()
             raise       # XXX handle instead of re-raise?
 
+    def renderer(self):
+        '''(新增函数)
+        每个 RENDER_INTERVAL 把收到的数据合并为一次解码、转换和终端写入，
+        终端跟不上时 RxBuffer 丢弃最旧的数据，这里显示丢弃了多少字节
+        '''
+        shown_dropped = 0
+        while self.alive:
+            frame_start = time.monotonic()
+            data, dropped = self.rx_buffer.take(RENDER_INTERVAL)
+
+            if dropped != shown_dropped:
+                # the decoder may hold half a character from before the gap
+                self.rx_decoder.reset()
+                self.console.write_bytes(ANSI_COLOR_YELLOW + '\r\n--- {} bytes dropped, console too slow ---\r\n'.format(
+                    dropped - shown_dropped).encode() + ANSI_COLOR_RESET)
+                shown_dropped = dropped
+
+            if not data:
+                continue
+
+            if self.raw:
+                self.console.write_bytes(data)
+            else:
+                text = self.rx_decoder.decode(data)
+                for transformation in self.rx_transformations:
+                    text = transformation.rx(text)
+                self.console.write(text)
+
+            self.rendered += len(data)
+            self.frames += 1
+
+            # let the next frame collect whatever arrives meanwhile
+            time.sleep(max(frame_start + RENDER_INTERVAL - time.monotonic(), 0))
+
     def send_tx_enter(self):
         '''(新增函数)
         发送一个模拟键盘输入的回车，用途是在换行时显示 repl 提示符前缀，也就是 >>>
@@ -463,7 +591,7 @@ class Miniterm(object):
                     assert type(selected) is int and 0 < selected <= len(file_list)
                     break
                 except EOFError:
-                    self.run_board_file(b'\n')
+                    self.send_tx_enter()
                     return
                 except:
                     pass
@@ -472,10 +600,73 @@ class Miniterm(object):
         else:
             self.show_tips('No local py file found')
 
+    def inject_code(self, code, follow=True):
+        '''(新增函数)
+        在开发板上运行代码，输出显示在终端中，所有运行代码的功能都使用这个函数，不使用固定的延时：
+
+        - 固件支持 raw-paste 模式时，在 raw repl 中按开发板确认的窗口发送代码，运行结束后回到普通 repl
+        - 否则使用 paste 模式（ctrl-e 进入， ctrl-d 完成），每发送一行等待开发板回显这一行
+
+        代码会复位开发板时 follow 设为 False，开发板复位后不会再输出运行结束的标记，输出直接显示
+        '''
+        from .pyboard import Pyboard, PyboardError, READ_TIMEOUT
+
+        # the reader must not take the acknowledgements and echoes from the board
+        self._stop_reader()
+        self.follower = None
+        timeout = self.serial.timeout
+        self.serial.timeout = READ_TIMEOUT
+        pyboard = Pyboard(self.serial)
+        pyboard.use_raw_paste = self.raw_paste
+
+        try:
+            if self.raw_paste:
+                pyboard.enter_raw_repl(soft_reset=False)
+                if not pyboard.read_until(1, b'>').endswith(b'>'):
+                    raise PyboardError('could not enter raw repl')
+                self.raw_paste = pyboard.enter_raw_paste()
+                if self.raw_paste:
+                    pyboard.raw_paste_write(code)
+                    if follow:
+                        self.follower = RawReplFollower(self.serial)
+                else:
+                    pyboard.exit_raw_repl()
+            else:
+                self.serial.write(b'\r\x03')   # ctrl-c: interrupt any running program
+
+            if not self.raw_paste:
+                self.serial.write(b'\x05')
+                if not pyboard.read_until(1, b'=== ').endswith(b'=== '):
+                    raise PyboardError('could not enter paste mode')
+                for line in code.replace(b'\r\n', b'\n').rstrip(b'\n').split(b'\n'):
+                    self.serial.write(line + b'\r')
+                    # the board echoes every line, followed by the next prompt,
+                    # the line itself may contain the prompt text
+                    echo = line + b'\r\n=== '
+                    if not pyboard.read_until(1, echo).endswith(echo):
+                        raise PyboardError('no echo in paste mode')
+                self.serial.write(b'\x04')
+        except PyboardError as pe:
+            self.follower = None
+            self.console.write('\033[1;33mRun code failed: {}\033[0m\n'.format(pe))
+            # don't leave the user at a raw repl or paste mode prompt
+            try:
+                self.serial.write(b'\x03')   # ctrl-c: abort raw-paste mode or cancel paste mode
+                if self.raw_paste:
+                    pyboard.exit_raw_repl()
+            except (serial.SerialException, OSError):
+                pass
+        finally:
+            # output which already arrived goes to the console first
+            data = pyboard.read_available()
+            if data:
+                self.receive(data)
+            self.serial.timeout = timeout
+            self._start_reader()
+
     def run_local_file(self, pyfile=None):
         '''(新增函数)
-        运行指定的本地 py 文件。
-        运行方式为 repl paste 模式（ctrl-e 进入， ctrl-d 完成）
+        运行指定的本地 py 文件
         '''
         pyfile = self.get_local_pyfile() if pyfile is None else pyfile
 
@@ -483,88 +674,190 @@ class Miniterm(object):
             with open(pyfile, 'rb') as file:
                 pyfile_data = file.read()
 
-            self._pause_reader = True
-            time.sleep(0.04)
-            self.serial.write(b"\x05")
-            time.sleep(0.04)
-
-            start_time = time.time()
-            for i in range(0, len(pyfile_data), 128):
-                self.serial.write(pyfile_data[i : min(i + 128, len(pyfile_data))])
-                time.sleep(0.04)
-
-            time.sleep(round(time.time() - start_time, 3))
-            self.serial.write(b"\x04")
-            # time.sleep(0.02)
-            self._pause_reader = False
-            # time.sleep(0.02)
             self.console.write_bytes(b'\r\n')
-            # time.sleep(0.02)
+            self.inject_code(pyfile_data)
 
             self.last_run = ('local', pyfile)
 
     def run_clipboard_code(self):
         '''(新增函数)
-        运行剪贴板中复制的代码。
-        运行方式为 repl paste 模式（ctrl-e 进入， ctrl-d 完成）
+        运行剪贴板中复制的代码
         '''
         self.show_title('Run clipboard code')
-        self._pause_reader = True
-        time.sleep(0.02)
-        self.serial.write(b'\x05')
         clip.OpenClipboard()
+        lines = []
         for line in clip.GetClipboardData().split('\r\n'):
             if line.strip('\t').startswith('#'):
                 continue
-            self.serial.write(line.replace('\t', '    ').encode() + b'\r')
-            self.serial.flush()
-            time.sleep(0.002)
+            lines.append(line.replace('\t', '    '))
         clip.CloseClipboard()
-        self.serial.write(b'\x04')
-        time.sleep(0.02)
-        self._pause_reader = False
-        time.sleep(0.02)
-        self.console.write_bytes(b'\r\n')
-        time.sleep(0.02)
-
-    def run_board_file(self, onboard_code=command_list_onboard_files):
+        self.inject_code('\n'.join(lines).encode())
+
+    @contextlib.contextmanager
+    def raw_repl_session(self):
         '''(新增函数)
-        运行指定的远程（开发板） py 文件，开发板上的目录结构相对简单所以会列出所有目录下的 py 文件。
-        运行方式为 repl paste 模式（ctrl-e 进入， ctrl-d 完成）
+        停止读取线程，在同一个串口上使用 Pyboard 进入 raw repl，退出时恢复终端
         '''
-        self._pause_reader = True
-        self.serial.write(b'\x05')
-        start_time = time.time()
-        for i in range(0, len(onboard_code), 128):
-            self.serial.write(onboard_code[i : min(i + 128, len(onboard_code))])
-            time.sleep(0.02)
-
-        time.sleep(round(time.time() - start_time, 3))
-
-        self.serial.write(b"\x04")
-        self._pause_reader = False
-
-    def run_code_on_board(self, onboard_code):
-        self.serial.write(b'\x05')
-        time.sleep(0.02)
-        lock = threading.Lock()
-        with lock:
-            for i in range(0, len(onboard_code), 128):
-                self.serial.write(onboard_code[i : min(i + 128, len(onboard_code))])
-                time.sleep(0.02)
-        self.serial.write(b"\x04")
-        # time.sleep(0.02)
-
-    def put_file(self, src, dest):
-        self.run_code_on_board(bytes("f=open('%s','wb')\nw=f.write" % dest, 'utf-8'))
-
-        with open(src, "rb") as f:
+        from .pyboard import Pyboard, READ_TIMEOUT
+
+        # the reader must not take the replies from the board
+        self._stop_reader()
+        timeout = self.serial.timeout
+        self.serial.timeout = READ_TIMEOUT
+        pyboard = Pyboard(self.serial)
+
+        try:
+            pyboard.enter_raw_repl(soft_reset=False)
+            yield pyboard
+        finally:
+            # back to the friendly repl even after an error, or the user is left at a raw prompt
+            try:
+                pyboard.exit_raw_repl()
+                data = pyboard.read_available()
+                if data:
+                    self.receive(data)
+            except (serial.SerialException, OSError):
+                pass
+            self.serial.timeout = timeout
+            self._start_reader()
+
+    def get_board_index(self, refresh=False):
+        '''(新增函数)
+        获取开发板文件系统索引，优先使用与命令行共用的缓存
+        '''
+        from .board_fs import BoardIndex, load_index, save_index
+
+        index = None if refresh else load_index(self.serial.port)
+
+        if index is None:
+            with self.raw_repl_session() as pyboard:
+                index = BoardIndex.build(pyboard)
+            save_index(self.serial.port, index)
+
+        return index
+
+    def get_board_pyfile(self):
+        '''(新增函数)
+        获取用户选择的开发板上的 py 文件，文件列表来自开发板文件系统索引，
+        选择 0 重新建立索引（文件被开发板上运行的代码或其它工具修改过时）
+        '''
+        from .pyboard import PyboardError
+
+        refresh = False
+        while True:
+            try:
+                file_list = self.get_board_index(refresh).py_files()
+            except PyboardError as pe:
+                self.show_tips('Read board files failed: {}'.format(pe))
+                return
+
+            if len(file_list) == 0:
+                if not refresh:
+                    # the cached index may be out of date, look once more
+                    refresh = True
+                    continue
+                self.show_tips('No py file on board')
+                return
+
+            self.show_title('Run onboard file')
+            print('    [0] Refresh list')
+            for index, file in enumerate(file_list, start=1):
+                print(f'    [{index}] {file}')
+
+            selected = None
             while True:
-                data = f.read(256)
-                if not data:
+                try:
+                    selected = int(input('Choose a file: '))
+                    assert type(selected) is int and 0 <= selected <= len(file_list)
                     break
-                self.run_code_on_board(bytes("w(" + repr(data) + ")", 'utf-8'))
-        self.run_code_on_board(b"f.close()")
+                except EOFError:
+                    self.send_tx_enter()
+                    return
+                except:
+                    pass
+
+            if selected:
+                return file_list[selected - 1]
+            refresh = True
+
+    def run_board_file(self, onboard_code=None):
+        '''(新增函数)
+        运行指定的远程（开发板） py 文件，不指定代码时从开发板上所有目录下的 py 文件中选择
+        '''
+        if onboard_code is None:
+            pyfile = self.get_board_pyfile()
+            if not pyfile:
+                return
+            self.console.write_bytes(b'\r\n')
+            onboard_code = 'exec(open({!r}).read(), globals())'.format(pyfile).encode()
+
+        self.inject_code(onboard_code)
+
+    def browse_board_files(self):
+        '''(新增函数)
+        使用开发板文件系统索引浏览开发板上的文件，支持 ls、tree、du 命令，refresh 重新建立索引，空行退出
+        '''
+        from .board_fs import FORMATTERS
+        from .pyboard import PyboardError
+
+        self.show_title('Browse board files')
+
+        try:
+            index = self.get_board_index()
+        except PyboardError as pe:
+            self.show_tips('Read board files failed: {}'.format(pe))
+            return
+
+        while True:
+            try:
+                command = input('ls, tree, du [PATH] or refresh: ').split()
+            except EOFError:
+                break
+
+            if not command:
+                break
+
+            if command[0] == 'refresh':
+                try:
+                    index = self.get_board_index(refresh=True)
+                except PyboardError as pe:
+                    print(f'    {pe}')
+                    continue
+                print(f'    {len(index.files)} files in {len(index.dirs)} dirs')
+            elif command[0] in FORMATTERS:
+                try:
+                    print('\n'.join(FORMATTERS[command[0]](index, command[1] if len(command) > 1 else '/')))
+                except ValueError as ve:
+                    print(f'    {ve}')
+            else:
+                print(f'    unknown command: {command[0]}')
+
+        self.send_tx_enter()
+
+    def upload_files(self, uploads, include_dirs):
+        '''(新增函数)
+        使用命令行上传的 bundle 模式上传文件，传输过程由开发板按 raw-paste 窗口确认，
+        上传期间停止读取线程，由 Pyboard 在同一个串口上进入 raw repl，完成后恢复终端，
+        返回上传的字节数和耗时
+        '''
+        from .__main__ import read_manifest, write_manifest, hash_file
+        from .board_fs import invalidate
+
+        start_time = time.time()
+        invalidate(self.serial.port)
+
+        with self.raw_repl_session() as pyboard:
+            manifest = read_manifest(pyboard) or {}
+            pyboard.fs_put_bundle(
+                include_dirs, uploads,
+                progress_callback=lambda index, dest: print(f'- uploading {dest} ({index}/{len(uploads)})'))
+            upload_time = time.time() - start_time
+
+            # keep the manifest of `ab --sync` up to date
+            manifest.update({dest: [os.path.getsize(src), hash_file(src)] for src, dest in uploads})
+            write_manifest(pyboard, manifest, 'bundle')
+
+        return sum([os.path.getsize(src) for src, _ in uploads]), upload_time
 
     def show_title(self, title):
         '''(新增函数)
@@ -595,6 +888,8 @@ class Miniterm(object):
                     break
                 elif c == self.exit_character:
                     self.stop()             # exit app
+                    if self.capture:
+                        self.capture.close()
                     os._exit(0)
                     break
                 elif c == unichr(0x19):     # CTRL + Y
@@ -607,16 +902,25 @@ class Miniterm(object):
                     self.run_clipboard_code()
                 elif c == unichr(0x18):     # CTRL + X
                     # 一键删除开发板 main.py 文件
-                    self._pause_reader = True
-                    time.sleep(0.04)
-                    self.serial.write(b"\x05")
-                    time.sleep(0.04)
-                    self.serial.write(
+                    from .board_fs import invalidate
+                    invalidate(self.serial.port)
+                    self.inject_code(
 b'''import os
 try:
   os.remove("main.py")
 except:
   pass
+try:
+  import json
+  f=open(".ab_manifest")
+  m=json.load(f)
+  f.close()
+  m["files"].pop("main.py",None)
+  f=open(".ab_manifest","w")
+  json.dump(m,f)
+  f.close()
+except:
+  pass
 import network
 sta=network.WLAN(network.STA_IF)
 if sta.active(): sta.active(False)
@@ -624,16 +928,13 @@ if sta.active(): sta.active(False)
 #sleep_ms(100)
 from machine import reset
 reset()
-'''
-)
-                    time.sleep(0.02)
-                    self.serial.write(b'\x04')
-                    self._pause_reader = False
-                    self.serial.write(b'\x04')
+''', follow=False)
                 elif c == unichr(0x12):     # CTRL + R
                     self.run_local_file()
                 elif c == unichr(0x14):     # CTRL + T
                     self.run_board_file()
+                elif c == unichr(0x17):     # CTRL + W
+                    self.browse_board_files()
                 elif c == unichr(0x15):      # CTRL + U
                     # upload files to board
                     self.show_title('Upload files')
@@ -658,14 +959,15 @@ reset()
                                 pass
 
                         if not selected:
-                            self.run_board_file(b'\n')
+                            self.send_tx_enter()
                             continue
                         abconfig = abconfig_list[selected - 1]
                     else:
                         self.show_tips('No ab config file found')
                         continue
 
-                    from .__main__ import parse_config_file, list_all_files_and_dirs, CMD_MKDIRS
+                    from .__main__ import parse_config_file, list_all_files_and_dirs
+                    from .pyboard import PyboardError
 
                     includes, excludes, run_file = parse_config_file(abconfig)
                     include_files, include_dirs, _ = list_all_files_and_dirs(includes, excludes)
@@ -674,25 +976,19 @@ reset()
                         self.show_tips('Nothing to do!')
                         continue
 
-                    cmd = CMD_MKDIRS.format(include_dirs, True)
-                    self.run_board_file(bytes(cmd, 'utf-8'))
-                    time.sleep(0.2)
-
-                    self._pause_reader = True
-                    time.sleep(0.2)
-                    for index, file in enumerate(include_files, start=1):
-                        print(f'- uploading {file} ({index}/{len(include_files)})')
-
-                        src = os.path.join(file)
-                        dest = file
-                        self.put_file(src, dest)
-
-                    self._pause_reader = False
-                    time.sleep(0.2)
+                    try:
+                        upload_bytes, upload_time = self.upload_files([(file, file) for file in include_files], include_dirs)
+                    except (PyboardError, serial.SerialException, OSError) as e:
+                        # keep the terminal usable, the reader stops by itself if the port is gone
+                        self.show_tips('Upload failed: {}'.format(e))
+                        continue
 
                     print('Upload Finished')
+                    rate = f'{upload_bytes / upload_time:.0f}' if upload_time else '-'
+                    print(f'- {upload_bytes} bytes in {upload_time:.2f}s, {rate} bytes/s (bundle)')
+
+                    # soft reset, so boot.py and main.py run with the new files
                     self.serial.write(b'\x04')
-                    time.sleep(0.2)
 
                     if run_file in include_files:
                         self.show_title('Run onboard file: {}'.format(run_file))
@@ -729,7 +1025,7 @@ reset()
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 # default args can be used to override when calling main() from an other script
 # e.g to create a miniterm-my-device.py
-def main(default_port=None, default_baudrate=115200, default_rts=False, default_dtr=False):
+def main(default_port=None, default_baudrate=115200, default_rts=False, default_dtr=False, capture=None):
     """Command line tool, entry point"""
     while True:
         try:
@@ -759,6 +1055,7 @@ def main(default_port=None, default_baudrate=115200, default_rts=False, default_
             break
 
     miniterm = Miniterm(serial_instance)
+    miniterm.capture = capture
     miniterm.raw = False
     miniterm.set_rx_encoding('UTF-8')
     miniterm.set_tx_encoding('UTF-8')
@@ -772,6 +1069,8 @@ def main(default_port=None, default_baudrate=115200, default_rts=False, default_
         pass
     miniterm.join()
     miniterm.close()
+    if capture:
+        capture.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,82 @@
+"""
+The MIT License (MIT)
+Copyright © 2021 Walkline Wang (https://walkline.wang)
+Gitee: https://gitee.com/walkline/a-batch-tool
+"""
+import importlib.util
+import shutil
+import subprocess
+import sys
+
+try:
+	from cache import ArtifactCache
+except ModuleNotFoundError:
+	from .cache import ArtifactCache
+
+# files which must be uploaded as source
+SOURCE_ONLY_FILES = ['main.py', 'boot.py']
+
+
+class MpyCrossError(Exception):
+	pass
+
+
+def find_mpy_cross():
+	'''
+	查找 mpy-cross 命令，优先使用 PATH 中的可执行文件，其次是 pip 安装的 mpy_cross 模块
+	'''
+	if shutil.which('mpy-cross'):
+		return ['mpy-cross']
+
+	if importlib.util.find_spec('mpy_cross'):
+		return [sys.executable, '-m', 'mpy_cross']
+
+	raise MpyCrossError('mpy-cross not found, install it with: pip install mpy-cross')
+
+
+class MpyCompiler(object):
+	'''
+	使用 mpy-cross 把 py 文件编译为 mpy 文件，编译结果以源文件内容、mpy-cross 版本和编译参数为键缓存
+	'''
+	def __init__(self, args=None, cache=None):
+		self.command = find_mpy_cross()
+		self.args = args or []
+		self.cache = cache or ArtifactCache('mpy')
+		self.hits = 0
+		self.misses = 0
+
+		try:
+			self.version = subprocess.run(self.command + ['--version'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT).stdout.decode().strip()
+		except OSError as ose:
+			raise MpyCrossError(str(ose))
+
+	@staticmethod
+	def should_compile(file):
+		return file.endswith('.py') and file not in SOURCE_ONLY_FILES
+
+	def compile(self, src, dest, source_name=None):
+		'''
+		返回编译后的 mpy 文件路径，缓存中没有时编译到 dest 并存入缓存，source_name 为 mpy 文件中记录的源文件名
+		'''
+		with open(src, 'rb') as file:
+			source = file.read()
+
+		# the source name is stored in the mpy file and shown in tracebacks
+		key = ArtifactCache.key(source, source_name or src, self.version, *self.args)
+		cached_file = self.cache.get(key)
+
+		if cached_file:
+			self.hits += 1
+			return cached_file
+
+		self.misses += 1
+		process = subprocess.run(
+			self.command + self.args + ['-s', source_name or src, '-o', dest, src],
+			stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+		)
+
+		if process.returncode != 0:
+			raise MpyCrossError(process.stdout.decode().strip())
+
+		with open(dest, 'rb') as file:
+			return self.cache.put(key, file.read())
@@ -0,0 +1,466 @@
+"""
+The MIT License (MIT)
+Copyright © 2021 Walkline Wang (https://walkline.wang)
+Gitee: https://gitee.com/walkline/a-batch-tool
+"""
+import base64
+import hmac
+import json
+import os
+import re
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+	from pyboard import Pyboard, PyboardError
+	from cache import default_cache_dir
+except ModuleNotFoundError:
+	from .pyboard import Pyboard, PyboardError
+	from .cache import default_cache_dir
+
+# attributes of Pyboard which can be read by a session
+REMOTE_ATTRIBUTES = ['raw_paste_window', 'stream_acks', 'in_raw_repl', 'serial.baudrate']
+START_TIMEOUT = 5
+LISTEN_HOST = '127.0.0.1'
+
+
+def state_dir():
+	return os.path.join(default_cache_dir(), 'daemon')
+
+def state_file(port):
+	'''
+	每个串口对应一个状态文件，保存服务监听的本机 TCP 端口和连接用的 token，
+	状态文件在用户目录下并且只有当前用户可以读取，其他用户无法连接服务
+	'''
+	name = re.sub(r'[^\w.-]', '_', port.strip('/'))
+	return os.path.join(state_dir(), f'{name}.json')
+
+def read_state(port):
+	try:
+		with open(state_file(port)) as file:
+			return json.load(file)
+	except (OSError, ValueError):
+		return None
+
+def write_state(port, state):
+	os.makedirs(state_dir(), exist_ok=True)
+
+	# mkstemp creates the file readable by the owner only
+	fd, temp_file = tempfile.mkstemp(dir=state_dir())
+	with os.fdopen(fd, 'w') as file:
+		json.dump(state, file)
+	os.replace(temp_file, state_file(port))
+
+def connect(port, timeout=None):
+	'''
+	连接服务并发送 token，没有状态文件时抛出 ConnectionRefusedError
+	'''
+	state = read_state(port)
+
+	if not state:
+		raise ConnectionRefusedError(f'no daemon for {port}')
+
+	sock = socket.create_connection((LISTEN_HOST, state['tcp_port']), timeout)
+
+	try:
+		sock.sendall(json.dumps({'token': state['token']}).encode() + b'\n')
+	except OSError:
+		sock.close()
+		raise
+
+	return sock
+
+def encode(value):
+	'''
+	把 bytes 转换为 json 可以表示的格式
+	'''
+	if isinstance(value, (bytes, bytearray)):
+		return {'__bytes__': base64.b64encode(value).decode()}
+
+	if isinstance(value, (list, tuple)):
+		return [encode(item) for item in value]
+
+	if isinstance(value, dict):
+		return {key: encode(item) for key, item in value.items()}
+
+	return value
+
+def decode(value):
+	if isinstance(value, dict):
+		if '__bytes__' in value:
+			return base64.b64decode(value['__bytes__'])
+
+		return {key: decode(item) for key, item in value.items()}
+
+	if isinstance(value, list):
+		return [decode(item) for item in value]
+
+	return value
+
+def send(file, message):
+	file.write(json.dumps(encode(message)).encode() + b'\n')
+	file.flush()
+
+def receive(file):
+	line = file.readline()
+
+	if not line:
+		raise EOFError('connection closed')
+
+	return decode(json.loads(line))
+
+def request(port, message, timeout=2):
+	'''
+	发送一个请求并返回应答，用于 ping 和 stop
+	'''
+	with connect(port, timeout) as sock:
+		file = sock.makefile('rwb')
+		send(file, message)
+		return receive(file)
+
+def is_running(port):
+	if not os.path.exists(state_file(port)):
+		return False
+
+	try:
+		return request(port, {'op': 'ping'}).get('ok', False)
+	except (OSError, EOFError, ValueError):
+		return False
+
+def list_running():
+	'''
+	返回当前用户所有正在运行的服务的串口
+	'''
+	ports = []
+
+	try:
+		names = sorted(os.listdir(state_dir()))
+	except OSError:
+		return ports
+
+	for name in names:
+		if not name.endswith('.json'):
+			continue
+
+		try:
+			with open(os.path.join(state_dir(), name)) as file:
+				port = json.load(file)['port']
+
+			request(port, {'op': 'ping'})
+		except (OSError, EOFError, ValueError, KeyError):
+			continue
+
+		ports.append(port)
+
+	return ports
+
+def start(port):
+	'''
+	在后台启动服务进程，等待服务可以连接后返回
+	'''
+	if is_running(port):
+		return True
+
+	package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+	env = dict(os.environ, PYTHONPATH=os.pathsep.join([package_dir, os.environ.get('PYTHONPATH', '')]).rstrip(os.pathsep))
+
+	subprocess.Popen(
+		[sys.executable, '-m', 'ab', '--daemon', 'run', '-p', port],
+		env=env,
+		stdin=subprocess.DEVNULL,
+		stdout=subprocess.DEVNULL,
+		stderr=subprocess.DEVNULL,
+		start_new_session=True,
+		creationflags=getattr(subprocess, 'DETACHED_PROCESS', 0)
+	)
+
+	deadline = time.monotonic() + START_TIMEOUT
+
+	while time.monotonic() < deadline:
+		if is_running(port):
+			return True
+
+		time.sleep(0.1)
+
+	return False
+
+def stop(port):
+	try:
+		return request(port, {'op': 'stop'}).get('ok', False)
+	except (OSError, EOFError, ValueError):
+		return False
+
+
+class BoardDaemon(object):
+	'''
+	保持串口和 Pyboard 连接，通过本机 TCP 端口提供以下服务，每个连接先发送状态文件中的 token：
+
+	- session：在连接期间独占串口，调用 Pyboard 的方法（上传、exec 等）
+	- attach：把串口输出转发给终端，并把终端输入写入串口，可以同时有多个终端
+	- ping、stop：查询状态和停止服务
+
+	没有 session 时由读取线程把串口输出转发给所有终端，session 期间终端的输入会等到 session 结束后再写入
+	'''
+	def __init__(self, port, baudrate=115200):
+		self.port = port
+		self.token = secrets.token_hex(16)
+		self.pyboard = Pyboard(port, baudrate)
+		self.serial_lock = threading.Lock()
+		self.session_waiting = False
+		self.terminals = []
+		self.terminals_lock = threading.Lock()
+		self.alive = True
+
+	def serve_forever(self):
+		self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.server.bind((LISTEN_HOST, 0))
+		self.server.listen()
+		self.server.settimeout(0.5)
+
+		write_state(self.port, {
+			'port': self.port,
+			'tcp_port': self.server.getsockname()[1],
+			'token': self.token,
+			'pid': os.getpid()
+		})
+
+		threading.Thread(target=self.reader, daemon=True).start()
+
+		try:
+			while self.alive:
+				try:
+					conn, _ = self.server.accept()
+				except socket.timeout:
+					continue
+
+				conn.settimeout(None)
+				threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+		finally:
+			self.server.close()
+
+			# a newer daemon may have replaced the state file
+			if (read_state(self.port) or {}).get('token') == self.token:
+				os.remove(state_file(self.port))
+
+			self.pyboard.close()
+
+	def reader(self):
+		while self.alive:
+			if self.session_waiting:
+				time.sleep(0.01)
+				continue
+
+			with self.serial_lock:
+				try:
+					data = self.pyboard.read_available(wait=True)
+				except Exception:
+					self.alive = False
+					break
+
+			if data:
+				with self.terminals_lock:
+					for terminal in list(self.terminals):
+						try:
+							terminal.sendall(data)
+						except OSError:
+							self.terminals.remove(terminal)
+
+	def handle(self, conn):
+		file = conn.makefile('rwb')
+
+		try:
+			if not hmac.compare_digest(str(receive(file).get('token')), self.token):
+				return
+
+			message = receive(file)
+			op = message.get('op')
+
+			if op == 'ping':
+				send(file, {'ok': True, 'port': self.port, 'terminals': len(self.terminals)})
+			elif op == 'stop':
+				self.alive = False
+				send(file, {'ok': True})
+			elif op == 'attach':
+				self.attach(conn, file)
+			elif op == 'session':
+				self.session(file)
+			else:
+				send(file, {'ok': False, 'error': f'unknown op {op}'})
+		except (OSError, EOFError, ValueError):
+			pass
+		finally:
+			file.close()
+			conn.close()
+
+	def attach(self, conn, file):
+		send(file, {'ok': True})
+
+		with self.terminals_lock:
+			self.terminals.append(conn)
+
+		try:
+			while self.alive:
+				data = conn.recv(4096)
+
+				if not data:
+					break
+
+				with self.serial_lock:
+					self.pyboard.serial.write(data)
+		finally:
+			with self.terminals_lock:
+				if conn in self.terminals:
+					self.terminals.remove(conn)
+
+	def session(self, file):
+		'''
+		daemon 的工作目录与客户端不同，RemotePyboard 发送的本地文件路径都是绝对路径
+		'''
+		self.session_waiting = True
+		self.serial_lock.acquire()
+		self.session_waiting = False
+
+		try:
+			send(file, {'ok': True})
+
+			while True:
+				try:
+					message = receive(file)
+				except EOFError:
+					break
+
+				self.call(file, message)
+		finally:
+			# never leave the board in raw REPL for the terminals
+			try:
+				if self.pyboard.in_raw_repl:
+					self.pyboard.exit_raw_repl()
+			except Exception:
+				pass
+
+			self.serial_lock.release()
+
+	def call(self, file, message):
+		try:
+			if 'get' in message:
+				if message['get'] not in REMOTE_ATTRIBUTES:
+					raise AttributeError(message['get'])
+
+				target = self.pyboard
+
+				for name in message['get'].split('.'):
+					target = getattr(target, name)
+
+				send(file, {'result': target})
+				return
+
+			method = message['method']
+
+			if method.startswith('_') or method == 'close':
+				raise AttributeError(method)
+
+			kwargs = message.get('kwargs', {})
+
+			if message.get('progress'):
+				kwargs['progress_callback'] = lambda index, dest: send(file, {'progress': [index, dest]})
+
+			target = self.pyboard.serial if method == 'serial.write' else self.pyboard
+			result = getattr(target, method.split('.')[-1])(*message.get('args', []), **kwargs)
+			send(file, {'result': result})
+		except (OSError, EOFError):
+			raise
+		except Exception as e:
+			send(file, {'error': type(e).__name__, 'args': list(e.args)})
+
+
+class RemoteSerial(object):
+	def __init__(self, pyboard):
+		self._pyboard = pyboard
+
+	@property
+	def baudrate(self):
+		return self._pyboard._get('serial.baudrate')
+
+	def write(self, data):
+		return self._pyboard._call('serial.write', data)
+
+
+class RemotePyboard(object):
+	'''
+	通过服务使用已经打开的串口，接口与 Pyboard 相同，close() 只断开与服务的连接
+	'''
+	def __init__(self, port):
+		self._sock = connect(port)
+		self._file = self._sock.makefile('rwb')
+		self.serial = RemoteSerial(self)
+
+		send(self._file, {'op': 'session'})
+
+		if not receive(self._file).get('ok'):
+			raise PyboardError('daemon refused the session')
+
+	def _request(self, message, progress_callback=None):
+		send(self._file, message)
+
+		while True:
+			reply = receive(self._file)
+
+			if 'progress' in reply:
+				if progress_callback:
+					progress_callback(*reply['progress'])
+
+				continue
+
+			if 'error' in reply:
+				if reply['error'] == 'PyboardError':
+					raise PyboardError(*reply['args'])
+
+				raise PyboardError(f'{reply["error"]}: {", ".join([str(arg) for arg in reply["args"]])}')
+
+			return reply['result']
+
+	def _get(self, name):
+		return self._request({'get': name})
+
+	def _call(self, method, *args, progress_callback=None, **kwargs):
+		message = {'method': method, 'args': list(args), 'kwargs': kwargs}
+
+		if progress_callback:
+			message['progress'] = True
+
+		result = self._request(message, progress_callback)
+
+		# json has no tuples
+		return tuple(result) if method == 'follow' else result
+
+	def __getattr__(self, name):
+		if name in REMOTE_ATTRIBUTES:
+			return self._get(name)
+
+		if name.startswith('_'):
+			raise AttributeError(name)
+
+		return lambda *args, **kwargs: self._call(name, *args, **kwargs)
+
+	# local paths are sent as absolute paths, the daemon runs in another directory
+
+	def fs_put(self, src, dest, **kwargs):
+		return self._call('fs_put', os.path.abspath(src), dest, **kwargs)
+
+	def fs_put_files(self, files, **kwargs):
+		return self._call('fs_put_files', [(os.path.abspath(src), dest) for src, dest in files], **kwargs)
+
+	def fs_put_bundle(self, dirs, files, **kwargs):
+		return self._call('fs_put_bundle', dirs, [(os.path.abspath(src), dest) for src, dest in files], **kwargs)
+
+	def execfile(self, filename):
+		return self._call('execfile', os.path.abspath(filename))
+
+	def close(self):
+		self._file.close()
+		self._sock.close()
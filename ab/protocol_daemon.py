@@ -0,0 +1,79 @@
+"""
+The MIT License (MIT)
+Copyright © 2021 Walkline Wang (https://walkline.wang)
+Gitee: https://gitee.com/walkline/a-batch-tool
+
+pyserial 的 daemon:// 协议，通过 ab 后台服务连接已经打开的串口，例如：
+
+	serial.protocol_handler_packages.append('ab')
+	serial.serial_for_url('daemon:///dev/ttyUSB0')
+"""
+import json
+import select
+
+from serial.serialutil import SerialException, PortNotOpenError
+
+from . import port_daemon
+from .socket_serial import SocketSerial
+
+
+class Serial(SocketSerial):
+	'''
+	串口参数由后台服务管理，这里的设置都会被忽略
+	'''
+	def open(self):
+		self._check_port()
+		port = self.from_url(self._port)
+
+		try:
+			self._socket = port_daemon.connect(port)
+			self._socket.sendall(b'{"op": "attach"}\n')
+
+			# read the reply unbuffered, board output follows right after it
+			reply = bytearray()
+
+			while not reply.endswith(b'\n'):
+				data = self._socket.recv(1)
+
+				if not data:
+					raise EOFError('connection closed')
+
+				reply += data
+
+			if not json.loads(reply).get('ok'):
+				raise SerialException(f'daemon refused to attach {port}')
+		except (OSError, EOFError, ValueError) as e:
+			raise SerialException(f'could not attach to daemon of {port}: {e}')
+
+		self.is_open = True
+
+	def close(self):
+		if self.is_open:
+			self.is_open = False
+			self._socket.close()
+
+	def from_url(self, url):
+		if not url.lower().startswith('daemon://'):
+			raise SerialException(f'expected a string in the form "daemon://PORT": {url!r}')
+
+		return url[len('daemon://'):]
+
+	def _receive(self, timeout):
+		if select.select([self._socket], [], [], timeout)[0]:
+			data = self._socket.recv(4096)
+
+			if not data:
+				raise SerialException('daemon closed the connection')
+
+			self._buffer += data
+			return True
+
+		return False
+
+	def write(self, data):
+		if not self.is_open:
+			raise PortNotOpenError()
+
+		self._socket.sendall(data)
+
+		return len(data)
@@ -0,0 +1,225 @@
+"""
+The MIT License (MIT)
+Copyright © 2021 Walkline Wang (https://walkline.wang)
+Gitee: https://gitee.com/walkline/a-batch-tool
+
+pyserial 的 webrepl:// 协议，通过 WiFi 连接开发板的 WebREPL，例如：
+
+	serial.protocol_handler_packages.append('ab')
+	serial.serial_for_url('webrepl://192.168.4.1:8266?password=python')
+
+不指定 password 时使用环境变量 AB_WEBREPL_PASSWORD
+"""
+import base64
+import os
+import select
+import socket
+import struct
+import time
+import urllib.parse
+
+from serial.serialutil import SerialException, PortNotOpenError
+
+from .socket_serial import SocketSerial
+
+DEFAULT_PORT = 8266
+PASSWORD_ENV = 'AB_WEBREPL_PASSWORD'
+CONNECT_TIMEOUT = 5
+
+# every write is split into frames no larger than this
+FRAME_SIZE = 1024
+
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xa
+
+
+def mask_payload(data, key):
+	'''
+	客户端发送的数据必须用 4 字节的 key 做异或，按大整数一次计算
+	'''
+	length = len(data)
+	key = (key * (length // 4 + 1))[:length]
+
+	return (int.from_bytes(data, 'big') ^ int.from_bytes(key, 'big')).to_bytes(length, 'big')
+
+def make_frame(opcode, payload):
+	if len(payload) < 126:
+		header = struct.pack('>BB', 0x80 | opcode, 0x80 | len(payload))
+	elif len(payload) < 0x10000:
+		header = struct.pack('>BBH', 0x80 | opcode, 0x80 | 126, len(payload))
+	else:
+		header = struct.pack('>BBQ', 0x80 | opcode, 0x80 | 127, len(payload))
+
+	key = os.urandom(4)
+
+	return header + key + mask_payload(payload, key)
+
+
+class Serial(SocketSerial):
+	'''
+	REPL 的输入输出都放在 websocket 的文本帧中，收到的帧先解析到缓冲区，读取的超时在这里处理，
+	串口参数对 WebREPL 没有意义，设置都会被忽略
+	'''
+	def open(self):
+		self._check_port()
+		host, port, path, password = self.from_url(self._port)
+		self._frames = bytearray()
+
+		try:
+			self._socket = socket.create_connection((host, port), timeout=CONNECT_TIMEOUT)
+		except OSError as e:
+			raise SerialException(f'could not connect to WebREPL {self._port}: {e}')
+
+		try:
+			self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+			self._handshake(host, port, path)
+			self._socket.settimeout(None)
+			self.is_open = True
+			self._login(password)
+		except (OSError, SerialException) as e:
+			self.is_open = False
+			self._socket.close()
+			raise SerialException(f'could not open WebREPL {self._port}: {e}')
+
+	def close(self):
+		if self.is_open:
+			self.is_open = False
+
+			try:
+				self._socket.sendall(make_frame(OPCODE_CLOSE, b''))
+			except OSError:
+				pass
+
+			self._socket.close()
+
+	def from_url(self, url):
+		parts = urllib.parse.urlsplit(url)
+
+		if parts.scheme != 'webrepl' or not parts.hostname:
+			raise SerialException(f'expected a string in the form "webrepl://HOST[:PORT][?password=PASSWORD]": {url!r}')
+
+		password = os.environ.get(PASSWORD_ENV)
+
+		for option, values in urllib.parse.parse_qs(parts.query).items():
+			if option == 'password':
+				password = values[0]
+			else:
+				raise SerialException(f'unknown option for webrepl://: {option!r}')
+
+		if password is None:
+			raise SerialException(f'no password for {url}, add ?password=... or set {PASSWORD_ENV}')
+
+		return parts.hostname, parts.port or DEFAULT_PORT, parts.path or '/', password
+
+	def _handshake(self, host, port, path):
+		key = base64.b64encode(os.urandom(16)).decode()
+		self._socket.sendall((
+			f'GET {path} HTTP/1.1\r\n'
+			f'Host: {host}:{port}\r\n'
+			'Connection: Upgrade\r\n'
+			'Upgrade: websocket\r\n'
+			f'Sec-WebSocket-Key: {key}\r\n'
+			'Sec-WebSocket-Version: 13\r\n'
+			'\r\n'
+		).encode())
+
+		response = bytearray()
+
+		while b'\r\n\r\n' not in response:
+			data = self._socket.recv(1024)
+
+			if not data:
+				raise SerialException('connection closed during handshake')
+
+			response += data
+
+		header, _, rest = bytes(response).partition(b'\r\n\r\n')
+
+		if header.split(b' ', 2)[1:2] != [b'101']:
+			raise SerialException(f'websocket handshake failed: {header.splitlines()[0].decode(errors="replace")}')
+
+		# frames sent right after the handshake
+		self._frames += rest
+		self._parse_frames()
+
+	def _login(self, password):
+		deadline = time.monotonic() + CONNECT_TIMEOUT
+
+		def read_until(*endings):
+			while not self._buffer.endswith(endings):
+				timeout = deadline - time.monotonic()
+
+				if timeout <= 0 or not self._receive(timeout):
+					raise SerialException('timeout waiting for WebREPL login')
+
+			data = bytes(self._buffer)
+			del self._buffer[:]
+
+			return data
+
+		read_until(b'Password: ')
+		self.write(password.encode() + b'\r')
+
+		if read_until(b'WebREPL connected\r\n>>> ', b'Access denied\r\n').endswith(b'Access denied\r\n'):
+			raise SerialException('WebREPL access denied, check the password')
+
+	def _parse_frames(self):
+		frames = self._frames
+
+		while len(frames) >= 2:
+			opcode = frames[0] & 0x0f
+			length = frames[1] & 0x7f
+			offset = 2
+
+			if length == 126:
+				if len(frames) < 4:
+					break
+
+				length, = struct.unpack_from('>H', frames, 2)
+				offset = 4
+			elif length == 127:
+				if len(frames) < 10:
+					break
+
+				length, = struct.unpack_from('>Q', frames, 2)
+				offset = 10
+
+			if len(frames) < offset + length:
+				break
+
+			payload = bytes(frames[offset:offset + length])
+			del frames[:offset + length]
+
+			if opcode in (OPCODE_CONTINUATION, OPCODE_TEXT, OPCODE_BINARY):
+				self._buffer += payload
+			elif opcode == OPCODE_PING:
+				self._socket.sendall(make_frame(OPCODE_PONG, payload))
+			elif opcode == OPCODE_CLOSE:
+				raise SerialException('WebREPL closed the connection')
+
+	def _receive(self, timeout):
+		if select.select([self._socket], [], [], timeout)[0]:
+			data = self._socket.recv(4096)
+
+			if not data:
+				raise SerialException('WebREPL closed the connection')
+
+			self._frames += data
+			self._parse_frames()
+			return True
+
+		return False
+
+	def write(self, data):
+		if not self.is_open:
+			raise PortNotOpenError()
+
+		# WebREPL passes text frames to the REPL, binary frames are its file transfer protocol
+		frames = [make_frame(OPCODE_TEXT, bytes(data[index:index + FRAME_SIZE])) for index in range(0, len(data), FRAME_SIZE)]
+		self._socket.sendall(b''.join(frames))
+
+		return len(data)
@@ -24,8 +24,17 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
+import binascii
+import os
+import struct
 import sys
 import time
+import zlib
+
+try:
+    from trace_events import span
+except ModuleNotFoundError:
+    from .trace_events import span
 
 stdout = sys.stdout.buffer
 
@@ -35,243 +44,770 @@ def stdout_write_bytes(b):
     stdout.flush()
 
 
+# Longest time a single blocking serial read may wait; read deadlines are
+# checked at least this often.
+READ_TIMEOUT = 0.05
+
+
 class PyboardError(Exception):
     pass
 
 
-class Pyboard:
-    def __init__(self, device, baudrate=115200, wait=0, exclusive=True):
+# Board side inflater shared by FS_RECEIVER and FS_UNPACKER, uses the deflate
+# module of newer firmware and falls back to zlib.DecompIO.
+FS_INFLATE = """\
+import io, micropython, sys
+try:
+  from deflate import DeflateIO, RAW
+  _inflate = lambda b: DeflateIO(io.BytesIO(b), RAW, 10)
+except ImportError:
+  try:
+    from zlib import DecompIO
+    _inflate = lambda b: DecompIO(io.BytesIO(b), -10)
+  except ImportError:
+    _inflate = None
+"""
+
+# Receiver run on the board by Pyboard.fs_put_files.  It reads length-prefixed
+# frames from stdin: a 2 byte block size first, then per file a 7 byte header
+# (path length, payload size, compressed flag) followed by the path and the
+# payload in blocks.  Every header and block is acknowledged with 0x01 as soon
+# as it has been read, so the host never has more than one block in flight.
+# A compressed payload is a sequence of length-prefixed raw deflate units
+# (1 KB window) which are inflated one by one straight into the file.  A zero
+# path length ends the stream.  Errors are collected and raised once the
+# stream is drained.
+FS_RECEIVER = FS_INFLATE + """\
+def _recv():
+  r = sys.stdin.buffer.read
+  a = sys.stdout.write
+  w = int.from_bytes(r(2), 'little')
+  o = memoryview(bytearray(512))
+  e = None
+  while True:
+    h = r(7)
+    n = int.from_bytes(h[:2], 'little')
+    if not n:
+      break
+    s = int.from_bytes(h[2:6], 'little')
+    c = h[6]
+    p = r(n).decode()
+    try:
+      f = open(p, 'wb')
+    except OSError as ex:
+      f = None
+      e = e or '{}: {}'.format(p, ex)
+    a('\\x01')
+    z = bytearray()
+    while s:
+      b = r(min(w, s))
+      a('\\x01')
+      s -= len(b)
+      if not f:
+        continue
+      try:
+        if not c:
+          f.write(b)
+          continue
+        z += b
+        while len(z) > 2 and len(z) >= (z[0] | z[1] << 8) + 2:
+          k = (z[0] | z[1] << 8) + 2
+          d = _inflate(z[2:k])
+          while True:
+            m = d.readinto(o)
+            if not m:
+              break
+            f.write(o[:m])
+          z = z[k:]
+      except Exception as ex:
+        f.close()
+        f = None
+        e = e or '{}: {}'.format(p, ex)
+    if f:
+      f.close()
+  if e:
+    raise OSError(e)
+micropython.kbd_intr(-1)
+try:
+  _recv()
+finally:
+  micropython.kbd_intr(3)
+"""
+
+# Unpacks a bundle: the whole file set as one archive.  The archive is
+# preceded by the block size and its total length, and is sent in blocks
+# which are acked with 0x01 regardless of entry boundaries.  Each entry has
+# a 7-byte header (type, path length, size) and the path, files are followed
+# by their payload.  Type 1 is a directory, 2 a file, 3 a compressed file and
+# 0 ends the archive.
+FS_UNPACKER = FS_INFLATE + """\
+import os
+def _unpack():
+  r = sys.stdin.buffer.read
+  a = sys.stdout.write
+  h = r(6)
+  w = h[0] | h[1] << 8
+  v = [memoryview(b''), int.from_bytes(h[2:], 'little')]
+  def g(n):
+    if not v[0]:
+      k = min(w, v[1])
+      v[0] = memoryview(r(k))
+      v[1] -= k
+      a('\\x01')
+    d = v[0][:n]
+    v[0] = v[0][len(d):]
+    return d
+  def x(n):
+    d = bytearray()
+    while len(d) < n:
+      d += g(n - len(d))
+    return d
+  o = memoryview(bytearray(512))
+  e = None
+  while True:
+    h = x(7)
+    y = h[0]
+    if not y:
+      break
+    n = h[1] | h[2] << 8
+    s = int.from_bytes(h[3:], 'little')
+    p = str(x(n), 'utf8')
+    if y == 1:
+      try:
+        os.mkdir(p)
+      except OSError as ex:
+        if ex.args[0] != 17:
+          e = e or '{}: {}'.format(p, ex)
+      continue
+    try:
+      f = open(p, 'wb')
+    except OSError as ex:
+      f = None
+      e = e or '{}: {}'.format(p, ex)
+    z = bytearray()
+    while s:
+      b = g(s)
+      s -= len(b)
+      if not f:
+        continue
+      try:
+        if y == 2:
+          f.write(b)
+          continue
+        z += b
+        while len(z) > 2 and len(z) >= (z[0] | z[1] << 8) + 2:
+          k = (z[0] | z[1] << 8) + 2
+          d = _inflate(z[2:k])
+          while True:
+            m = d.readinto(o)
+            if not m:
+              break
+            f.write(o[:m])
+          z = z[k:]
+      except Exception as ex:
+        f.close()
+        f = None
+        e = e or '{}: {}'.format(p, ex)
+    if f:
+      f.close()
+  if e:
+    raise OSError(e)
+micropython.kbd_intr(-1)
+try:
+  _unpack()
+finally:
+  micropython.kbd_intr(3)
+"""
+
+# Raw data per independently compressed unit, the board needs about twice
+# this much RAM while inflating.
+COMPRESS_UNIT_SIZE = 4096
+
+
+def compress_units(data):
+    # Raw deflate with a 1 KB window, so the board can inflate it with little
+    # RAM, split in independent units each prefixed by its length.
+    units = bytearray()
+    for i in range(0, len(data), COMPRESS_UNIT_SIZE):
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -10)
+        unit = compressor.compress(data[i : i + COMPRESS_UNIT_SIZE]) + compressor.flush()
+        units += struct.pack("<H", len(unit)) + unit
+    return bytes(units)
+
+
+# Switches the board's REPL UART to a new baud rate.  The host answers with a
+# 0x06 probe byte at the new rate; if the probe does not arrive in time the
+# board switches back to the old rate by itself, so the link is never lost.
+BAUDRATE_SWITCH = """\
+import machine, select, sys, time
+time.sleep_ms(50)
+machine.UART({uart_id}, {baudrate})
+p = select.poll()
+p.register(sys.stdin, select.POLLIN)
+ok = False
+t = time.ticks_ms()
+while not ok and time.ticks_diff(time.ticks_ms(), t) < {timeout}:
+  if p.poll(10):
+    ok = sys.stdin.buffer.read(1) == b'\\x06'
+if not ok:
+  machine.UART({uart_id}, {old_baudrate})
+print('ok' if ok else 'fail')
+"""
+
+
+# I/O requests yielded by the PyboardProtocol generators, see PyboardProtocol.
+WRITE = "write"  # (WRITE, data): write all of data
+FILL = "fill"  # (FILL, timeout): wait up to timeout for more input in _rx_buffer, True if any arrived
+POLL = "poll"  # (POLL,): move input that is already waiting into _rx_buffer without blocking
+SLEEP = "sleep"  # (SLEEP, seconds)
+
+# Operations every driver provides, each one runs the PyboardProtocol
+# generator of the same name with a "_g_" prefix.
+PROTOCOL_METHODS = (
+    "read_available",
+    "read_until",
+    "enter_raw_repl",
+    "exit_raw_repl",
+    "set_baudrate",
+    "follow",
+    "enter_raw_paste",
+    "raw_paste_write",
+    "exec_raw_no_follow",
+    "exec_raw",
+    "eval",
+    "exec_",
+    "execfile",
+    "fs_put",
+    "fs_decompress_supported",
+    "fs_put_files",
+    "fs_put_bundle",
+)
+
+
+class PyboardProtocol:
+    # The raw REPL protocol without any I/O.  Every operation is a generator
+    # which yields the I/O requests above to the driver running it and gets
+    # their result back, received data is kept in _rx_buffer.  Pyboard runs
+    # the generators with blocking serial calls, AsyncPyboard (aiopyboard.py)
+    # from an asyncio event loop, so both speak exactly the same protocol.
+    def __init__(self):
         self.in_raw_repl = False
         self.use_raw_paste = True
+        self.raw_paste_window = None
+        self._rx_buffer = bytearray()
+        self.stream_acks = 0
+
+    def _g_read_available(self, wait=False):
+        # everything received so far, with wait=True block up to the serial
+        # read timeout for the first byte
+        if wait and not self._rx_buffer:
+            yield (FILL, READ_TIMEOUT)
+        yield (POLL,)
+        data = bytes(self._rx_buffer)
+        del self._rx_buffer[:]
+        return data
 
-        if True:
-            import serial
-
-            # Set options, and exclusive if pyserial supports it
-            serial_kwargs = {"baudrate": baudrate, "interCharTimeout": 1}
-            if serial.__version__ >= "3.3":
-                serial_kwargs["exclusive"] = exclusive
-
-            delayed = False
-            for attempt in range(wait + 1):
-                try:
-                    self.serial = serial.Serial(None, **serial_kwargs)
-                    self.serial.port = device
-                    self.serial.rts = False
-                    self.serial.dtr = False
-                    self.serial.open()
-                    break
-                except (OSError, IOError):  # Py2 and Py3 have different errors
-                    if wait == 0:
-                        continue
-                    if attempt == 0:
-                        sys.stdout.write("Waiting {} seconds for pyboard ".format(wait))
-                        delayed = True
-                time.sleep(1)
-                sys.stdout.write(".")
-                sys.stdout.flush()
-            else:
-                if delayed:
-                    print("")
-                raise PyboardError("failed to access " + device)
-            if delayed:
-                print("")
-
-    def close(self):
-        self.serial.close()
+    def _g_in_waiting(self):
+        yield (POLL,)
+        return len(self._rx_buffer)
+
+    def _g_fill(self, deadline):
+        # Wait for more input until the deadline, the read timeout of the
+        # driver may end the wait earlier.
+        timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+        return (yield (FILL, timeout))
+
+    def _g_read(self, num_bytes, timeout=10):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while len(self._rx_buffer) < num_bytes:
+            if (yield from self._g_fill(deadline)):
+                deadline = None if timeout is None else time.monotonic() + timeout
+            elif deadline is not None and time.monotonic() >= deadline:
+                break
+        data = bytes(self._rx_buffer[:num_bytes])
+        del self._rx_buffer[:num_bytes]
+        return data
 
-    def read_until(self, min_num_bytes, ending, timeout=10, data_consumer=None):
+    def _g_read_until(self, min_num_bytes, ending, timeout=10, data_consumer=None):
         # if data_consumer is used then data is not accumulated and the ending must be 1 byte long
         assert data_consumer is None or len(ending) == 1
 
-        data = self.serial.read(min_num_bytes)
-        if data_consumer:
-            data_consumer(data)
-        timeout_count = 0
+        # timeout is the allowed idle time, the deadline moves on whenever data arrives
+        deadline = None if timeout is None else time.monotonic() + timeout
+        data = b""
         while True:
-            if data.endswith(ending):
-                break
-            elif self.serial.inWaiting() > 0:
-                new_data = self.serial.read(1)
+            if self._rx_buffer:
                 if data_consumer:
-                    data_consumer(new_data)
-                    data = new_data
+                    index = self._rx_buffer.find(ending)
+                    end = len(self._rx_buffer) if index < 0 else index + 1
+                    data_consumer(bytes(self._rx_buffer[:end]))
+                    del self._rx_buffer[:end]
+                    if index >= 0:
+                        return ending
+                else:
+                    start = max(0, len(data) - len(ending) + 1, min_num_bytes - len(ending))
+                    data += self._rx_buffer
+                    index = data.find(ending, start)
+                    if index >= 0:
+                        end = index + len(ending)
+                        self._rx_buffer[:] = data[end:]
+                        return data[:end]
+                    self._rx_buffer.clear()
+            if (yield from self._g_fill(deadline)):
+                deadline = None if timeout is None else time.monotonic() + timeout
+            elif deadline is not None and time.monotonic() >= deadline:
+                return data
+
+    def _g_flush_input(self):
+        # flush input (without relying on serial.flushInput())
+        yield (POLL,)
+        self._rx_buffer.clear()
+
+    def _g_drain(self, quiet=0.1):
+        # discard input until the line has been quiet for the given time
+        deadline = time.monotonic() + quiet
+        while time.monotonic() < deadline:
+            if (yield from self._g_fill(deadline)):
+                self._rx_buffer.clear()
+                deadline = time.monotonic() + quiet
+
+    def _g_enter_raw_repl(self, soft_reset=True, attempts=10):
+        with span("enter_raw_repl", soft_reset=soft_reset):
+            # Instead of fixed sleeps, interrupt the board and ask for the raw REPL
+            # prompt right away, and only retry if it doesn't answer in time (e.g.
+            # it is still booting after the port was opened).
+            retried = False
+            for attempt in range(attempts):
+                yield from self._g_flush_input()
+                yield (WRITE, b"\r\x03\x03")  # ctrl-C twice: interrupt any running program
+                yield (WRITE, b"\r\x01")  # ctrl-A: enter raw REPL
+                data = yield from self._g_read_until(1, b"raw REPL; CTRL-B to exit\r\n", timeout=0.5)
+                if data.endswith(b"raw REPL; CTRL-B to exit\r\n"):
+                    if not retried:
+                        break
+                    # Late answers to earlier attempts may still be on the way, wait
+                    # for the line to go quiet and ask once more for a clean prompt.
+                    yield from self._g_drain()
+                    retried = False
                 else:
-                    data = data + new_data
-                timeout_count = 0
+                    retried = True
             else:
-                timeout_count += 1
-                if timeout is not None and timeout_count >= 100 * timeout:
-                    break
-                time.sleep(0.01)
-        return data
-
-    def enter_raw_repl(self, soft_reset=True):
-        time.sleep(0.3)
-        self.serial.write(b"\r\x03\x03")  # ctrl-C twice: interrupt any running program
-        time.sleep(0.1)
-        self.serial.write(b"\x03\x03")  # ctrl-C twice: interrupt any running program
-        time.sleep(0.1)
+                print(data)
+                raise PyboardError("could not enter raw repl")
 
-        # flush input (without relying on serial.flushInput())
-        n = self.serial.inWaiting()
-        while n > 0:
-            self.serial.read(n)
-            n = self.serial.inWaiting()
+            if soft_reset:
+                yield from self._g_soft_reset()
 
-        self.serial.write(b"\r\x01")  # ctrl-A: enter raw REPL
+            self.in_raw_repl = True
 
-        if soft_reset:
-            data = self.read_until(1, b"raw REPL; CTRL-B to exit\r\n>")
-            if not data.endswith(b"raw REPL; CTRL-B to exit\r\n>"):
+    def _g_soft_reset(self):
+        with span("soft_reset"):
+            data = yield from self._g_read_until(1, b">")
+            if not data.endswith(b">"):
                 print(data)
                 raise PyboardError("could not enter raw repl")
 
-            self.serial.write(b"\x04")  # ctrl-D: soft reset
+            yield (WRITE, b"\x04")  # ctrl-D: soft reset
 
             # Waiting for "soft reboot" independently to "raw REPL" (done below)
             # allows boot.py to print, which will show up after "soft reboot"
             # and before "raw REPL".
-            data = self.read_until(1, b"soft reboot\r\n")
+            data = yield from self._g_read_until(1, b"soft reboot\r\n")
             if not data.endswith(b"soft reboot\r\n"):
                 print(data)
                 raise PyboardError("could not enter raw repl")
 
-        data = self.read_until(1, b"raw REPL; CTRL-B to exit\r\n")
-        if not data.endswith(b"raw REPL; CTRL-B to exit\r\n"):
-            print(data)
-            raise PyboardError("could not enter raw repl")
-
-        self.in_raw_repl = True
+            data = yield from self._g_read_until(1, b"raw REPL; CTRL-B to exit\r\n")
+            if not data.endswith(b"raw REPL; CTRL-B to exit\r\n"):
+                print(data)
+                raise PyboardError("could not enter raw repl")
 
-    def exit_raw_repl(self):
-        self.serial.write(b"\r\x02")  # ctrl-B: enter friendly REPL
+    def _g_exit_raw_repl(self):
+        yield (WRITE, b"\r\x02")  # ctrl-B: enter friendly REPL
         self.in_raw_repl = False
 
-    def follow(self, timeout, data_consumer=None):
-        # wait for normal output
-        data = self.read_until(1, b"\x04", timeout=timeout, data_consumer=data_consumer)
-        if not data.endswith(b"\x04"):
-            raise PyboardError("timeout waiting for first EOF reception")
-        data = data[:-1]
-
-        # wait for error output
-        data_err = self.read_until(1, b"\x04", timeout=timeout)
-        if not data_err.endswith(b"\x04"):
-            raise PyboardError("timeout waiting for second EOF reception")
-        data_err = data_err[:-1]
+    def _g_set_baudrate(self, baudrate, uart_id=0, timeout=1000):
+        # Must be in raw REPL.  Returns True if both ends now run at baudrate,
+        # False if the probe failed and both ends are back at the old rate.
+        with span("set_baudrate", baudrate=baudrate):
+            old_baudrate = self.serial.baudrate
+            yield from self._g_exec_raw_no_follow(
+                BAUDRATE_SWITCH.format(
+                    uart_id=uart_id, baudrate=baudrate, old_baudrate=old_baudrate, timeout=timeout
+                )
+            )
+            try:
+                self.serial.baudrate = baudrate
+                yield (SLEEP, 0.1)
+                yield (WRITE, b"\x06")
+                ret, ret_err = yield from self._g_follow(timeout=1)
+                if ret.strip() == b"ok" and not ret_err:
+                    return True
+            except (PyboardError, ValueError, OSError):
+                pass
 
-        # return normal and error output
-        return data, data_err
+            # Probe failed, wait for the board to fall back and resync the raw REPL.
+            self.serial.baudrate = old_baudrate
+            yield (SLEEP, timeout / 1000 + 0.2)
+            yield from self._g_enter_raw_repl(soft_reset=False)
+            return False
+
+    def _g_follow(self, timeout, data_consumer=None):
+        with span("follow") as follow_span:
+            # wait for normal output
+            data = yield from self._g_read_until(1, b"\x04", timeout=timeout, data_consumer=data_consumer)
+            if not data.endswith(b"\x04"):
+                raise PyboardError("timeout waiting for first EOF reception")
+            data = data[:-1]
+
+            # wait for error output
+            data_err = yield from self._g_read_until(1, b"\x04", timeout=timeout)
+            if not data_err.endswith(b"\x04"):
+                raise PyboardError("timeout waiting for second EOF reception")
+            data_err = data_err[:-1]
+
+            # return normal and error output
+            follow_span.set(received=len(data) + len(data_err))
+            return data, data_err
+
+    def _g_enter_raw_paste(self):
+        # Must be at the raw REPL prompt.  Returns True in raw-paste mode, or
+        # False still in the raw REPL if the device doesn't support it.
+        if not self.use_raw_paste:
+            return False
+
+        # Try to enter raw-paste mode.
+        yield (WRITE, b"\x05A\x01")
+        data = yield from self._g_read(2)
+        if data == b"R\x01":
+            return True
+        if data != b"R\x00":
+            # Device doesn't understand the raw-paste command, resync the raw REPL.
+            data = yield from self._g_read_until(1, b"w REPL; CTRL-B to exit\r\n>")
+            if not data.endswith(b"w REPL; CTRL-B to exit\r\n>"):
+                print(data)
+                raise PyboardError("could not enter raw repl")
+        # Don't try to use raw-paste mode again for this connection.
+        self.use_raw_paste = False
+        return False
 
-    def raw_paste_write(self, command_bytes):
+    def _g_raw_paste_write(self, command_bytes):
         # Read initial header, with window size.
-        data = self.serial.read(2)
+        data = yield from self._g_read(2)
         window_size = data[0] | data[1] << 8
         window_remain = window_size
+        self.raw_paste_window = window_size
 
         # Write out the command_bytes data.
         i = 0
         while i < len(command_bytes):
-            while window_remain == 0 or self.serial.inWaiting():
-                data = self.serial.read(1)
-                if data == b"\x01":
-                    # Device indicated that a new window of data can be sent.
-                    window_remain += window_size
-                elif data == b"\x04":
-                    # Device indicated abrupt end.  Acknowledge it and finish.
-                    self.serial.write(b"\x04")
-                    return
-                else:
-                    # Unexpected data from device.
-                    raise PyboardError("unexpected read during raw paste: {}".format(data))
+            with span("window_wait", window=window_size):
+                while window_remain == 0 or (yield from self._g_in_waiting()):
+                    data = yield from self._g_read(1)
+                    if data == b"\x01":
+                        # Device indicated that a new window of data can be sent.
+                        window_remain += window_size
+                    elif data == b"\x04":
+                        # Device indicated abrupt end.  Acknowledge it and finish.
+                        yield (WRITE, b"\x04")
+                        return
+                    else:
+                        # Unexpected data from device.
+                        raise PyboardError("unexpected read during raw paste: {}".format(data))
             # Send out as much data as possible that fits within the allowed window.
             b = command_bytes[i : min(i + window_remain, len(command_bytes))]
-            self.serial.write(b)
+            yield (WRITE, b)
             window_remain -= len(b)
             i += len(b)
 
         # Indicate end of data.
-        self.serial.write(b"\x04")
+        yield (WRITE, b"\x04")
 
         # Wait for device to acknowledge end of data.
-        data = self.read_until(1, b"\x04")
+        data = yield from self._g_read_until(1, b"\x04")
         if not data.endswith(b"\x04"):
             raise PyboardError("could not complete raw paste: {}".format(data))
 
-    def exec_raw_no_follow(self, command):
+    def _g_exec_raw_no_follow(self, command):
         if isinstance(command, bytes):
             command_bytes = command
         else:
             command_bytes = bytes(command, encoding="utf8")
 
         # check we have a prompt
-        data = self.read_until(1, b">")
+        data = yield from self._g_read_until(1, b">")
         if not data.endswith(b">"):
             raise PyboardError("could not enter raw repl")
 
-        if self.use_raw_paste:
-            # Try to enter raw-paste mode.
-            self.serial.write(b"\x05A\x01")
-            data = self.serial.read(2)
-            if data == b"R\x00":
-                # Device understood raw-paste command but doesn't support it.
-                pass
-            elif data == b"R\x01":
-                # Device supports raw-paste mode, write out the command using this mode.
-                return self.raw_paste_write(command_bytes)
-            else:
-                # Device doesn't support raw-paste, fall back to normal raw REPL.
-                data = self.read_until(1, b"w REPL; CTRL-B to exit\r\n>")
-                if not data.endswith(b"w REPL; CTRL-B to exit\r\n>"):
-                    print(data)
-                    raise PyboardError("could not enter raw repl")
-            # Don't try to use raw-paste mode again for this connection.
-            self.use_raw_paste = False
+        if (yield from self._g_enter_raw_paste()):
+            # Device supports raw-paste mode, write out the command using this mode.
+            return (yield from self._g_raw_paste_write(command_bytes))
 
         # Write command using standard raw REPL, 256 bytes every 10ms.
         for i in range(0, len(command_bytes), 256):
-            self.serial.write(command_bytes[i : min(i + 256, len(command_bytes))])
-            time.sleep(0.01)
-        self.serial.write(b"\x04")
+            yield (WRITE, command_bytes[i : min(i + 256, len(command_bytes))])
+            yield (SLEEP, 0.01)
+        yield (WRITE, b"\x04")
 
         # check if we could exec command
-        data = self.serial.read(2)
+        data = yield from self._g_read(2)
         if data != b"OK":
             raise PyboardError("could not exec command (response: %r)" % data)
 
-    def exec_raw(self, command, timeout=10, data_consumer=None):
-        self.exec_raw_no_follow(command)
-        return self.follow(timeout, data_consumer)
+    def _g_exec_raw(self, command, timeout=10, data_consumer=None):
+        # "send" covers the raw-paste transfer, "follow" the run on the board
+        with span("exec", bytes=len(command)):
+            with span("send", bytes=len(command)):
+                yield from self._g_exec_raw_no_follow(command)
+            return (yield from self._g_follow(timeout, data_consumer))
 
-    def eval(self, expression):
-        ret = self.exec_("print({})".format(expression))
+    def _g_eval(self, expression):
+        ret = yield from self._g_exec_("print({})".format(expression))
         ret = ret.strip()
         return ret
 
-    def exec_(self, command, data_consumer=None):
-        ret, ret_err = self.exec_raw(command, data_consumer=data_consumer)
+    def _g_exec_(self, command, data_consumer=None):
+        ret, ret_err = yield from self._g_exec_raw(command, data_consumer=data_consumer)
         if ret_err:
             raise PyboardError("exception", ret, ret_err)
         return ret
 
-    def execfile(self, filename):
+    def _g_execfile(self, filename):
         with open(filename, "rb") as f:
             pyfile = f.read()
-        return self.exec_(pyfile)
-
-    def fs_put(self, src, dest, chunk_size=256):
-        self.exec_("f=open('%s','wb')\nw=f.write" % dest)
-        with open(src, "rb") as f:
-            while True:
-                data = f.read(chunk_size)
-                if not data:
+        return (yield from self._g_exec_(pyfile))
+
+    def _g_fs_put(self, src, dest, chunk_size=256, encoding="repr"):
+        # encoding "repr" sends bytes literals, "base64" sends base64 text which
+        # the board decodes with binascii.a2b_base64, close to 4/3 bytes per byte
+        with span("file", dest=dest, bytes=os.path.getsize(src)):
+            if encoding == "base64":
+                yield from self._g_exec_("from binascii import a2b_base64\nf=open('%s','wb')\nw=lambda d:f.write(a2b_base64(d))" % dest)
+            elif encoding == "repr":
+                yield from self._g_exec_("f=open('%s','wb')\nw=f.write" % dest)
+            else:
+                raise PyboardError("unknown transfer encoding: {}".format(encoding))
+            with open(src, "rb") as f:
+                while True:
+                    data = f.read(chunk_size)
+                    if not data:
+                        break
+                    if encoding == "base64":
+                        yield from self._g_exec_("w(" + repr(binascii.b2a_base64(data).rstrip()) + ")")
+                    elif sys.version_info < (3,):
+                        yield from self._g_exec_("w(b" + repr(data) + ")")
+                    else:
+                        yield from self._g_exec_("w(" + repr(data) + ")")
+            yield from self._g_exec_("f.close()")
+
+    def _g_stream_ack(self):
+        with span("ack_wait"):
+            data = yield from self._g_read(1)
+        if data == b"\x01":
+            self.stream_acks += 1
+            return
+        if data == b"\x04":
+            # The receiver stopped early, collect its error output.
+            data_err = yield from self._g_read_until(1, b"\x04")
+            raise PyboardError("exception", b"", data_err[:-1])
+        raise PyboardError("unexpected read during stream upload: {}".format(data))
+
+    def _g_fs_decompress_supported(self):
+        # whether the receiver can inflate compressed payloads on this board
+        try:
+            yield from self._g_exec_("try:\n import deflate\nexcept ImportError:\n import zlib\n zlib.DecompIO")
+        except PyboardError:
+            return False
+        return True
+
+    def _g_fs_put_files(self, files, block_size=None, progress_callback=None, compress=False):
+        # Upload a list of (src, dest) files through one receiver program, with
+        # one acknowledgement per block instead of one exec per chunk.  The
+        # block size defaults to the raw-paste window, which is what the board
+        # can buffer on stdin.  With compress, every file is deflated on the
+        # host and sent compressed unless that doesn't make it smaller.
+        # Returns the number of payload bytes sent.
+        yield from self._g_exec_raw_no_follow(FS_RECEIVER)
+        block_size = block_size or self.raw_paste_window or 256
+        self.stream_acks = 0
+        yield (WRITE, struct.pack("<H", block_size))
+        sent_bytes = 0
+        for index, (src, dest) in enumerate(files, start=1):
+            if progress_callback:
+                progress_callback(index, dest)
+            with open(src, "rb") as f:
+                data = f.read()
+            compressed = False
+            if compress:
+                units = compress_units(data)
+                if len(units) < len(data):
+                    data = units
+                    compressed = True
+            dest_bytes = dest.encode("utf8")
+            with span("file", dest=dest, bytes=len(data), compressed=compressed):
+                yield (WRITE, struct.pack("<HIB", len(dest_bytes), len(data), compressed) + dest_bytes)
+                yield from self._g_stream_ack()
+                for i in range(0, len(data), block_size):
+                    yield (WRITE, data[i : i + block_size])
+                    yield from self._g_stream_ack()
+            sent_bytes += len(data)
+        yield (WRITE, struct.pack("<HIB", 0, 0, 0))
+        ret, ret_err = yield from self._g_follow(timeout=10)
+        if ret_err:
+            raise PyboardError("exception", ret, ret_err)
+        return sent_bytes
+
+    def _g_fs_put_bundle(self, dirs, files, block_size=None, progress_callback=None, compress=False):
+        # Pack dirs and files into one archive and send it as a single stream,
+        # the board creates the dirs and writes the files while unpacking.
+        archive = bytearray()
+        starts = []
+        sent_bytes = 0
+        for dest in dirs:
+            dest_bytes = dest.encode("utf8")
+            archive += struct.pack("<BHI", 1, len(dest_bytes), 0) + dest_bytes
+        for src, dest in files:
+            with open(src, "rb") as f:
+                data = f.read()
+            entry_type = 2
+            if compress:
+                units = compress_units(data)
+                if len(units) < len(data):
+                    data = units
+                    entry_type = 3
+            dest_bytes = dest.encode("utf8")
+            starts.append(len(archive))
+            archive += struct.pack("<BHI", entry_type, len(dest_bytes), len(data)) + dest_bytes
+            archive += data
+            sent_bytes += len(data)
+        archive += struct.pack("<BHI", 0, 0, 0)
+
+        yield from self._g_exec_raw_no_follow(FS_UNPACKER)
+        block_size = block_size or self.raw_paste_window or 256
+        self.stream_acks = 0
+        yield (WRITE, struct.pack("<HI", block_size, len(archive)))
+        index = 0
+        with span("bundle", bytes=len(archive), files=len(files)):
+            for i in range(0, len(archive), block_size):
+                while progress_callback and index < len(starts) and starts[index] < i + block_size:
+                    index += 1
+                    progress_callback(index, files[index - 1][1])
+                yield (WRITE, archive[i : i + block_size])
+                yield from self._g_stream_ack()
+        ret, ret_err = yield from self._g_follow(timeout=10)
+        if ret_err:
+            raise PyboardError("exception", ret, ret_err)
+        return sent_bytes
+
+
+def _blocking_method(name):
+    generator = getattr(PyboardProtocol, "_g_" + name)
+
+    def method(self, *args, **kwargs):
+        return self._run(generator(self, *args, **kwargs))
+
+    method.__name__ = name
+    return method
+
+
+class Pyboard(PyboardProtocol):
+    def __init__(self, device, baudrate=115200, wait=0, exclusive=True):
+        super().__init__()
+
+        if not isinstance(device, str):
+            # An already opened serial-like object, used as it is.
+            self.serial = device
+            return
+
+        with span("open", device=device):
+            import serial
+
+            # Set options, and exclusive if pyserial supports it
+            serial_kwargs = {"baudrate": baudrate, "interCharTimeout": 1, "timeout": READ_TIMEOUT}
+            if serial.__version__ >= "3.3":
+                serial_kwargs["exclusive"] = exclusive
+
+            delayed = False
+            for attempt in range(wait + 1):
+                try:
+                    if "://" in device:
+                        # URLs (socket://, rfc2217://, and the handlers registered in
+                        # serial.protocol_handler_packages) bring their own transport,
+                        # which does the buffering and honours the read timeout.
+                        self.serial = serial.serial_for_url(device, do_not_open=True, **serial_kwargs)
+                    else:
+                        self.serial = serial.Serial(None, **serial_kwargs)
+                        self.serial.port = device
+                    self.serial.rts = False
+                    self.serial.dtr = False
+                    self.serial.open()
                     break
-                if sys.version_info < (3,):
-                    self.exec_("w(b" + repr(data) + ")")
-                else:
-                    self.exec_("w(" + repr(data) + ")")
-        self.exec_("f.close()")
+                except (OSError, IOError) as e:  # Py2 and Py3 have different errors
+                    error = e
+                    if wait == 0:
+                        continue
+                    if attempt == 0:
+                        sys.stdout.write("Waiting {} seconds for pyboard ".format(wait))
+                        delayed = True
+                time.sleep(1)
+                sys.stdout.write(".")
+                sys.stdout.flush()
+            else:
+                if delayed:
+                    print("")
+                # network transports explain what went wrong, e.g. a wrong password
+                raise PyboardError("failed to access {}: {}".format(device, error))
+            if delayed:
+                print("")
+
+    def close(self):
+        self.serial.close()
+
+    def _run(self, generator):
+        # Run a protocol generator, answering its I/O requests with blocking
+        # serial calls, errors are raised inside the generator.
+        result = error = None
+        while True:
+            try:
+                request = generator.throw(error) if error else generator.send(result)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                result, error = self._io(*request), None
+            except Exception as e:
+                result, error = None, e
+
+    def _io(self, op, arg=None):
+        if op == WRITE:
+            self.serial.write(arg)
+        elif op == FILL:
+            # bounded by the serial read timeout rather than arg
+            return self._fill()
+        elif op == POLL:
+            n = self.serial.inWaiting()
+            while n > 0:
+                self._rx_buffer += self.serial.read(n)
+                n = self.serial.inWaiting()
+        elif op == SLEEP:
+            time.sleep(arg)
+
+    def _fill(self):
+        # Block until at least one byte is available (bounded by the serial
+        # read timeout), then take everything that is waiting in one read.
+        n = self.serial.inWaiting()
+        if n == 0:
+            data = self.serial.read(1)
+            if not data:
+                return False
+            self._rx_buffer += data
+            n = self.serial.inWaiting()
+        if n > 0:
+            self._rx_buffer += self.serial.read(n)
+        return True
+
+
+for _name in PROTOCOL_METHODS:
+    setattr(Pyboard, _name, _blocking_method(_name))
 
 # in Python2 exec is a keyword so one must use "exec_"
 # but for Python3 we want to provide the nicer version "exec"
@@ -0,0 +1,94 @@
+"""
+The MIT License (MIT)
+Copyright © 2021 Walkline Wang (https://walkline.wang)
+Gitee: https://gitee.com/walkline/a-batch-tool
+
+daemon:// 和 webrepl:// 协议共用的基类，数据通过 socket 收发，没有真正的串口参数和控制线
+"""
+import time
+
+from serial.serialutil import SerialBase, SerialException, PortNotOpenError
+
+
+class SocketSerial(SerialBase):
+	'''
+	子类实现 open()、close()、write() 和 _receive(timeout)，
+	_receive() 把收到的数据放到 self._buffer 中，有新数据时返回 True，超时返回 False，
+	读取的超时在这里处理，串口参数的设置都会被忽略
+	'''
+	def _check_port(self):
+		if self.is_open:
+			raise SerialException('Port is already open.')
+
+		if self._port is None:
+			raise SerialException('Port must be configured before it can be used.')
+
+		self._buffer = bytearray()
+
+	def _receive(self, timeout):
+		raise NotImplementedError
+
+	def _reconfigure_port(self, force_update=False):
+		pass
+
+	@property
+	def in_waiting(self):
+		if not self.is_open:
+			raise PortNotOpenError()
+
+		while self._receive(0):
+			pass
+
+		return len(self._buffer)
+
+	def read(self, size=1):
+		if not self.is_open:
+			raise PortNotOpenError()
+
+		deadline = None if self._timeout is None else time.monotonic() + self._timeout
+
+		while len(self._buffer) < size:
+			timeout = None if deadline is None else deadline - time.monotonic()
+
+			if timeout is not None and timeout <= 0:
+				break
+
+			if not self._receive(timeout):
+				break
+
+		data = bytes(self._buffer[:size])
+		del self._buffer[:size]
+
+		return data
+
+	def reset_input_buffer(self):
+		self.in_waiting
+		del self._buffer[:]
+
+	def reset_output_buffer(self):
+		pass
+
+	def _update_break_state(self):
+		pass
+
+	def _update_rts_state(self):
+		pass
+
+	def _update_dtr_state(self):
+		pass
+
+	@property
+	def cts(self):
+		return False
+
+	@property
+	def dsr(self):
+		return False
+
+	@property
+	def ri(self):
+		return False
+
+	@property
+	def cd(self):
+		return False
@@ -0,0 +1,149 @@
+"""
+The MIT License (MIT)
+Copyright © 2021 Walkline Wang (https://walkline.wang)
+Gitee: https://gitee.com/walkline/a-batch-tool
+
+记录上传过程中每个阶段的耗时，保存为 Chrome/Perfetto 可以打开的 trace event JSON 文件
+（chrome://tracing 或 https://ui.perfetto.dev），或者按阶段汇总耗时和传输速率：
+
+	trace_events.enable()
+
+	with trace_events.span('exec', bytes=len(command)) as span:
+		...
+		span.set(received=len(output))
+
+	trace_events.save('upload.json')
+
+没有调用 enable() 时 span() 返回一个什么都不做的对象，几乎没有额外开销
+"""
+import json
+import os
+import threading
+import time
+
+
+class Tracer(object):
+	'''
+	收集所有线程的 span，每个线程对应 trace 中的一行，可以用 name_thread() 命名（如串口名称）
+	'''
+	def __init__(self):
+		self.events = []
+		self._lock = threading.Lock()
+		self._start = time.perf_counter()
+
+	def timestamp(self, perf_time):
+		# trace event 的时间单位为微秒
+		return (perf_time - self._start) * 1000000
+
+	def add(self, name, start, end, args):
+		event = {
+			'name': name,
+			'ph': 'X',
+			'ts': self.timestamp(start),
+			'dur': (end - start) * 1000000,
+			'pid': os.getpid(),
+			'tid': threading.get_ident(),
+			'args': args
+		}
+
+		with self._lock:
+			self.events.append(event)
+
+	def name_thread(self, name):
+		with self._lock:
+			self.events.append({
+				'name': 'thread_name',
+				'ph': 'M',
+				'pid': os.getpid(),
+				'tid': threading.get_ident(),
+				'args': {'name': name}
+			})
+
+	def save(self, filename):
+		with open(filename, 'w') as file:
+			json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, file)
+
+	def stats(self):
+		'''
+		按名称汇总所有 span，返回 {名称: [次数, 总耗时（秒）, 字节数]}，按第一次出现的顺序排列
+		'''
+		result = {}
+
+		for event in self.events:
+			if event['ph'] != 'X':
+				continue
+
+			item = result.setdefault(event['name'], [0, 0, 0])
+			item[0] += 1
+			item[1] += event['dur'] / 1000000
+			item[2] += event['args'].get('bytes', 0)
+
+		return result
+
+
+class Span(object):
+	__slots__ = ('tracer', 'name', 'args', 'start')
+
+	def __init__(self, tracer, name, args):
+		self.tracer = tracer
+		self.name = name
+		self.args = args
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type is not None:
+			self.args['error'] = exc_type.__name__
+
+		self.tracer.add(self.name, self.start, time.perf_counter(), self.args)
+
+	def set(self, **args):
+		self.args.update(args)
+
+
+class NullSpan(object):
+	__slots__ = ()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		pass
+
+	def set(self, **args):
+		pass
+
+
+NULL_SPAN = NullSpan()
+tracer = None
+
+
+def enable():
+	global tracer
+
+	tracer = Tracer()
+	return tracer
+
+def span(name, **args):
+	'''
+	args 中的 bytes 用来计算 stats 中的传输速率
+	'''
+	return NULL_SPAN if tracer is None else Span(tracer, name, args)
+
+def name_thread(name):
+	if tracer is not None:
+		tracer.name_thread(name)
+
+def save(filename):
+	tracer.save(filename)
+
+def format_stats():
+	lines = [f'    {"PHASE":<16}  {"COUNT":>6}  {"TIME":>8}  {"BYTES":>9}  {"BYTES/S":>9}']
+
+	for name, (count, seconds, total_bytes) in tracer.stats().items():
+		rate = f'{total_bytes / seconds:.0f}' if total_bytes and seconds else '-'
+		lines.append(f'    {name:<16}  {count:>6}  {seconds:>7.3f}s  {total_bytes or "-":>9}  {rate:>9}')
+
+	return '\n'.join(lines)
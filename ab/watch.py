@@ -0,0 +1,119 @@
+"""
+The MIT License (MIT)
+Copyright © 2021 Walkline Wang (https://walkline.wang)
+Gitee: https://gitee.com/walkline/a-batch-tool
+"""
+import os
+import select
+import sys
+import time
+
+# wait this long without new events before handling a burst of saves
+DEBOUNCE_TIME = 0.2
+POLL_INTERVAL = 0.5
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, 'O_CLOEXEC', 0)
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+class InotifyWatcher(object):
+	'''
+	使用 Linux inotify 监视文件夹（不递归），通过 ctypes 调用 libc，不需要安装其它模块
+	'''
+	def __init__(self):
+		import ctypes, ctypes.util
+
+		self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+		self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+
+		if self._fd < 0:
+			raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+		self._dirs = set()
+
+	def add(self, dir):
+		if dir in self._dirs:
+			return
+
+		if self._libc.inotify_add_watch(self._fd, os.fsencode(dir), WATCH_MASK) >= 0:
+			self._dirs.add(dir)
+
+	def _drain(self):
+		try:
+			while os.read(self._fd, 65536):
+				pass
+		except BlockingIOError:
+			pass
+
+	def wait(self, timeout):
+		'''
+		等待文件变化，有变化时一直等到 DEBOUNCE_TIME 内没有新的变化才返回 True，超时返回 False
+		'''
+		if not select.select([self._fd], [], [], timeout)[0]:
+			return False
+
+		self._drain()
+
+		while select.select([self._fd], [], [], DEBOUNCE_TIME)[0]:
+			self._drain()
+
+		return True
+
+	def close(self):
+		os.close(self._fd)
+
+
+class PollingWatcher(object):
+	'''
+	不支持 inotify 时每隔 POLL_INTERVAL 对比一次 snapshot() 的返回值
+	'''
+	def __init__(self, snapshot):
+		self._snapshot = snapshot
+		self._last = snapshot()
+		self._next_poll = time.monotonic() + POLL_INTERVAL
+
+	def add(self, dir):
+		pass
+
+	def wait(self, timeout):
+		time.sleep(max(min(self._next_poll - time.monotonic(), timeout), 0))
+
+		if time.monotonic() < self._next_poll:
+			return False
+
+		self._next_poll = time.monotonic() + POLL_INTERVAL
+		current = self._snapshot()
+
+		if current == self._last:
+			return False
+
+		while True:
+			time.sleep(DEBOUNCE_TIME)
+			self._last, current = current, self._snapshot()
+
+			if current == self._last:
+				return True
+
+	def close(self):
+		pass
+
+
+def create_watcher(snapshot):
+	'''
+	Linux 使用 inotify，其它系统或 inotify 不可用时使用轮询
+	'''
+	if sys.platform.startswith('linux'):
+		try:
+			return InotifyWatcher()
+		except (OSError, AttributeError):
+			pass
+
+	return PollingWatcher(snapshot)
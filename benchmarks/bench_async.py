@@ -0,0 +1,112 @@
+"""
+The MIT License (MIT)
+Copyright © 2021 Walkline Wang (https://walkline.wang)
+Gitee: https://gitee.com/walkline/a-batch-tool
+
+对比每块开发板一个线程（Pyboard）和一个事件循环（AsyncPyboard）同时操作多块开发板的性能（仅支持 Linux/macOS）
+
+	python benchmarks/bench_async.py [BOARDS]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ab.pyboard import Pyboard
+from ab.aiopyboard import AsyncPyboard
+from simboard import SimBoard
+
+BOARDS = 32
+EXEC_COUNT = 50
+OUTPUT_SIZE = 256
+FILE_SIZE = 4 * 1024
+
+
+def work_with_thread(device, filename):
+	pyboard = Pyboard(device)
+
+	try:
+		pyboard.enter_raw_repl(soft_reset=False)
+
+		for _ in range(EXEC_COUNT):
+			pyboard.exec_(f"print('x' * {OUTPUT_SIZE})")
+
+		pyboard.fs_put(filename, 'bench.bin')
+		pyboard.exit_raw_repl()
+	finally:
+		pyboard.close()
+
+async def work_with_loop(device, filename):
+	pyboard = AsyncPyboard(device)
+
+	try:
+		await pyboard.enter_raw_repl(soft_reset=False)
+
+		for _ in range(EXEC_COUNT):
+			await pyboard.exec_(f"print('x' * {OUTPUT_SIZE})")
+
+		await pyboard.fs_put(filename, 'bench.bin')
+		await pyboard.exit_raw_repl()
+	finally:
+		pyboard.close()
+
+def run_threads(devices, filename):
+	with ThreadPoolExecutor(max_workers=len(devices)) as executor:
+		list(executor.map(lambda device: work_with_thread(device, filename), devices))
+
+def run_loop(devices, filename):
+	async def main():
+		await asyncio.gather(*[work_with_loop(device, filename) for device in devices])
+
+	asyncio.run(main())
+
+def measure(function, *args):
+	peak_threads = [threading.active_count()]
+	done = threading.Event()
+
+	def sample():
+		while not done.wait(0.01):
+			peak_threads[0] = max(peak_threads[0], threading.active_count())
+
+	sampler = threading.Thread(target=sample)
+	sampler.start()
+	start_time, start_cpu = time.perf_counter(), time.process_time()
+
+	try:
+		function(*args)
+	finally:
+		done.set()
+		sampler.join()
+
+	# the sampler thread itself is not part of the result
+	return time.perf_counter() - start_time, time.process_time() - start_cpu, peak_threads[0] - 1
+
+def main():
+	boards_count = int(sys.argv[1]) if len(sys.argv) > 1 else BOARDS
+	boards = [SimBoard(throttle=False, latency=0.001, window=256).start() for _ in range(boards_count)]
+	devices = [board.device for board in boards]
+
+	with tempfile.NamedTemporaryFile(delete=False) as file:
+		file.write(os.urandom(FILE_SIZE))
+
+	try:
+		print(f'{boards_count} boards, {EXEC_COUNT} exec_ with {OUTPUT_SIZE}B output and fs_put {FILE_SIZE // 1024}KB each')
+		print(f'{"":<10}{"wall (s)":>10}{"cpu (s)":>10}{"threads":>10}')
+
+		for name, function in (('threads', run_threads), ('asyncio', run_loop)):
+			wall_time, cpu_time, threads = measure(function, devices, file.name)
+			print(f'{name:<10}{wall_time:>10.2f}{cpu_time:>10.2f}{threads:>10}')
+	finally:
+		for board in boards:
+			board.stop()
+
+		os.remove(file.name)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,130 @@
+"""
+The MIT License (MIT)
+Copyright © 2021 Walkline Wang (https://walkline.wang)
+Gitee: https://gitee.com/walkline/a-batch-tool
+
+对比 list_all_files_and_dirs 改为集合、os.scandir 和匹配规则前后的性能，
+在临时文件夹中生成约 10k 和 100k 个文件和文件夹
+
+	python benchmarks/bench_list_files.py [ENTRIES ...]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ab.__main__ import iter_all_files, list_all_files_and_dirs
+
+FILES_PER_DIR = 48
+SUBDIRS_PER_DIR = 40
+EXCLUDES = ['lib/d0', '**/*.pyc']
+
+
+def old_list_all_files_and_dirs(includes, excludes):
+	'''
+	改动前的实现，使用列表判断是否已存在
+	'''
+	dir_list = []
+	file_list = []
+	bad_list = []
+
+	for include in includes:
+		if not os.path.exists(include):
+			bad_list.append(include)
+			continue
+
+		if os.path.isdir(include):
+			for root, _, files in os.walk(include):
+				if root in excludes:
+					continue
+
+				for file in files:
+					full_path = os.path.join(root, file)
+
+					if full_path not in excludes:
+						file_list.append(full_path)
+		else:
+			if include not in excludes:
+				file_list.append(include)
+
+	for file in file_list:
+		splited_path = os.path.split(file)[0].split(os.path.sep)
+
+		for index in range(len(splited_path) + 1):
+			full_path = os.path.sep.join(splited_path[:index])
+
+			if full_path not in dir_list and full_path:
+				dir_list.append(full_path)
+
+	for items in [file_list, dir_list, bad_list]:
+		for index, item in enumerate(items):
+			items[index] = item.replace('\\', '/')
+
+	file_list.sort()
+	dir_list.sort()
+	bad_list.sort()
+
+	if 'main.py' in file_list:
+		file_list.remove('main.py')
+		file_list.append('main.py')
+
+	return file_list, dir_list, bad_list
+
+def make_tree(root, entries):
+	'''
+	生成两层文件夹，每个文件夹下 FILES_PER_DIR 个文件，返回实际生成的数量
+	'''
+	count = 0
+	top = 0
+
+	while count < entries:
+		for sub in range(SUBDIRS_PER_DIR):
+			dir = os.path.join(root, 'lib', f'd{top}', f's{sub}')
+			os.makedirs(dir)
+			count += 1
+
+			for index in range(FILES_PER_DIR):
+				open(os.path.join(dir, f'm{index}.py' if index % 8 else f'm{index}.pyc'), 'w').close()
+
+			count += FILES_PER_DIR
+
+		top += 1
+		count += 1
+
+	open(os.path.join(root, 'main.py'), 'w').close()
+
+	return count + 1
+
+def measure(function, *args):
+	start_time = time.perf_counter()
+	result = function(*args)
+	return time.perf_counter() - start_time, result
+
+def main():
+	sizes = [int(size) for size in sys.argv[1:]] or [10000, 100000]
+	cwd = os.getcwd()
+
+	print(f'{"ENTRIES":>8}  {"FILES":>7}  {"old (s)":>8}  {"new (s)":>8}  {"first file (ms)":>16}')
+
+	for size in sizes:
+		root = tempfile.mkdtemp(prefix='ab_bench_')
+
+		try:
+			entries = make_tree(root, size)
+			os.chdir(root)
+
+			old_time, _ = measure(old_list_all_files_and_dirs, ['lib', 'main.py'], EXCLUDES)
+			new_time, (files, _, _) = measure(list_all_files_and_dirs, ['lib', 'main.py'], EXCLUDES)
+			first_time, _ = measure(next, iter_all_files(['lib', 'main.py'], EXCLUDES))
+
+			print(f'{entries:>8}  {len(files):>7}  {old_time:>8.2f}  {new_time:>8.2f}  {first_time * 1000:>16.2f}')
+		finally:
+			os.chdir(cwd)
+			shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+	main()
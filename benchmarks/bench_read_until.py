@@ -0,0 +1,88 @@
+"""
+The MIT License (MIT)
+Copyright © 2021 Walkline Wang (https://walkline.wang)
+Gitee: https://gitee.com/walkline/a-batch-tool
+
+对比 Pyboard.read_until 改为缓冲读取前后的性能（仅支持 Linux/macOS），
+改动前的 Pyboard 直接从 git 读取（默认为 BASELINE_REV），需要在 git 仓库中运行
+
+	python benchmarks/bench_read_until.py [REV]
+"""
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ab.pyboard import Pyboard
+from simboard import SimBoard
+
+# ab/pyboard.py right before read_until was buffered
+BASELINE_REV = '38c68ea~1'
+EXEC_COUNT = 100
+HANDSHAKE_COUNT = 10
+OUTPUT_SIZE = 512
+FILE_SIZE = 16 * 1024
+
+
+def load_baseline(rev):
+	'''
+	从 git 读取 rev 版本的 ab/pyboard.py，使用它原来的 read_until、串口参数和 enter_raw_repl 中的延时
+	'''
+	root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+	source = subprocess.check_output(['git', 'show', f'{rev}:ab/pyboard.py'], cwd=root)
+	spec = importlib.util.spec_from_loader('baseline_pyboard', loader=None)
+	module = importlib.util.module_from_spec(spec)
+	exec(compile(source, f'{rev}:ab/pyboard.py', 'exec'), module.__dict__)
+
+	return module.Pyboard
+
+
+def timeit(func, count):
+	start_time = time.perf_counter()
+	for _ in range(count):
+		func()
+	return (time.perf_counter() - start_time) / count
+
+
+def run(pyboard_class, board, filename):
+	pyboard = pyboard_class(board.device)
+	pyboard.enter_raw_repl(soft_reset=False)
+
+	results = [
+		timeit(lambda: pyboard.enter_raw_repl(), HANDSHAKE_COUNT),
+		timeit(lambda: pyboard.exec_('pass'), EXEC_COUNT),
+		timeit(lambda: pyboard.exec_(f"print('x' * {OUTPUT_SIZE})"), EXEC_COUNT),
+		timeit(lambda: pyboard.fs_put(filename, 'bench.bin'), 1)
+	]
+
+	pyboard.exit_raw_repl()
+	pyboard.close()
+
+	return results
+
+
+def main():
+	board = SimBoard(throttle=False, latency=0.001, window=256).start()
+
+	with tempfile.NamedTemporaryFile(delete=False) as file:
+		file.write(os.urandom(FILE_SIZE))
+
+	try:
+		titles = ['enter_raw_repl', 'exec_', f'exec_ {OUTPUT_SIZE}B out', f'fs_put {FILE_SIZE // 1024}KB']
+		print(f'{"read_until":<12}' + ''.join([f'{title:>18}' for title in titles]) + '  (ms)')
+		baseline = load_baseline(sys.argv[1] if len(sys.argv) > 1 else BASELINE_REV)
+
+		for name, pyboard_class in (('baseline', baseline), ('buffered', Pyboard)):
+			results = run(pyboard_class, board, file.name)
+			print(f'{name:<12}' + ''.join([f'{result * 1000:>18.1f}' for result in results]))
+	finally:
+		board.stop()
+		os.remove(file.name)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,258 @@
+"""
+The MIT License (MIT)
+Copyright © 2021 Walkline Wang (https://walkline.wang)
+Gitee: https://gitee.com/walkline/a-batch-tool
+
+使用模拟开发板（simboard.py）测试 Pyboard 常用操作和完整上传的耗时（仅支持 Linux/macOS），
+每项运行 --repeat 次取中位数，结果可以保存为 JSON 文件，并与其它版本保存的结果对比：
+
+	python benchmarks/bench_suite.py -o new.json
+	python benchmarks/bench_suite.py -o new.json -c old.json
+	python benchmarks/bench_suite.py -k fs_put,ab_bundle --baud 921600 --latency 2
+
+repl 终端的 Ctrl-U 上传无法在这里直接测试：miniterm 依赖 win32clipboard 和 Windows 控制台，只能在 Windows 上导入，
+而模拟开发板需要 pty，只能在 Linux/macOS 上运行，所以这里测试 Ctrl-U 使用的传输方式 fs_put_bundle
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT_DIR)
+
+from ab import __version__
+from ab.pyboard import Pyboard
+from simboard import SimBoard
+
+BENCHMARKS = {}
+FILE_SIZE = 16 * 1024
+OUTPUT_SIZE = 1024
+PROJECT_FILES = 20
+PROJECT_FILE_SIZE = 512
+
+
+def benchmark(name):
+	'''
+	注册一项测试，测试函数返回一次操作的耗时（秒）
+	'''
+	def decorator(function):
+		BENCHMARKS[name] = function
+		return function
+
+	return decorator
+
+def timeit(function, count):
+	start_time = time.perf_counter()
+
+	for _ in range(count):
+		function()
+
+	return (time.perf_counter() - start_time) / count
+
+
+class Context(object):
+	'''
+	所有测试共用的模拟开发板和临时文件夹
+	'''
+	def __init__(self, board, work_dir):
+		self.board = board
+		self.work_dir = work_dir
+		self.file = os.path.join(work_dir, 'bench.bin')
+		self.project = os.path.join(work_dir, 'project')
+
+		with open(self.file, 'wb') as file:
+			file.write(os.urandom(FILE_SIZE))
+
+		os.makedirs(os.path.join(self.project, 'lib'))
+
+		for index in range(PROJECT_FILES):
+			with open(os.path.join(self.project, 'lib', f'module{index}.py'), 'w') as file:
+				file.write(f'# module {index}\n' + 'x = 1\n' * ((PROJECT_FILE_SIZE - 12) // 6))
+
+		with open(os.path.join(self.project, 'main.py'), 'w') as file:
+			file.write('pass\n')
+
+		with open(os.path.join(self.project, 'abconfig'), 'w') as file:
+			file.write('lib/\nmain.py\n')
+
+	def open(self):
+		pyboard = Pyboard(self.board.device)
+		pyboard.enter_raw_repl(soft_reset=False)
+		return pyboard
+
+	def run_ab(self, *args):
+		'''
+		在测试项目中运行一次完整的 ab 命令，返回耗时，包括启动 Python 的时间
+		'''
+		env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.abspath(ROOT_DIR), os.environ.get('PYTHONPATH', '')]).rstrip(os.pathsep))
+		start_time = time.perf_counter()
+		result = subprocess.run(
+			[sys.executable, '-m', 'ab', '-p', self.board.device] + list(args) + ['abconfig'],
+			cwd=self.project,
+			env=env,
+			stdout=subprocess.DEVNULL,
+			stderr=subprocess.PIPE
+		)
+
+		if result.returncode:
+			raise RuntimeError(f'ab {" ".join(args)} failed\n{result.stderr.decode(errors="replace")}')
+
+		return time.perf_counter() - start_time
+
+
+@benchmark('enter_raw_repl')
+def bench_enter_raw_repl(context):
+	pyboard = context.open()
+
+	try:
+		return timeit(lambda: pyboard.enter_raw_repl(soft_reset=False), 20)
+	finally:
+		pyboard.close()
+
+@benchmark('enter_raw_repl_soft_reset')
+def bench_enter_raw_repl_soft_reset(context):
+	pyboard = context.open()
+
+	try:
+		return timeit(lambda: pyboard.enter_raw_repl(), 5)
+	finally:
+		pyboard.close()
+
+@benchmark('exec_')
+def bench_exec(context):
+	pyboard = context.open()
+
+	try:
+		return timeit(lambda: pyboard.exec_('pass'), 50)
+	finally:
+		pyboard.close()
+
+@benchmark(f'exec_{OUTPUT_SIZE}B_output')
+def bench_exec_output(context):
+	pyboard = context.open()
+
+	try:
+		return timeit(lambda: pyboard.exec_(f"print('x' * {OUTPUT_SIZE})"), 10)
+	finally:
+		pyboard.close()
+
+def bench_fs_put(encoding):
+	def function(context):
+		pyboard = context.open()
+
+		try:
+			return timeit(lambda: pyboard.fs_put(context.file, 'bench.bin', chunk_size=1536 if encoding == 'base64' else 256, encoding=encoding), 1)
+		finally:
+			pyboard.close()
+
+	return function
+
+benchmark(f'fs_put_base64_{FILE_SIZE // 1024}KB')(bench_fs_put('base64'))
+benchmark(f'fs_put_repr_{FILE_SIZE // 1024}KB')(bench_fs_put('repr'))
+
+@benchmark(f'fs_put_files_stream_{FILE_SIZE // 1024}KB')
+def bench_fs_put_files(context):
+	pyboard = context.open()
+
+	try:
+		return timeit(lambda: pyboard.fs_put_files([(context.file, 'bench.bin')]), 1)
+	finally:
+		pyboard.close()
+
+@benchmark(f'fs_put_bundle_{FILE_SIZE // 1024}KB')
+def bench_fs_put_bundle(context):
+	# the transfer used by ctrl-u in the repl terminal, see the module docstring
+	pyboard = context.open()
+
+	try:
+		return timeit(lambda: pyboard.fs_put_bundle([], [(context.file, 'bench.bin')]), 1)
+	finally:
+		pyboard.close()
+
+def bench_ab(transfer):
+	return lambda context: context.run_ab('-t', transfer)
+
+benchmark('ab_base64')(bench_ab('base64'))
+benchmark('ab_stream')(bench_ab('stream'))
+benchmark('ab_bundle')(bench_ab('bundle'))
+
+@benchmark('ab_sync_unchanged')
+def bench_ab_sync(context):
+	context.run_ab('-t', 'bundle')
+	return context.run_ab('-t', 'bundle', '--sync')
+
+
+def git_commit():
+	try:
+		return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def compare(results, baseline):
+	print(f'\n{"compared with " + (baseline.get("commit") or baseline["version"]):<36}{"old (ms)":>12}{"new (ms)":>12}{"change":>10}')
+
+	for name, result in results.items():
+		if name not in baseline['results']:
+			continue
+
+		old, new = baseline['results'][name]['median'], result['median']
+		print(f'{name:<36}{old * 1000:>12.1f}{new * 1000:>12.1f}{(new - old) / old * 100:>+9.1f}%')
+
+def main():
+	parser = argparse.ArgumentParser(description='benchmarks of ab on a simulated board')
+	parser.add_argument('-o', '--output', help='save results to this json file')
+	parser.add_argument('-c', '--compare', help='compare with results saved in this json file')
+	parser.add_argument('-k', '--only', help='run benchmarks whose names contain any of these comma separated words')
+	parser.add_argument('-r', '--repeat', type=int, default=3, help='runs of every benchmark, the median is reported')
+	parser.add_argument('--baud', type=int, default=115200, help='line rate of the simulated board, 0 for unlimited')
+	parser.add_argument('--latency', type=float, default=1, help='latency of every chunk received by the board in milliseconds')
+	parser.add_argument('--window', type=int, default=128, help='raw-paste window size of the simulated board')
+	args = parser.parse_args()
+
+	names = [name for name in BENCHMARKS if not args.only or any([word in name for word in args.only.split(',')])]
+	work_dir = tempfile.mkdtemp(prefix='ab_bench_')
+	board = SimBoard(os.path.join(work_dir, 'board'), args.baud or 115200, args.baud > 0, args.latency / 1000, args.window)
+	os.makedirs(board.root)
+	board.start()
+	results = {}
+
+	try:
+		context = Context(board, work_dir)
+		print(f'{"benchmark":<36}{"median (ms)":>12}{"min (ms)":>12}{"max (ms)":>12}')
+
+		for name in names:
+			runs = [BENCHMARKS[name](context) for _ in range(args.repeat)]
+			results[name] = {'median': statistics.median(runs), 'runs': runs}
+			print(f'{name:<36}{results[name]["median"] * 1000:>12.1f}{min(runs) * 1000:>12.1f}{max(runs) * 1000:>12.1f}')
+	finally:
+		board.stop()
+		shutil.rmtree(work_dir)
+
+	report = {
+		'version': __version__,
+		'commit': git_commit(),
+		'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+		'python': platform.python_version(),
+		'platform': sys.platform,
+		'board': {'baudrate': args.baud, 'latency': args.latency, 'window': args.window},
+		'results': results
+	}
+
+	if args.output:
+		with open(args.output, 'w') as file:
+			json.dump(report, file, indent=2)
+
+	if args.compare:
+		with open(args.compare) as file:
+			compare(results, json.load(file))
+
+
+if __name__ == '__main__':
+	main()
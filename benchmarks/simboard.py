@@ -0,0 +1,687 @@
+"""
+The MIT License (MIT)
+Copyright © 2021 Walkline Wang (https://walkline.wang)
+Gitee: https://gitee.com/walkline/a-batch-tool
+
+运行在 pty 上的模拟开发板（仅支持 Linux/macOS），实现了普通 REPL（回显、粘贴模式）、raw REPL、
+raw-paste 窗口协议和软复位，收到的代码由 CPython 执行，文件系统限制在指定的文件夹中。
+可以按波特率限制传输速度，并模拟 USB 转串口的延迟，用来在没有开发板时测试和对比 ab 的性能：
+
+	python benchmarks/simboard.py [--fs DIR] [--baud N] [--latency MS]
+	cd <项目文件夹> && python -m ab -p <第一行输出的设备路径> abconfig
+
+不指定 --fs 时使用新建的临时文件夹（第二行输出），--fs 不能是当前文件夹，
+否则 ab 上传时会覆盖正在读取的源文件
+
+也可以在其它脚本中使用：
+
+	board = SimBoard(latency=0.001).start()
+	pyboard = Pyboard(board.device)
+	...
+	board.stop()
+"""
+import argparse
+import binascii
+import builtins
+import collections
+import io
+import multiprocessing
+import os
+import pty
+import shutil
+import sys
+import tempfile
+import termios
+import threading
+import time
+import traceback
+import tty
+import types
+import zlib
+
+RAW_PROMPT = b'raw REPL; CTRL-B to exit\r\n>'
+FRIENDLY_BANNER = b'MicroPython v1.22.0 on 2024-01-01; simboard with ESP32\r\nType "help()" for more information.\r\n>>> '
+PASTE_BANNER = b'\r\npaste mode; Ctrl-C to cancel, Ctrl-D to finish\r\n=== '
+
+BAUD_CONSTANTS = {
+	getattr(termios, name): int(name[1:])
+	for name in dir(termios)
+	if name.startswith('B') and name[1:].isdigit()
+}
+
+
+class SoftReset(Exception):
+	pass
+
+
+class SimBoard(object):
+	'''
+	模拟开发板，pty 在创建时打开，start() 之后在独立的进程中运行解释器
+
+	- baudrate：开发板 REPL 串口的波特率，本地串口的波特率与它不同时收发的数据都会变成 0xff
+	- throttle：是否按波特率限制收发速度（每字节 10 位）
+	- latency：每次收到数据后额外的延迟（秒），模拟 USB 转串口按帧传输
+	- window：raw-paste 模式的窗口大小
+	- rxbuf：开发板接收缓冲区大小，来不及处理的数据会被丢弃并计入 overruns
+	'''
+	def __init__(self, root=None, baudrate=115200, throttle=True, latency=0.0, window=128, rxbuf=1024):
+		self._own_root = root is None
+		self.root = os.path.abspath(root or tempfile.mkdtemp(prefix='ab_simboard_'))
+		self.baudrate = baudrate
+		self.throttle = throttle
+		self.latency = latency
+		self.window = window
+		self.rxbuf = rxbuf
+		self.overruns = 0
+		self.kbd_intr = 3
+		self.executing = False
+		self.interrupted = False
+
+		self.master, self.slave = pty.openpty()
+		tty.setraw(self.slave)
+		self.device = os.ttyname(self.slave)
+
+		self._rx = collections.deque()
+		self._rx_cond = threading.Condition()
+		self._tx_lock = threading.Lock()
+		self._process = None
+		self.namespace = None
+		self.soft_reset()
+
+	def start(self):
+		self._process = multiprocessing.Process(target=self.run, daemon=True)
+		self._process.start()
+		return self
+
+	def stop(self):
+		if self._process:
+			self._process.terminate()
+			self._process.join()
+
+		if self._own_root:
+			shutil.rmtree(self.root, ignore_errors=True)
+
+	# 串口
+
+	def _byte_time(self, count):
+		return count * 10 / self.baudrate if self.throttle else 0
+
+	def _host_baudrate(self):
+		try:
+			return BAUD_CONSTANTS.get(termios.tcgetattr(self.slave)[4])
+		except termios.error:
+			return None
+
+	def _line_ok(self):
+		host = self._host_baudrate()
+		return host is None or host == self.baudrate
+
+	def _rx_thread(self):
+		while True:
+			try:
+				data = os.read(self.master, 4096)
+			except OSError:
+				os._exit(0)
+
+			if not data:
+				continue
+
+			time.sleep(self.latency + self._byte_time(len(data)))
+
+			if not self._line_ok():
+				data = b'\xff' * len(data)
+
+			if self.executing and self.kbd_intr == 3 and b'\x03' in data:
+				self.interrupted = True
+				data = data.replace(b'\x03', b'')
+
+			with self._rx_cond:
+				room = self.rxbuf - len(self._rx)
+
+				if len(data) > room:
+					self.overruns += len(data) - room
+					data = data[:room]
+
+				self._rx.extend(data)
+				self._rx_cond.notify_all()
+
+	def getc(self, timeout=None):
+		deadline = None if timeout is None else time.monotonic() + timeout
+
+		with self._rx_cond:
+			while not self._rx:
+				remain = None if deadline is None else deadline - time.monotonic()
+
+				if remain is not None and remain <= 0:
+					return None
+
+				self._rx_cond.wait(remain)
+
+			return bytes([self._rx.popleft()])
+
+	def read(self, count):
+		data = bytearray()
+
+		while len(data) < count:
+			data += self.getc()
+
+		return bytes(data)
+
+	def any(self):
+		with self._rx_cond:
+			return len(self._rx)
+
+	def write(self, data):
+		if isinstance(data, str):
+			data = data.encode()
+
+		if not data:
+			return
+
+		with self._tx_lock:
+			time.sleep(self._byte_time(len(data)))
+
+			if not self._line_ok():
+				data = b'\xff' * len(data)
+
+			os.write(self.master, data)
+
+	# 解释器
+
+	def sleep(self, seconds):
+		'''
+		time.sleep() 期间可以被 Ctrl-C 中断
+		'''
+		deadline = time.monotonic() + seconds
+
+		while True:
+			if self.interrupted:
+				self.interrupted = False
+				raise KeyboardInterrupt
+
+			remain = deadline - time.monotonic()
+
+			if remain <= 0:
+				return
+
+			time.sleep(min(remain, 0.01))
+
+	def run_main(self):
+		for name in ('boot.py', 'main.py'):
+			if os.path.exists(self.path(name)):
+				with open(self.path(name), 'rb') as file:
+					self.execute(file.read(), echo_errors=True)
+
+	def soft_reset(self):
+		self.kbd_intr = 3
+		self.namespace = {'__name__': '__main__'}
+
+	def run(self):
+		threading.Thread(target=self._rx_thread, daemon=True).start()
+		mode = self.friendly_repl
+
+		while True:
+			try:
+				mode = mode()
+			except SoftReset:
+				self.soft_reset()
+				mode = self.friendly_repl
+
+	def friendly_repl(self):
+		self.write(b'\r\n>>> ')
+		line = bytearray()
+
+		while True:
+			c = self.getc()
+
+			if c == b'\x01':
+				self.write(b'\r\n' + RAW_PROMPT)
+				return self.raw_repl
+			elif c == b'\x02':
+				self.write(b'\r\n' + FRIENDLY_BANNER)
+				line.clear()
+			elif c == b'\x03':
+				self.write(b'\r\n>>> ')
+				line.clear()
+			elif c == b'\x04':
+				if not line:
+					self.write(b'\r\nMPY: soft reboot\r\n')
+					self.soft_reset()
+					self.run_main()
+					self.write(FRIENDLY_BANNER)
+			elif c == b'\x05':
+				return self.paste_mode
+			elif c in (b'\r', b'\n'):
+				self.write(b'\r\n')
+
+				if line:
+					self.execute(bytes(line), echo_errors=True)
+					line.clear()
+
+				self.write(b'>>> ')
+			else:
+				line += c
+				self.write(c)
+
+	def paste_mode(self):
+		self.write(PASTE_BANNER)
+		code = bytearray()
+
+		while True:
+			c = self.getc()
+
+			if c == b'\x03':
+				return self.friendly_repl
+			elif c == b'\x04':
+				self.write(b'\r\n')
+				self.execute(bytes(code), echo_errors=True)
+				return self.friendly_repl
+			elif c == b'\r':
+				code += b'\n'
+				self.write(b'\r\n=== ')
+			elif c == b'\n':
+				continue
+			else:
+				code += c
+				self.write(c)
+
+	def raw_repl(self):
+		code = bytearray()
+
+		while True:
+			c = self.getc()
+
+			if c == b'\x02':
+				self.write(b'\r\n' + FRIENDLY_BANNER)
+				return self.friendly_repl
+			elif c == b'\x01':
+				self.write(b'\r\n' + RAW_PROMPT)
+				code.clear()
+			elif c == b'\x03':
+				code.clear()
+			elif c == b'\x05' and not code:
+				if self.read(2) == b'A\x01':
+					self.write(b'R\x01' + bytes([self.window & 0xff, self.window >> 8]))
+					self.run_raw(self.raw_paste_receive(), ok=False)
+				else:
+					self.write(b'R\x00')
+			elif c == b'\x04':
+				if not code:
+					self.write(b'OK\r\nMPY: soft reboot\r\n')
+					self.soft_reset()
+					self.write(RAW_PROMPT)
+					continue
+
+				self.run_raw(bytes(code), ok=True)
+				code.clear()
+			else:
+				code += c
+
+	def raw_paste_receive(self):
+		code = bytearray()
+		remain = self.window
+
+		while True:
+			c = self.getc()
+
+			if c == b'\x04':
+				self.write(b'\x04')
+				return bytes(code)
+
+			if c == b'\x03':
+				# like the firmware, ctrl-c aborts the paste with a KeyboardInterrupt
+				self.write(b'\x04')
+				return None
+
+			code += c
+			remain -= 1
+
+			if remain == 0:
+				remain = self.window
+				self.write(b'\x01')
+
+	def run_raw(self, code, ok):
+		if ok:
+			self.write(b'OK')
+
+		error = b'KeyboardInterrupt: \r\n' if code is None else self.execute(code)
+		self.write(b'\x04' + error + b'\x04' + b'>')
+
+	def execute(self, code, echo_errors=False):
+		'''
+		执行代码，返回错误信息，echo_errors 为 True 时直接输出错误信息（普通 REPL）
+		'''
+		output = BoardStream(self)
+		self.executing = True
+		self.interrupted = False
+
+		try:
+			compiled = compile(code.decode(), '<stdin>', 'exec')
+
+			with SandboxedBuiltins(self, output):
+				exec(compiled, self.namespace)
+		except SoftReset:
+			raise
+		except BaseException as e:
+			lines = ['Traceback (most recent call last):']
+
+			for frame in traceback.extract_tb(e.__traceback__):
+				if frame.filename == '<stdin>':
+					lines.append(f'  File "<stdin>", line {frame.lineno}, in {frame.name}')
+
+			lines.append(f'{type(e).__name__}: {e}' if str(e) else type(e).__name__)
+			error = ('\r\n'.join(lines) + '\r\n').encode()
+
+			if echo_errors:
+				self.write(error)
+				return b''
+
+			return error
+		finally:
+			self.executing = False
+
+		return b''
+
+	# 文件系统
+
+	def path(self, path):
+		'''
+		把开发板上的路径转换为 root 中的路径，不允许访问 root 以外的文件
+		'''
+		path = str(path)
+
+		if not path.startswith('/'):
+			path = '/' + path
+
+		full = os.path.normpath(os.path.join(self.root, path.lstrip('/')))
+
+		if not (full + os.sep).startswith(self.root + os.sep):
+			raise OSError(2, 'ENOENT')
+
+		return full
+
+
+class BoardStream(object):
+	def __init__(self, board):
+		self.board = board
+
+	def write(self, data):
+		if isinstance(data, str):
+			data = data.encode()
+
+		self.board.write(bytes(data).replace(b'\n', b'\r\n'))
+		return len(data)
+
+	def flush(self):
+		pass
+
+
+class BoardStdin(object):
+	def __init__(self, board):
+		self.board = board
+		self.buffer = self
+
+	def read(self, count=1):
+		return self.board.read(count)
+
+	def readinto(self, buffer, count=None):
+		count = len(buffer) if count is None else count
+		buffer[:count] = self.board.read(count)
+		return count
+
+	def readline(self):
+		line = bytearray()
+
+		while not line.endswith(b'\r'):
+			c = self.board.getc()
+			self.board.write(c)
+			line += c
+
+		self.board.write(b'\n')
+		return line.decode()[:-1] + '\n'
+
+
+class SandboxedBuiltins(object):
+	'''
+	执行代码期间替换 import、open、print 和 input，使用 MicroPython 风格的模块和受限的文件系统
+	'''
+	def __init__(self, board, output):
+		self.board = board
+		self.output = output
+		self.modules = make_modules(board, output)
+
+	def __enter__(self):
+		self.saved = {}
+		board = self.board
+		real_import = builtins.__import__
+		real_open = io.open
+		modules = self.modules
+
+		def sim_import(name, globals=None, locals=None, fromlist=(), level=0):
+			if name in modules:
+				return modules[name]
+
+			return real_import(name, globals, locals, fromlist, level)
+
+		def sim_open(path, mode='r', *args, **kwargs):
+			return real_open(board.path(path), mode, *args, **kwargs)
+
+		def sim_print(*args, sep=' ', end='\n', file=None):
+			(file or self.output).write(sep.join([str(arg) for arg in args]) + end)
+
+		def sim_input(prompt=''):
+			self.output.write(prompt)
+			return modules['sys'].stdin.readline().rstrip('\n')
+
+		for name, value in (('__import__', sim_import), ('open', sim_open), ('print', sim_print), ('input', sim_input)):
+			self.saved[name] = getattr(builtins, name)
+			setattr(builtins, name, value)
+
+		return self
+
+	def __exit__(self, *args):
+		for name, value in self.saved.items():
+			setattr(builtins, name, value)
+
+
+class BoardOSError(OSError):
+	'''
+	与 MicroPython 相同，显示为 [Errno 2] ENOENT
+	'''
+	STRINGS = {2: 'ENOENT', 17: 'EEXIST'}
+
+	def __str__(self):
+		return f'[Errno {self.args[0]}] {self.STRINGS.get(self.args[0], "")}'
+
+
+def board_errors(function):
+	def wrapper(*args):
+		try:
+			return function(*args)
+		except FileExistsError:
+			raise BoardOSError(17, 'EEXIST') from None
+		except (FileNotFoundError, NotADirectoryError):
+			raise BoardOSError(2, 'ENOENT') from None
+		except OSError as e:
+			raise BoardOSError(e.errno or 5, '') from None
+
+	return wrapper
+
+def make_modules(board, output):
+	import gc
+	import hashlib
+	import json
+
+	def module(name, **attrs):
+		result = types.ModuleType(name)
+		result.__dict__.update(attrs)
+		return result
+
+	stdin = BoardStdin(board)
+
+	sys_module = module(
+		'sys', stdin=stdin, stdout=output, stderr=output, platform='esp32',
+		implementation=types.SimpleNamespace(name='micropython', version=(1, 22, 0)),
+		print_exception=lambda e, file=output: file.write(f'{type(e).__name__}: {e}\n'),
+		exit=sys.exit, path=['', '/lib'], modules={}, argv=[], maxsize=sys.maxsize
+	)
+
+	def ilistdir(path='/'):
+		for entry in os.scandir(board.path(path)):
+			yield (entry.name, 0x4000 if entry.is_dir() else 0x8000, 0, entry.stat().st_size if entry.is_file() else 0)
+
+	def stat(path):
+		full = board.path(path)
+		return (0x4000 if os.path.isdir(full) else 0x8000, 0, 0, 0, 0, 0, os.stat(full).st_size, 0, 0, 0)
+
+	os_module = module(
+		'os',
+		listdir=board_errors(lambda path='/': sorted(os.listdir(board.path(path)))),
+		ilistdir=board_errors(ilistdir),
+		stat=board_errors(stat),
+		mkdir=board_errors(lambda path: os.mkdir(board.path(path))),
+		remove=board_errors(lambda path: os.remove(board.path(path))),
+		rmdir=board_errors(lambda path: os.rmdir(board.path(path))),
+		rename=board_errors(lambda old, new: os.replace(board.path(old), board.path(new))),
+		getcwd=lambda: '/',
+		statvfs=lambda path='/': (4096, 4096, 512, 256, 256, 0, 0, 0, 0, 255),
+		sync=lambda: None
+	)
+
+	start_time = time.monotonic()
+	time_module = module(
+		'time',
+		sleep=lambda seconds: board.sleep(seconds),
+		sleep_ms=lambda ms: board.sleep(ms / 1000),
+		sleep_us=lambda us: board.sleep(us / 1000000),
+		ticks_ms=lambda: int((time.monotonic() - start_time) * 1000),
+		ticks_us=lambda: int((time.monotonic() - start_time) * 1000000),
+		ticks_diff=lambda new, old: new - old,
+		time=time.time
+	)
+
+	def kbd_intr(char):
+		board.kbd_intr = char
+
+	micropython_module = module(
+		'micropython', kbd_intr=kbd_intr, const=lambda value: value,
+		native=lambda function: function, viper=lambda function: function, mem_info=lambda *args: None
+	)
+
+	class UART(object):
+		'''
+		初始化 UART0 时切换开发板 REPL 的波特率
+		'''
+		def __init__(self, uart_id, baudrate=None, **kwargs):
+			self.uart_id = uart_id
+			self.init(baudrate)
+
+		def init(self, baudrate=None, **kwargs):
+			if self.uart_id == 0 and baudrate:
+				board.baudrate = baudrate
+
+	def reset():
+		raise SoftReset()
+
+	machine_module = module(
+		'machine', UART=UART, reset=reset, soft_reset=reset,
+		unique_id=lambda: b'\x5a\x1b\x0a\x4d' + board.device.encode()[-2:],
+		freq=lambda *args: 240000000
+	)
+
+	class Poll(object):
+		def register(self, obj, mask=1):
+			pass
+
+		def poll(self, timeout=-1):
+			deadline = None if timeout < 0 else time.monotonic() + timeout / 1000
+
+			while not board.any():
+				if deadline is not None and time.monotonic() >= deadline:
+					return []
+
+				time.sleep(0.001)
+
+			return [(stdin, 1)]
+
+		ipoll = poll
+
+	select_module = module('select', poll=Poll, POLLIN=1)
+
+	class DecompIO(object):
+		def __init__(self, stream, wbits=0, *args):
+			self.stream = stream
+			self.decompressor = zlib.decompressobj(wbits or 15)
+			self.pending = b''
+
+		def read(self, count=-1):
+			while count < 0 or len(self.pending) < count:
+				chunk = self.stream.read(256)
+
+				if not chunk:
+					self.pending += self.decompressor.flush()
+					break
+
+				self.pending += self.decompressor.decompress(chunk)
+
+				if self.decompressor.eof:
+					break
+
+			if count < 0:
+				count = len(self.pending)
+
+			data, self.pending = self.pending[:count], self.pending[count:]
+			return data
+
+		def readinto(self, buffer):
+			data = self.read(len(buffer))
+			buffer[:len(data)] = data
+			return len(data)
+
+	def DeflateIO(stream, format=0, wbits=0, close=False):
+		# AUTO, RAW, ZLIB, GZIP
+		bits = wbits or 15
+		bits = [bits + 32, -bits, bits, bits + 16][format]
+		return DecompIO(stream, bits)
+
+	zlib_module = module('zlib', DecompIO=DecompIO, decompress=zlib.decompress)
+	deflate_module = module('deflate', DeflateIO=DeflateIO, AUTO=0, RAW=1, ZLIB=2, GZIP=3)
+	gc_module = module('gc', collect=gc.collect, mem_free=lambda: 100000, mem_alloc=lambda: 20000)
+
+	return {
+		'sys': sys_module, 'os': os_module, 'uos': os_module,
+		'time': time_module, 'utime': time_module,
+		'micropython': micropython_module, 'machine': machine_module,
+		'select': select_module, 'uselect': select_module,
+		'zlib': zlib_module, 'deflate': deflate_module,
+		'binascii': binascii, 'ubinascii': binascii,
+		'hashlib': hashlib, 'uhashlib': hashlib,
+		'json': json, 'ujson': json, 'io': io, 'uio': io,
+		'gc': gc_module
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser(description='simulated MicroPython board on a pty')
+	parser.add_argument('--fs', help='directory used as the board filesystem, a new temp directory by default')
+	parser.add_argument('--baud', type=int, default=115200, help='line rate to throttle to, 0 for unlimited')
+	parser.add_argument('--latency', type=float, default=0, help='extra latency of every received chunk in milliseconds')
+	parser.add_argument('--window', type=int, default=128, help='raw-paste window size')
+	parser.add_argument('--rxbuf', type=int, default=1024, help='board rx buffer size in bytes')
+	args = parser.parse_args()
+
+	if args.fs is None:
+		args.fs = tempfile.mkdtemp(prefix='simboard-')
+	elif os.path.realpath(args.fs) == os.path.realpath(os.getcwd()):
+		# uploading from here would truncate the files while they are being read
+		parser.error('--fs must not be the current directory')
+
+	os.makedirs(args.fs, exist_ok=True)
+	board = SimBoard(args.fs, args.baud or 115200, args.baud > 0, args.latency / 1000, args.window, args.rxbuf)
+	print(board.device, flush=True)
+	print(args.fs, flush=True)
+	board.run()
+
+
+if __name__ == '__main__':
+	main()